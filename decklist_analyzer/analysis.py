@@ -0,0 +1,328 @@
+import asyncio
+import hashlib
+import json
+import time
+
+from decklist_analyzer.utils.analyzer import Analyzer
+from decklist_analyzer.utils.card_classifier import RULES_FINGERPRINT
+from decklist_analyzer.utils.decklist_parser import DecklistParser
+from decklist_analyzer.utils.metrics import ANALYSES, ANALYSIS_DURATION
+from decklist_analyzer.utils.timing import count, timed
+
+
+def parse_decklist(decklist):
+    """
+    Parses a decklist.
+
+    Args:
+        decklist (str | iterable): The raw decklist, with any line endings, or
+            an iterator of its lines.
+
+    Returns:
+        dict: A dictionary containing the parsed decklist data.
+    """
+    with timed('parse'):
+        return DecklistParser(decklist).parse_decklist()
+
+
+def analyze_decklist(decklist, fetcher=None):
+    """
+    Parses and analyzes a decklist.
+
+    Args:
+        decklist (str): The raw decklist, with any line endings.
+        fetcher (CardDataFetcher): The fetcher used to look up card data.
+
+    Returns:
+        tuple: The parsed decklist and the Analyzer that analyzed it.
+    """
+    parsed_decklist = parse_decklist(decklist)
+    analyzer = _run_analyzer(parsed_decklist, fetcher)
+    return parsed_decklist, analyzer
+
+
+def get_analysis(decklist, fetcher=None, result_cache=None, previous=None):
+    """
+    Parses and analyzes a decklist, reusing the cached statistics of an
+    identical decklist when there are some.
+
+    The statistics are cached under the fingerprint of the decklist, which
+    includes the version of the classification rules and of the card data,
+    so they are recomputed once either changes. Cached statistics are shared
+    between callers and must not be modified.
+
+    When the state of a previous analysis is given, typically of the same
+    decklist before a few of its lines were edited, its statistics are
+    updated for the changed cards instead of analyzing the decklist from
+    scratch.
+
+    Args:
+        decklist (str): The raw decklist, with any line endings.
+        fetcher (CardDataFetcher): The fetcher used to look up card data.
+        result_cache (CardCache): An optional cache of decklist statistics.
+        previous (dict): The state of a previous analysis, as returned by
+            analysis_state().
+
+    Returns:
+        dict: The statistics of the decklist, with JSON-serializable values.
+    """
+    start = time.perf_counter()
+    try:
+        result = _get_analysis(decklist, fetcher, result_cache, previous)
+    except Exception:
+        ANALYSES.inc(outcome='error')
+        raise
+
+    ANALYSES.inc(outcome='ok')
+    ANALYSIS_DURATION.observe(time.perf_counter() - start)
+    return result
+
+
+async def aget_analysis(
+    decklist, fetcher=None, result_cache=None, previous=None
+):
+    """
+    Parses and analyzes a decklist like get_analysis() does, awaiting the
+    card data instead of blocking while it is fetched.
+
+    Args:
+        decklist (str): The raw decklist, with any line endings.
+        fetcher (CardDataFetcher): The fetcher used to look up card data.
+        result_cache (CardCache): An optional cache of decklist statistics.
+        previous (dict): The state of a previous analysis, as returned by
+            analysis_state().
+
+    Returns:
+        dict: The statistics of the decklist, with JSON-serializable values.
+    """
+    start = time.perf_counter()
+    try:
+        result = await _aget_analysis(
+            decklist, fetcher, result_cache, previous
+        )
+    except Exception:
+        ANALYSES.inc(outcome='error')
+        raise
+
+    ANALYSES.inc(outcome='ok')
+    ANALYSIS_DURATION.observe(time.perf_counter() - start)
+    return result
+
+
+def analysis_state(decklist, result, fetcher=None):
+    """
+    Returns the state of an analysis to be given to the next analysis of the
+    same user, e.g. stored in their session.
+
+    Args:
+        decklist (str): The raw decklist that was analyzed.
+        result (dict): The statistics of the decklist.
+        fetcher (CardDataFetcher): The fetcher used to look up card data.
+
+    Returns:
+        dict: The decklist, its statistics and the version of the rules and
+              card data that computed them, with JSON-serializable values.
+    """
+    return {
+        'decklist': decklist,
+        'result': result,
+        'version': _analysis_version(fetcher),
+    }
+
+
+def diff_decklists(previous_decklist, parsed_decklist):
+    """
+    Returns the maindeck cards whose copies differ between two parsed
+    decklists.
+
+    Args:
+        previous_decklist (dict): The previous parsed decklist.
+        parsed_decklist (dict): The new parsed decklist.
+
+    Returns:
+        list: The removed and changed cards in the order of the previous
+              decklist, followed by the added cards.
+    """
+    maindeck = previous_decklist['deck']
+    new_maindeck = parsed_decklist['deck']
+    return [
+        card
+        for card, card_info_list in maindeck.items()
+        if new_maindeck.get(card) != card_info_list
+    ] + [card for card in new_maindeck if card not in maindeck]
+
+
+def decklist_fingerprint(parsed_decklist, data_version=''):
+    """
+    Computes a fingerprint of a parsed decklist that does not depend on the
+    order of its cards and of their printings.
+
+    Args:
+        parsed_decklist (dict): A dictionary containing the parsed decklist data.
+        data_version (str): The version of the card data used for the analysis.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical decklist, the
+             classification rules and the card data version.
+    """
+    # Sort the cards of each section, and sum the quantities of each of their
+    # printings, since the rarity of a printing can change the statistics
+    canonical_decklist = {}
+    for section, cards in sorted(parsed_decklist.items()):
+        canonical_cards = []
+        for card, printings in cards.items():
+            quantities = {}
+            for printing in printings:
+                key = (printing['set_code'] or '', printing['card_set_id'] or '')
+                quantities[key] = quantities.get(key, 0) + printing['quantity']
+            canonical_cards.append((card, sorted(quantities.items())))
+        canonical_decklist[section] = sorted(canonical_cards)
+
+    payload = json.dumps(
+        [canonical_decklist, RULES_FINGERPRINT, data_version],
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def serialize_analysis(parsed_decklist, analyzer):
+    """
+    Collects the statistics of an analyzed decklist.
+
+    Args:
+        parsed_decklist (dict): A dictionary containing the parsed decklist data.
+        analyzer (Analyzer): The Analyzer that analyzed the decklist.
+
+    Returns:
+        dict: The statistics of the decklist, with JSON-serializable values.
+    """
+    return {
+        'companion_count': len(parsed_decklist['companion']),
+        'companion': list(parsed_decklist['companion'].keys()),
+        'card_count': analyzer.card_count,
+        'non_land_count': analyzer.non_land_count,
+        'non_land_cmcs_count': analyzer.non_land_cmcs_count,
+        'cheap_card_draw_count': analyzer.cheap_card_draw_count,
+        'cheap_card_draw_list': analyzer.cheap_card_draw_list,
+        'cheap_card_scry_count': analyzer.cheap_card_scry_count,
+        'cheap_card_scry_list': analyzer.cheap_card_scry_list,
+        'cheap_mana_ramp_count': analyzer.cheap_mana_ramp_count,
+        'cheap_mana_ramp_list': analyzer.cheap_mana_ramp_list,
+        'non_mythic_land_spell_mdfc_count': analyzer.non_mythic_land_spell_mdfc_count,
+        'non_mythic_land_spell_mdfc_list': analyzer.non_mythic_land_spell_mdfc_list,
+        'mythic_land_spell_mdfc_count': analyzer.mythic_land_spell_mdfc_count,
+        'mythic_land_spell_mdfc_list': analyzer.mythic_land_spell_mdfc_list,
+        'average_cmc': analyzer.average_cmc,
+        'recommended_number_of_lands': analyzer.recommended_number_of_lands,
+    }
+
+
+def _get_analysis(decklist, fetcher, result_cache, previous):
+    parsed_decklist = parse_decklist(decklist)
+    if result_cache is None:
+        analyzer = _run_analyzer(parsed_decklist, fetcher, previous)
+        return serialize_analysis(parsed_decklist, analyzer)
+
+    data_version = fetcher.data_version if fetcher is not None else ''
+    key = decklist_fingerprint(parsed_decklist, data_version)
+    result = result_cache.get(key)
+    if result is None:
+        analyzer = _run_analyzer(parsed_decklist, fetcher, previous)
+        result = serialize_analysis(parsed_decklist, analyzer)
+        result_cache.set(key, result)
+    else:
+        count('analysis_cache_hits')
+        count('card_count', result['card_count'])
+    return result
+
+
+async def _aget_analysis(decklist, fetcher, result_cache, previous):
+    parsed_decklist = parse_decklist(decklist)
+    if result_cache is None:
+        analyzer = await _arun_analyzer(parsed_decklist, fetcher, previous)
+        return serialize_analysis(parsed_decklist, analyzer)
+
+    # The cache backend may be a database, which is only used from threads
+    data_version = fetcher.data_version if fetcher is not None else ''
+    key = decklist_fingerprint(parsed_decklist, data_version)
+    result = await asyncio.to_thread(result_cache.get, key)
+    if result is None:
+        analyzer = await _arun_analyzer(parsed_decklist, fetcher, previous)
+        result = serialize_analysis(parsed_decklist, analyzer)
+        await asyncio.to_thread(result_cache.set, key, result)
+    else:
+        count('analysis_cache_hits')
+        count('card_count', result['card_count'])
+    return result
+
+
+def _run_analyzer(parsed_decklist, fetcher, previous=None):
+    # The fetch phase is timed by the fetcher, inside the analyze phase
+    with timed('analyze'):
+        analyzer, changed_cards = _previous_analyzer(
+            parsed_decklist, fetcher, previous
+        )
+        if analyzer is None:
+            analyzer = Analyzer(parsed_decklist, fetcher=fetcher)
+            analyzer.analyze_decklist()
+        else:
+            analyzer.update_decklist(parsed_decklist, changed_cards)
+    count('card_count', analyzer.card_count)
+    return analyzer
+
+
+async def _arun_analyzer(parsed_decklist, fetcher, previous=None):
+    with timed('analyze'):
+        analyzer, changed_cards = _previous_analyzer(
+            parsed_decklist, fetcher, previous
+        )
+        if analyzer is None:
+            analyzer = Analyzer(parsed_decklist, fetcher=fetcher)
+            await analyzer.aanalyze_decklist()
+        else:
+            await analyzer.aupdate_decklist(parsed_decklist, changed_cards)
+    count('card_count', analyzer.card_count)
+    return analyzer
+
+
+def _previous_analyzer(parsed_decklist, fetcher, previous):
+    """
+    Restores the Analyzer of a previous analysis, when its statistics can be
+    updated for a new decklist.
+
+    Args:
+        parsed_decklist (dict): The new parsed decklist.
+        fetcher (CardDataFetcher): The fetcher used to look up card data.
+        previous (dict): The state of the previous analysis, or None.
+
+    Returns:
+        tuple: The Analyzer of the previous decklist and the changed cards,
+               or (None, None) if the decklist must be analyzed from scratch.
+    """
+    # Statistics computed by other rules or card data cannot be updated
+    if not previous or previous.get('version') != _analysis_version(fetcher):
+        return None, None
+
+    try:
+        previous_decklist = DecklistParser(
+            previous['decklist']
+        ).parse_decklist()
+    except (ValueError, AttributeError, KeyError, IndexError):
+        return None, None
+
+    # Updating costs twice the lookups of the changed cards, so a decklist
+    # with many changes is analyzed from scratch
+    changed_cards = diff_decklists(previous_decklist, parsed_decklist)
+    if 2 * len(changed_cards) > len(parsed_decklist['deck']):
+        return None, None
+
+    count('changed_cards', len(changed_cards))
+    analyzer = Analyzer.from_analysis(
+        previous_decklist, previous['result'], fetcher=fetcher
+    )
+    return analyzer, changed_cards
+
+
+def _analysis_version(fetcher):
+    data_version = fetcher.data_version if fetcher is not None else ''
+    return f'{RULES_FINGERPRINT}:{data_version}'
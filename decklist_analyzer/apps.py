@@ -1,6 +1,33 @@
+import atexit
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DecklistAnalyzerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'decklist_analyzer'
+
+    def ready(self):
+        from decklist_analyzer.utils.metrics import REGISTRY
+
+        REGISTRY.set_directory(getattr(settings, 'METRICS_DIR', None))
+
+        # Start warm from the snapshot written by warm_card_cache or by the
+        # previous workers, and leave the cards of this worker to the next ones
+        if getattr(settings, 'CARD_CACHE', {}).get('SNAPSHOT'):
+            from decklist_analyzer.card_data import (
+                dump_card_cache_snapshot,
+                restore_card_cache_snapshot,
+            )
+
+            restore_card_cache_snapshot()
+            atexit.register(_dump_quietly, dump_card_cache_snapshot)
+
+
+def _dump_quietly(dump):
+    # A snapshot that cannot be written leaves the previous one in place
+    try:
+        dump()
+    except OSError:
+        pass
@@ -0,0 +1,316 @@
+import os
+import pickle
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from decklist_analyzer.utils.card_cache import CardCache
+from decklist_analyzer.utils.card_data_fetcher import CardDataFetcher
+from decklist_analyzer.utils.card_store import CardStore
+from decklist_analyzer.utils.circuit_breaker import OPEN, CircuitBreaker
+from decklist_analyzer.utils.color_requirements import (
+    DECK_SIZES,
+    SourceTables,
+)
+from decklist_analyzer.utils.metrics import REGISTRY
+from decklist_analyzer.utils.rate_limiter import RateLimiter
+from decklist_analyzer.utils.single_flight import SingleFlight
+
+_card_store = None
+_card_cache = None
+_card_cache_lock = threading.Lock()
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+_not_found_cache = None
+_not_found_cache_lock = threading.Lock()
+_card_data_fetcher = None
+_card_data_fetcher_lock = threading.Lock()
+_circuit_breaker = None
+_source_tables = None
+_source_tables_lock = threading.Lock()
+
+
+def get_card_store():
+    """
+    Returns the process-wide CardStore configured by the CARD_STORE_PATH setting.
+
+    Returns:
+        CardStore: The local card store, or None if it has not been ingested yet.
+    """
+    global _card_store
+
+    path = getattr(settings, 'CARD_STORE_PATH', None)
+    if not path:
+        return None
+
+    if _card_store is None or _card_store.path != str(path):
+        _card_store = CardStore(path)
+
+    if not _card_store.exists():
+        return None
+    return _card_store
+
+
+def get_card_cache():
+    """
+    Returns the process-wide CardCache configured by the CARD_CACHE setting.
+
+    The CARD_CACHE setting is a dictionary with the optional keys MAX_ENTRIES,
+    MAX_BYTES, TTL (in seconds), STALE_TTL (the seconds an expired card is
+    still served while it is requested again), BACKEND (the alias of a
+    Django cache used to share cards between worker processes) and SNAPSHOT
+    (the path of the snapshot file restored when a worker starts).
+
+    Returns:
+        CardCache: The card cache shared by every analysis in this process.
+    """
+    global _card_cache
+
+    if _card_cache is None:
+        with _card_cache_lock:
+            if _card_cache is None:
+                options = getattr(settings, 'CARD_CACHE', {})
+                backend = options.get('BACKEND')
+                _card_cache = CardCache(
+                    max_entries=options.get('MAX_ENTRIES'),
+                    max_bytes=options.get('MAX_BYTES'),
+                    ttl=options.get('TTL'),
+                    backend=caches[backend] if backend else None,
+                    stale_ttl=options.get('STALE_TTL'),
+                )
+                _register_cache_metrics('card_cache', _card_cache)
+    return _card_cache
+
+
+def restore_card_cache_snapshot():
+    """
+    Restores the snapshot file configured by the SNAPSHOT key of the
+    CARD_CACHE setting into the process-wide card cache.
+
+    A missing or unreadable snapshot only leaves the cache cold, so that it
+    never prevents a worker from starting.
+
+    Returns:
+        int: The number of cards restored.
+    """
+    path = getattr(settings, 'CARD_CACHE', {}).get('SNAPSHOT')
+    if not path or not os.path.exists(path):
+        return 0
+
+    try:
+        return get_card_cache().load(path)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return 0
+
+
+def dump_card_cache_snapshot(path=None):
+    """
+    Writes the process-wide card cache to a snapshot file, so that the next
+    workers start with the cards of the recent traffic.
+
+    Args:
+        path (str): The path of the snapshot file. Defaults to the SNAPSHOT
+            key of the CARD_CACHE setting.
+
+    Returns:
+        int: The number of cards written.
+    """
+    path = path or getattr(settings, 'CARD_CACHE', {}).get('SNAPSHOT')
+    if not path or _card_cache is None or not len(_card_cache):
+        return 0
+    return _card_cache.dump(path)
+
+
+def get_analysis_cache():
+    """
+    Returns the process-wide cache of decklist statistics configured by the
+    ANALYSIS_CACHE setting.
+
+    The ANALYSIS_CACHE setting is a dictionary with the optional keys
+    MAX_ENTRIES, TTL (in seconds) and BACKEND, like the CARD_CACHE setting.
+
+    Returns:
+        CardCache: The cache of the statistics of analyzed decklists.
+    """
+    global _analysis_cache
+
+    if _analysis_cache is None:
+        with _analysis_cache_lock:
+            if _analysis_cache is None:
+                options = getattr(settings, 'ANALYSIS_CACHE', {})
+                backend = options.get('BACKEND')
+                _analysis_cache = CardCache(
+                    max_entries=options.get('MAX_ENTRIES'),
+                    ttl=options.get('TTL'),
+                    backend=caches[backend] if backend else None,
+                    namespace='analysis',
+                )
+                _register_cache_metrics('analysis_cache', _analysis_cache)
+    return _analysis_cache
+
+
+def get_not_found_cache():
+    """
+    Returns the process-wide cache of the cards not found by Scryfall,
+    configured by the NOT_FOUND_CACHE setting.
+
+    The NOT_FOUND_CACHE setting is a dictionary with the optional keys
+    MAX_ENTRIES, TTL (in seconds) and BACKEND, like the CARD_CACHE setting.
+
+    Returns:
+        CardCache: The cache of the names of the cards not found.
+    """
+    global _not_found_cache
+
+    if _not_found_cache is None:
+        with _not_found_cache_lock:
+            if _not_found_cache is None:
+                options = getattr(settings, 'NOT_FOUND_CACHE', {})
+                backend = options.get('BACKEND')
+                _not_found_cache = CardCache(
+                    max_entries=options.get('MAX_ENTRIES'),
+                    ttl=options.get('TTL', CardDataFetcher.NOT_FOUND_TTL),
+                    backend=caches[backend] if backend else None,
+                    namespace='not_found',
+                )
+                _register_cache_metrics('not_found_cache', _not_found_cache)
+    return _not_found_cache
+
+
+def get_card_data_fetcher():
+    """
+    Returns the process-wide CardDataFetcher, backed by the shared card cache,
+    the shared cache of the cards not found and the local card store, if
+    there is one.
+
+    The CARD_DATA_FETCHER setting is a dictionary with the optional keys
+    LOOKUP ('collection' or 'named'), MAX_WORKERS, MAX_ASYNC_REQUESTS,
+    REQUEST_INTERVAL and REQUEST_BURST (of the rate limiter), MAX_RETRIES,
+    RETRY_BACKOFF, MAX_RETRY_DELAY, RETRY_DEADLINE and TIMEOUT (in seconds),
+    FAILURE_THRESHOLD and RESET_TIMEOUT (of the circuit breaker shared by the
+    fetchers of the process), and
+    LOCK_BACKEND (the alias of a Django cache used to coalesce the lookups
+    of the same cards between worker processes).
+
+    Returns:
+        CardDataFetcher: The fetcher to be used by the Analyzer.
+    """
+    global _card_data_fetcher, _circuit_breaker
+
+    card_store = get_card_store()
+    with _card_data_fetcher_lock:
+        if (
+            _card_data_fetcher is None
+            or _card_data_fetcher.card_store is not card_store
+        ):
+            options = getattr(settings, 'CARD_DATA_FETCHER', {})
+            if _circuit_breaker is None:
+                _circuit_breaker = CircuitBreaker(
+                    failure_threshold=options.get('FAILURE_THRESHOLD', 5),
+                    reset_timeout=options.get('RESET_TIMEOUT', 30.0),
+                )
+                REGISTRY.gauge(
+                    'how_many_upstream_circuit_open',
+                    'Whether the requests to the Scryfall API are stopped.',
+                    lambda: int(_circuit_breaker.state == OPEN),
+                )
+            _card_data_fetcher = CardDataFetcher(
+                card_store=card_store,
+                card_cache=get_card_cache(),
+                offline=getattr(settings, 'CARD_DATA_OFFLINE', False),
+                lookup=options.get('LOOKUP', 'collection'),
+                max_workers=options.get('MAX_WORKERS', 1),
+                max_async_requests=options.get('MAX_ASYNC_REQUESTS', 32),
+                rate_limiter=RateLimiter(
+                    options.get('REQUEST_INTERVAL', 0.1),
+                    options.get('REQUEST_BURST', 1),
+                ),
+                max_retries=options.get('MAX_RETRIES', 0),
+                retry_backoff=options.get('RETRY_BACKOFF', 0.5),
+                max_retry_delay=options.get('MAX_RETRY_DELAY', 5.0),
+                retry_deadline=options.get('RETRY_DEADLINE', 20.0),
+                timeout=options.get('TIMEOUT', 10.0),
+                circuit_breaker=_circuit_breaker,
+                not_found_cache=get_not_found_cache(),
+                single_flight=_create_single_flight(options),
+            )
+    return _card_data_fetcher
+
+
+def _create_single_flight(options):
+    # The lookups of other workers are waited for as long as their requests
+    # can take
+    backend = options.get('LOCK_BACKEND')
+    return SingleFlight(
+        backend=caches[backend] if backend else None,
+        lock_timeout=options.get('RETRY_DEADLINE', 20.0),
+    )
+
+
+def get_source_tables():
+    """
+    Returns the process-wide tables of the probabilities of drawing colored
+    sources, computed in memory for each deck size the first time it is used.
+
+    When the SOURCE_TABLES_PATH setting is set, the tables are loaded from
+    that file instead, and a missing or unreadable file is replaced by the
+    tables of the usual deck sizes, so that the next workers load them
+    instead of computing them again.
+
+    Returns:
+        SourceTables: The tables used by the color requirements.
+    """
+    global _source_tables
+
+    if _source_tables is None:
+        with _source_tables_lock:
+            if _source_tables is None:
+                _source_tables = _load_source_tables(
+                    getattr(settings, 'SOURCE_TABLES_PATH', None)
+                )
+    return _source_tables
+
+
+def _load_source_tables(path):
+    if not path:
+        return SourceTables()
+
+    if os.path.exists(path):
+        try:
+            return SourceTables.load(path)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+    source_tables = SourceTables(DECK_SIZES)
+    try:
+        source_tables.dump(path)
+    except OSError:
+        pass
+    return source_tables
+
+
+def _register_cache_metrics(name, cache):
+    # Expose the counts kept by the cache itself, read when metrics are
+    # scraped, instead of counting every lookup twice
+    for stat, description in (
+        ('hits', 'Lookups found in the in-process cache.'),
+        ('backend_hits', 'Lookups found in the shared cache backend.'),
+        ('misses', 'Lookups found in neither cache.'),
+        ('evictions', 'Entries evicted to respect the size bounds.'),
+    ):
+        REGISTRY.function_counter(
+            f'how_many_{name}_{stat}_total',
+            description,
+            lambda stat=stat: cache.stats()[stat],
+        )
+    REGISTRY.gauge(
+        f'how_many_{name}_entries',
+        'Entries in the in-process cache.',
+        lambda: cache.stats()['entries'],
+    )
+    REGISTRY.gauge(
+        f'how_many_{name}_bytes',
+        'Estimated memory of the in-process cache.',
+        lambda: cache.stats()['bytes'],
+    )
@@ -0,0 +1,306 @@
+import json
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from decklist_analyzer.analysis import get_analysis, parse_decklist
+from decklist_analyzer.utils import deck_matrix
+from decklist_analyzer.utils.card_cache import CardCache
+from decklist_analyzer.utils.card_data_fetcher import (
+    CardDataFetcher,
+    UpstreamUnavailable,
+)
+from decklist_analyzer.utils.card_store import CardStore
+from decklist_analyzer.utils.rate_limiter import RateLimiter
+
+# The fetcher, result cache and deck matrix of each worker process, created
+# by _init_worker
+_fetcher = None
+_result_cache = None
+_deck_matrix = None
+
+
+def _init_worker(fetcher_options):
+    """
+    Creates the card data fetcher of a worker process. Every worker opens the
+    same card store read-only, and keeps its own card and result caches.
+
+    Args:
+        fetcher_options (dict): The keyword arguments of the CardDataFetcher,
+            with the card store path instead of the card store.
+    """
+    global _fetcher, _result_cache, _deck_matrix
+
+    fetcher_options = dict(fetcher_options)
+    card_store_path = fetcher_options.pop('card_store_path')
+    card_store = CardStore(card_store_path) if card_store_path else None
+    if card_store is not None and not card_store.exists():
+        card_store = None
+
+    engine = fetcher_options.pop('engine')
+    request_interval = fetcher_options.pop('request_interval')
+    result_entries = fetcher_options.pop('result_entries')
+    _fetcher = CardDataFetcher(
+        card_store=card_store,
+        card_cache=CardCache(max_entries=fetcher_options.pop('cache_entries')),
+        rate_limiter=RateLimiter(request_interval),
+        **fetcher_options,
+    )
+    _result_cache = CardCache(max_entries=result_entries, namespace='analysis')
+    _deck_matrix = deck_matrix.DeckMatrix(_fetcher) if engine == 'matrix' else None
+
+
+def _analyze_batch(batch):
+    """
+    Analyzes a batch of decklists in a worker process.
+
+    Args:
+        batch (list): The (deck id, decklist) pairs to analyze.
+
+    Returns:
+        list: The (deck id, result, error message) of each decklist.
+    """
+    if _deck_matrix is not None:
+        return _analyze_batch_matrix(batch)
+
+    results = []
+    for deck_id, decklist in batch:
+        try:
+            result = get_analysis(decklist, _fetcher, _result_cache)
+        except (ValueError, AttributeError, KeyError, IndexError) as e:
+            results.append((deck_id, None, str(e).replace("'", '')))
+        except UpstreamUnavailable as e:
+            results.append((deck_id, None, str(e)))
+        else:
+            results.append((deck_id, result, None))
+    return results
+
+
+def _analyze_batch_matrix(batch):
+    """
+    Analyzes a batch of decklists at once with the deck matrix of a worker
+    process.
+
+    Args:
+        batch (list): The (deck id, decklist) pairs to analyze.
+
+    Returns:
+        list: The (deck id, result, error message) of each decklist.
+    """
+    results = []
+    parsed = []
+    for deck_id, decklist in batch:
+        try:
+            parsed.append((len(results), parse_decklist(decklist)))
+        except (ValueError, AttributeError, KeyError, IndexError) as e:
+            results.append((deck_id, None, str(e).replace("'", '')))
+        else:
+            results.append(None)
+
+    try:
+        analyses = _deck_matrix.analyze_decklists(
+            [parsed_decklist for _, parsed_decklist in parsed]
+        )
+    except UpstreamUnavailable as e:
+        analyses = [(None, e)] * len(parsed)
+    for (index, _), (result, error) in zip(parsed, analyses):
+        deck_id = batch[index][0]
+        if error is not None:
+            error = str(error).replace("'", '')
+        results[index] = (deck_id, result, error)
+    return results
+
+
+class Command(BaseCommand):
+    """
+    Analyzes many decklists across a pool of worker processes.
+
+    The decklists are read from a JSONL file, one {"id": ..., "decklist": ...}
+    object per line, or from a directory of .txt decklists. The results are
+    written as JSONL in input order, and the decklists that could not be
+    analyzed are written to a separate error channel. At most a few batches
+    per worker are in flight, so memory stays bounded whatever the input size.
+
+    With --engine matrix, each batch is analyzed at once by a DeckMatrix,
+    which needs NumPy, instead of deck by deck by the Analyzer. The results
+    are the same, and larger batches make the most of it.
+
+    Examples:
+        python manage.py analyze_decks decks.jsonl --output results.jsonl
+        python manage.py analyze_decks tournament/ --workers 8 --errors errors.jsonl
+        python manage.py analyze_decks decks.jsonl --engine matrix --batch-size 5000
+    """
+
+    help = 'Analyzes many decklists from a JSONL file or a directory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'input',
+            help='A JSONL file of decklists, a directory of .txt decklists, or - for JSONL on stdin.',
+        )
+        parser.add_argument(
+            '--output',
+            help='Path of the JSONL results file. Defaults to stdout.',
+        )
+        parser.add_argument(
+            '--errors',
+            help='Path of the JSONL errors file. Defaults to stderr.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes. Defaults to the number of CPUs.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Number of decklists sent to a worker at once.',
+        )
+        parser.add_argument(
+            '--progress-every',
+            type=int,
+            default=10000,
+            help='Report progress every N decklists (0 to disable).',
+        )
+        parser.add_argument(
+            '--engine',
+            choices=('analyzer', 'matrix'),
+            default='analyzer',
+            help='Analyze deck by deck, or each batch at once with NumPy.',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        batch_size = max(options['batch_size'], 1)
+        if options['engine'] == 'matrix' and deck_matrix.np is None:
+            raise CommandError('The matrix engine requires NumPy.')
+
+        output = self._open(options['output'], sys.stdout)
+        errors = self._open(options['errors'], sys.stderr)
+
+        fetcher_options = self._fetcher_options(workers, options['engine'])
+        decklists = self._iter_decklists(options['input'])
+        batches = iter(lambda: list(islice(decklists, batch_size)), [])
+
+        self._analyzed = 0
+        self._failed = 0
+        self._start = time.perf_counter()
+
+        try:
+            if workers == 1:
+                _init_worker(fetcher_options)
+                for batch in batches:
+                    self._write_results(
+                        _analyze_batch(batch), output, errors, options
+                    )
+            else:
+                with Pool(
+                    workers, initializer=_init_worker, initargs=(fetcher_options,)
+                ) as pool:
+                    pending = deque()
+                    for batch in batches:
+                        pending.append(pool.apply_async(_analyze_batch, (batch,)))
+                        if len(pending) >= workers * 2:
+                            self._write_results(
+                                pending.popleft().get(), output, errors, options
+                            )
+                    while pending:
+                        self._write_results(
+                            pending.popleft().get(), output, errors, options
+                        )
+        finally:
+            if output is not sys.stdout:
+                output.close()
+            if errors is not sys.stderr:
+                errors.close()
+
+        self._report_progress()
+
+    def _write_results(self, results, output, errors, options):
+        for deck_id, result, error in results:
+            if error is None:
+                output.write(json.dumps({'id': deck_id, 'result': result}) + '\n')
+                self._analyzed += 1
+            else:
+                errors.write(json.dumps({'id': deck_id, 'error': error}) + '\n')
+                self._failed += 1
+
+            progress_every = options['progress_every']
+            if progress_every and (self._analyzed + self._failed) % progress_every == 0:
+                self._report_progress()
+
+    def _report_progress(self):
+        total = self._analyzed + self._failed
+        elapsed = time.perf_counter() - self._start
+        throughput = total / elapsed if elapsed > 0 else 0.0
+        self.stderr.write(
+            f'Analyzed {total} decklists ({self._failed} errors) in '
+            f'{elapsed:.1f}s, {throughput:.0f} decklists/s.'
+        )
+
+    def _iter_decklists(self, path):
+        if path == '-':
+            yield from self._iter_jsonl(sys.stdin)
+            return
+
+        path = Path(path)
+        if path.is_dir():
+            for deck_path in sorted(path.rglob('*.txt')):
+                yield (
+                    str(deck_path.relative_to(path)),
+                    deck_path.read_text(encoding='utf-8'),
+                )
+        elif path.is_file():
+            with open(path, encoding='utf-8') as jsonl_file:
+                yield from self._iter_jsonl(jsonl_file)
+        else:
+            raise CommandError(f'No such file or directory: {path}.')
+
+    def _iter_jsonl(self, jsonl_file):
+        for line_number, line in enumerate(jsonl_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                entry = None
+
+            # Malformed entries are analyzed as empty decklists, so that they
+            # are reported on the error channel with their line number
+            if isinstance(entry, str):
+                yield line_number, entry
+            elif isinstance(entry, dict) and isinstance(entry.get('decklist'), str):
+                yield entry.get('id', line_number), entry['decklist']
+            else:
+                yield line_number, ''
+
+    def _fetcher_options(self, workers, engine):
+        options = getattr(settings, 'CARD_DATA_FETCHER', {})
+        card_cache_options = getattr(settings, 'CARD_CACHE', {})
+        analysis_cache_options = getattr(settings, 'ANALYSIS_CACHE', {})
+        return {
+            'card_store_path': str(getattr(settings, 'CARD_STORE_PATH', '') or ''),
+            'cache_entries': card_cache_options.get('MAX_ENTRIES'),
+            'result_entries': analysis_cache_options.get('MAX_ENTRIES'),
+            'engine': engine,
+            'offline': getattr(settings, 'CARD_DATA_OFFLINE', False),
+            'lookup': options.get('LOOKUP', 'collection'),
+            'max_retries': options.get('MAX_RETRIES', 0),
+            'retry_backoff': options.get('RETRY_BACKOFF', 0.5),
+            # Every worker gets its share of the request rate to Scryfall
+            'request_interval': options.get('REQUEST_INTERVAL', 0.1) * workers,
+        }
+
+    def _open(self, path, default):
+        if not path:
+            return default
+        return open(path, 'w', encoding='utf-8')
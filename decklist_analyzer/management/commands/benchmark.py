@@ -0,0 +1,304 @@
+import asyncio
+import itertools
+import json
+import platform
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from decklist_analyzer.utils import deck_matrix
+from decklist_analyzer.utils.analyzer import Analyzer
+from decklist_analyzer.utils.card_data_fetcher import CardDataFetcher
+from decklist_analyzer.utils.card_store import CardStore
+from decklist_analyzer.utils.decklist_parser import DecklistParser
+from decklist_analyzer.utils.local_scryfall import LocalScryfallServer
+
+FIXTURES_PATH = Path(__file__).resolve().parents[2] / 'fixtures'
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the parser, fetcher and analyzer hot paths.
+
+    Every benchmark runs on the recorded fixture card pool, served by a local
+    stand-in for Scryfall or ingested into a temporary card store, and on the
+    fixture decks: a 60-card constructed deck, an 80-card deck with a
+    companion and a 100-card Commander deck. Cold runs use a new card cache
+    for every iteration, warm runs share one, and the bulk run analyzes
+    thousands of decks with a warm cache, deck by deck and, when NumPy is
+    installed, at once with the deck matrix.
+
+    The load runs compare the sync and async analysis paths under concurrent
+    cold analyses, with a latency like Scryfall's: the sync run spreads them
+    over a few threads, like the requests of sync gunicorn workers, and the
+    async run awaits all of them on a single event loop, like the requests of
+    one ASGI worker.
+
+    The results are written as JSON. When a baseline file written by a
+    previous run is given, the command fails if the median time of any
+    benchmark regressed by more than the threshold.
+
+    Examples:
+        python manage.py benchmark --output baseline.json
+        python manage.py benchmark --baseline baseline.json --threshold 0.2
+    """
+
+    help = 'Benchmarks the parser, fetcher and analyzer hot paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help='Number of timed iterations of each benchmark.',
+        )
+        parser.add_argument(
+            '--bulk-decks',
+            type=int,
+            default=5000,
+            help='Number of decks analyzed by the bulk benchmark.',
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='Seconds of latency added by the local Scryfall server.',
+        )
+        parser.add_argument(
+            '--load-analyses',
+            type=int,
+            default=32,
+            help='Number of concurrent analyses of the load benchmarks.',
+        )
+        parser.add_argument(
+            '--load-workers',
+            type=int,
+            default=4,
+            help='Number of sync workers of the sync load benchmark.',
+        )
+        parser.add_argument(
+            '--load-latency',
+            type=float,
+            default=0.1,
+            help='Seconds of latency added by Scryfall in the load benchmarks.',
+        )
+        parser.add_argument(
+            '--output',
+            help='Path of the JSON results file. Defaults to stdout.',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Path of a JSON results file to compare the results with.',
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.2,
+            help='Maximum allowed slowdown of a median time over the baseline (0.2 = 20%%).',
+        )
+
+    def handle(self, *args, **options):
+        iterations = max(options['iterations'], 1)
+        decks = {
+            deck_path.stem: deck_path.read_text(encoding='utf-8')
+            for deck_path in sorted((FIXTURES_PATH / 'decks').glob('*.txt'))
+        }
+
+        results = {}
+        with LocalScryfallServer.from_fixture(
+            FIXTURES_PATH / 'card_pool.json', latency=options['latency']
+        ) as scryfall, tempfile.TemporaryDirectory() as tmp_dir:
+            card_store = CardStore(Path(tmp_dir) / 'cards.sqlite3')
+            with open(FIXTURES_PATH / 'card_pool.json', encoding='utf-8') as bulk_file:
+                card_store.ingest_bulk_data(bulk_file)
+
+            def scryfall_fetcher():
+                return CardDataFetcher(api_url=scryfall.url)
+
+            def store_fetcher():
+                return CardDataFetcher(card_store=card_store, offline=True)
+
+            for name, decklist in decks.items():
+                parsed_decklist = DecklistParser(decklist).parse_decklist()
+                cards = list(parsed_decklist['deck'])
+
+                results[f'parse/{name}'] = self._time(
+                    lambda: DecklistParser(decklist).parse_decklist(), iterations
+                )
+                results[f'fetch_cold/{name}'] = self._time(
+                    lambda: scryfall_fetcher().get_cards_data(cards), iterations
+                )
+                results[f'fetch_store/{name}'] = self._time(
+                    lambda: store_fetcher().get_cards_data(cards), iterations
+                )
+
+                warm_fetcher = scryfall_fetcher()
+                warm_fetcher.get_cards_data(cards)
+                results[f'fetch_warm/{name}'] = self._time(
+                    lambda: [warm_fetcher.get_card_data(card) for card in cards],
+                    iterations,
+                )
+
+                results[f'analyze_cold/{name}'] = self._time(
+                    lambda: self._analyze(decklist, scryfall_fetcher()),
+                    iterations,
+                )
+                results[f'analyze_warm/{name}'] = self._time(
+                    lambda: self._analyze(decklist, warm_fetcher), iterations
+                )
+
+            bulk_fetcher = store_fetcher()
+            bulk_decks = list(
+                itertools.islice(
+                    itertools.cycle(decks.values()), options['bulk_decks']
+                )
+            )
+            start = time.perf_counter()
+            for decklist in bulk_decks:
+                self._analyze(decklist, bulk_fetcher)
+            elapsed = time.perf_counter() - start
+            results['analyze_bulk'] = self._throughput(len(bulk_decks), elapsed)
+
+            if deck_matrix.np is not None:
+                matrix = deck_matrix.DeckMatrix(bulk_fetcher)
+                start = time.perf_counter()
+                matrix.analyze_decklists(
+                    [
+                        DecklistParser(decklist).parse_decklist()
+                        for decklist in bulk_decks
+                    ]
+                )
+                elapsed = time.perf_counter() - start
+                results['analyze_bulk_matrix'] = self._throughput(
+                    len(bulk_decks), elapsed
+                )
+
+        results.update(
+            self._load(
+                list(decks.values()),
+                options['load_analyses'],
+                options['load_workers'],
+                options['load_latency'],
+            )
+        )
+
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n', encoding='utf-8')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['threshold'])
+
+    def _analyze(self, decklist, fetcher):
+        parser = DecklistParser(decklist)
+        parser.parse_decklist()
+        analyzer = Analyzer(parser.parsed_decklist, fetcher=fetcher)
+        analyzer.analyze_decklist()
+        return analyzer
+
+    def _load(self, decklists, analyses, workers, latency):
+        decklists = list(
+            itertools.islice(itertools.cycle(decklists), max(analyses, 1))
+        )
+        with LocalScryfallServer.from_fixture(
+            FIXTURES_PATH / 'card_pool.json', latency=latency
+        ) as scryfall:
+
+            def run_sync():
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    list(
+                        executor.map(
+                            lambda decklist: self._analyze(
+                                decklist, CardDataFetcher(api_url=scryfall.url)
+                            ),
+                            decklists,
+                        )
+                    )
+
+            async def run_async():
+                await asyncio.gather(
+                    *(
+                        self._aanalyze(
+                            decklist, CardDataFetcher(api_url=scryfall.url)
+                        )
+                        for decklist in decklists
+                    )
+                )
+
+            results = {}
+            for name, function in (
+                ('load_sync', run_sync),
+                ('load_async', lambda: asyncio.run(run_async())),
+            ):
+                start = time.perf_counter()
+                function()
+                elapsed = time.perf_counter() - start
+                results[name] = self._throughput(len(decklists), elapsed)
+        return results
+
+    async def _aanalyze(self, decklist, fetcher):
+        parser = DecklistParser(decklist)
+        parser.parse_decklist()
+        analyzer = Analyzer(parser.parsed_decklist, fetcher=fetcher)
+        await analyzer.aanalyze_decklist()
+        return analyzer
+
+    def _throughput(self, analyses, elapsed):
+        return {
+            'iterations': analyses,
+            'median_us': elapsed * 1e6 / max(analyses, 1),
+            'ops_per_second': analyses / elapsed if elapsed else 0.0,
+        }
+
+    def _time(self, function, iterations):
+        # One untimed run so that lazy imports and connections are not timed
+        function()
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        median = statistics.median(timings)
+        return {
+            'iterations': iterations,
+            'mean_us': statistics.fmean(timings) * 1e6,
+            'median_us': median * 1e6,
+            'p95_us': timings[int(0.95 * (iterations - 1))] * 1e6,
+            'ops_per_second': 1 / median if median else 0.0,
+        }
+
+    def _compare(self, results, baseline_path, threshold):
+        try:
+            with open(baseline_path, encoding='utf-8') as baseline_file:
+                baseline = json.load(baseline_file)['results']
+        except (OSError, ValueError, KeyError):
+            raise CommandError(f'Invalid baseline file: {baseline_path}.')
+
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            ratio = result['median_us'] / baseline[name]['median_us']
+            self.stderr.write(f'{name}: {ratio:.2f}x the baseline median')
+            if ratio > 1 + threshold:
+                regressions.append(f'{name} ({ratio:.2f}x)')
+
+        if regressions:
+            raise CommandError(
+                f'Regressions over {threshold:.0%}: {", ".join(regressions)}.'
+            )
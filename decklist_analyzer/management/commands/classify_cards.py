@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from decklist_analyzer.utils.card_classifier import RULES_FINGERPRINT
+from decklist_analyzer.utils.card_store import CardStore
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the classification flags stored in the local card store after
+    the classification rules change.
+
+    Example:
+        python manage.py classify_cards
+    """
+
+    help = 'Recomputes the classification flags stored in the local card store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store',
+            default=getattr(settings, 'CARD_STORE_PATH', None),
+            help='Path of the card store database. Defaults to the CARD_STORE_PATH setting.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['store']:
+            raise CommandError('No card store path. Set CARD_STORE_PATH or pass --store.')
+
+        card_store = CardStore(options['store'])
+        if not card_store.exists():
+            raise CommandError(f'No card store at {card_store.path}. Run ingest_card_data first.')
+
+        card_count = card_store.classify_cards()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Classified {card_count} cards with rules {RULES_FINGERPRINT}.'
+            )
+        )
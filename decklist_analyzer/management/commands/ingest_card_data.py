@@ -0,0 +1,89 @@
+import gzip
+import io
+import sys
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from decklist_analyzer.utils.card_store import CardStore
+
+
+class Command(BaseCommand):
+    """
+    Ingests a Scryfall bulk-data file into the local card store.
+
+    Examples:
+        python manage.py ingest_card_data oracle-cards.json
+        python manage.py ingest_card_data --download oracle_cards
+    """
+
+    help = 'Ingests a Scryfall bulk-data file into the local card store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'bulk_file',
+            nargs='?',
+            help='Path of a bulk-data JSON file (.json or .json.gz), or - for stdin.',
+        )
+        parser.add_argument(
+            '--download',
+            metavar='TYPE',
+            help='Download the bulk-data file of this type (e.g. oracle_cards, default_cards) from Scryfall.',
+        )
+        parser.add_argument(
+            '--store',
+            default=getattr(settings, 'CARD_STORE_PATH', None),
+            help='Path of the card store database. Defaults to the CARD_STORE_PATH setting.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['store']:
+            raise CommandError('No card store path. Set CARD_STORE_PATH or pass --store.')
+
+        if bool(options['bulk_file']) == bool(options['download']):
+            raise CommandError('Pass either a bulk-data file or --download TYPE.')
+
+        card_store = CardStore(options['store'])
+
+        if options['download']:
+            source = options['download']
+            bulk_file = self._download(source)
+        elif options['bulk_file'] == '-':
+            source = 'stdin'
+            bulk_file = sys.stdin
+        elif options['bulk_file'].endswith('.gz'):
+            source = options['bulk_file']
+            bulk_file = gzip.open(source, 'rt', encoding='utf-8')
+        else:
+            source = options['bulk_file']
+            bulk_file = open(source, encoding='utf-8')
+
+        try:
+            card_count = card_store.ingest_bulk_data(bulk_file, source=source)
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            bulk_file.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Ingested {card_count} cards from {source} into {card_store.path}.'
+            )
+        )
+
+    def _download(self, bulk_type):
+        try:
+            response = requests.get(
+                f'https://api.scryfall.com/bulk-data/{bulk_type}', timeout=30
+            )
+            response.raise_for_status()
+            download_uri = response.json()['download_uri']
+
+            response = requests.get(download_uri, stream=True, timeout=30)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise CommandError(f'Could not download {bulk_type}: {e}')
+
+        response.raw.decode_content = True
+        return io.TextIOWrapper(response.raw, encoding='utf-8')
@@ -0,0 +1,160 @@
+import json
+import time
+from collections import Counter
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from decklist_analyzer.card_data import (
+    dump_card_cache_snapshot,
+    get_card_cache,
+    get_card_data_fetcher,
+)
+from decklist_analyzer.utils.card_data_fetcher import (
+    CardDataFetcher,
+    UpstreamUnavailable,
+)
+from decklist_analyzer.utils.decklist_parser import DecklistParser
+
+
+class Command(BaseCommand):
+    """
+    Warms the card cache with the cards of formats or of recent decklists,
+    and writes it to the snapshot restored by the workers when they start.
+
+    The cards of a format are its legal cards, searched on Scryfall. The
+    cards of recent decklists are read from a JSONL file, one {"id": ...,
+    "decklist": ...} object per line like the input of analyze_decks, and
+    only the N most played are kept with --top. The cards are fetched
+    through the card data fetcher, so from the local card store when there
+    is one, and the most played are fetched last, so that they are the last
+    to be evicted.
+
+    Examples:
+        python manage.py warm_card_cache --format standard --format pioneer
+        python manage.py warm_card_cache --decks recent.jsonl --top 5000
+    """
+
+    help = 'Warms the card cache and writes its snapshot.'
+
+    # Scryfall asks for 50-100 milliseconds between requests
+    SEARCH_INTERVAL = 0.1
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            action='append',
+            default=[],
+            dest='formats',
+            help='Warm the cards legal in this format (e.g. standard). Can be repeated.',
+        )
+        parser.add_argument(
+            '--decks',
+            help='Warm the cards of the decklists of this JSONL file.',
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            help='Warm only the N cards played the most in the decklists.',
+        )
+        parser.add_argument(
+            '--snapshot',
+            default=getattr(settings, 'CARD_CACHE', {}).get('SNAPSHOT'),
+            help='Path of the snapshot file. Defaults to the SNAPSHOT key of the CARD_CACHE setting.',
+        )
+        parser.add_argument(
+            '--api-url',
+            default=CardDataFetcher.SCRYFALL_API_URL,
+            help='Base URL of the Scryfall API searched for the format cards.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['formats'] and not options['decks']:
+            raise CommandError('Pass --format FORMAT or --decks FILE.')
+        if not options['snapshot'] and not getattr(
+            settings, 'CARD_CACHE', {}
+        ).get('BACKEND'):
+            raise CommandError(
+                'Nothing would keep the warmed cards. Set the SNAPSHOT or '
+                'BACKEND key of CARD_CACHE, or pass --snapshot.'
+            )
+
+        popularity = Counter()
+        if options['decks']:
+            popularity.update(self._count_decks(options['decks']))
+            if options['top'] is not None:
+                popularity = Counter(
+                    dict(popularity.most_common(max(options['top'], 0)))
+                )
+        for format_name in options['formats']:
+            for name in self._search_format(format_name, options['api_url']):
+                # Cards are cached under the lowercase names of the parser
+                popularity.setdefault(name.lower(), 0)
+
+        # Least played first, so that the most played are the most recent
+        cards = sorted(popularity, key=lambda name: (popularity[name], name))
+        try:
+            cards_data, not_found = get_card_data_fetcher().get_cards_data(
+                cards
+            )
+        except UpstreamUnavailable as e:
+            raise CommandError(str(e))
+
+        message = (
+            f'Warmed {len(cards_data)} cards ({len(not_found)} not found).'
+        )
+        if options['snapshot']:
+            cache = get_card_cache()
+            written = dump_card_cache_snapshot(options['snapshot'])
+            message += (
+                f' Wrote {written} of {len(cache)} cached cards to '
+                f'{options["snapshot"]}.'
+            )
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def _count_decks(self, path):
+        counts = Counter()
+        try:
+            jsonl_file = open(path, encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Could not read {path}: {e}')
+
+        with jsonl_file:
+            for line in jsonl_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(entry, dict):
+                    entry = entry.get('decklist')
+                if not isinstance(entry, str):
+                    continue
+
+                # Invalid decklists do not tell which cards are played
+                try:
+                    parsed_decklist = DecklistParser(entry).parse_decklist()
+                except (ValueError, AttributeError, KeyError, IndexError):
+                    continue
+                for card, entries in parsed_decklist['deck'].items():
+                    counts[card] += sum(entry['quantity'] for entry in entries)
+        return counts
+
+    def _search_format(self, format_name, api_url):
+        names = []
+        url = f'{api_url}/cards/search'
+        params = {'q': f'f:{format_name}', 'unique': 'cards'}
+        while url:
+            try:
+                response = requests.get(url, params=params, timeout=30)
+                response.raise_for_status()
+                page = response.json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                raise CommandError(f'Could not search {format_name} cards: {e}')
+
+            names.extend(card['name'] for card in page.get('data', []))
+            url = page.get('next_page') if page.get('has_more') else None
+            params = None
+            if url:
+                time.sleep(self.SEARCH_INTERVAL)
+        return names
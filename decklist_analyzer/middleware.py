@@ -0,0 +1,129 @@
+import json
+import logging
+import time
+
+from asgiref.sync import (
+    iscoroutinefunction,
+    markcoroutinefunction,
+    sync_to_async,
+)
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from decklist_analyzer.utils.timing import start_timings, stop_timings
+
+logger = logging.getLogger('decklist_analyzer.timing')
+
+
+class ServerTimingMiddleware:
+    """
+    Times the phases of every request and reports them in a Server-Timing
+    header.
+
+    The phases are timed by the code that runs them (parse, fetch, upstream,
+    classify, analyze, simulate, colors, session and render), and the whole
+    request is reported as total. When the SERVER_TIMING_LOG setting is True,
+    a JSON line with the timings, the card count, the cache misses and the
+    time spent waiting on Scryfall is also logged for every request.
+
+    The middleware runs synchronously or asynchronously, like the rest of the
+    middleware chain, so it does not make async views synchronous.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """
+        Initializes the ServerTimingMiddleware instance.
+
+        Args:
+            get_response (callable): The next middleware or view.
+        """
+        self.get_response = get_response
+        self.log = getattr(settings, 'SERVER_TIMING_LOG', False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timings, token = start_timings()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self._report(request, response, timings, start)
+
+    async def __acall__(self, request):
+        timings, token = start_timings()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_timings(token)
+        return self._report(request, response, timings, start)
+
+    def _report(self, request, response, timings, start):
+        timings.add('total', time.perf_counter() - start)
+
+        response['Server-Timing'] = timings.server_timing()
+
+        if self.log:
+            logger.info(
+                json.dumps(
+                    {
+                        'method': request.method,
+                        'path': request.path,
+                        'status': response.status_code,
+                        **timings.as_dict(),
+                    }
+                )
+            )
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """
+    Serves the static files with WhiteNoise, asynchronously under ASGI.
+
+    WhiteNoise's middleware is synchronous only, so Django would run the rest
+    of the middleware chain and the async views through a single thread.
+    Static files are served from a thread instead, and every other request is
+    passed on without leaving the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        """
+        Initializes the StaticFilesMiddleware instance.
+
+        Args:
+            get_response (callable): The next middleware or view.
+            settings (Settings): The Django settings.
+        """
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(
+                self.find_file, thread_sensitive=False
+            )(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve, thread_sensitive=False)(
+                static_file, request
+            )
+        return await self.get_response(request)
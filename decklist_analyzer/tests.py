@@ -1,3 +1,1806 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import AsyncRequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from decklist_analyzer.analysis import aget_analysis, analysis_state, get_analysis
+from decklist_analyzer.card_data import _load_source_tables
+from decklist_analyzer.middleware import ServerTimingMiddleware
+from decklist_analyzer.utils.analyzer import Analyzer
+from decklist_analyzer.utils.card_cache import CardCache
+from decklist_analyzer.utils.card_classifier import (
+    ORACLE_TEXT_TOKENS,
+    RULES_FINGERPRINT,
+    CardClassifier,
+)
+from decklist_analyzer.utils.card_data_fetcher import (
+    CardDataFetcher,
+    UpstreamUnavailable,
+)
+from decklist_analyzer.utils.card_record import CardRecord
+from decklist_analyzer.utils.card_store import CardStore
+from decklist_analyzer.utils.circuit_breaker import CircuitBreaker
+from decklist_analyzer.utils.color_requirements import (
+    DECK_SIZES,
+    SourceTables,
+    parse_mana_cost,
+)
+from decklist_analyzer.utils.deck_matrix import DeckMatrix
+from decklist_analyzer.utils.deck_matrix import np as numpy
+from decklist_analyzer.utils.decklist_parser import DecklistParser
+from decklist_analyzer.utils.local_scryfall import LocalScryfallServer
+from decklist_analyzer.utils.mana_simulator import ManaSimulator
+from decklist_analyzer.utils.metrics import MetricsRegistry
+from decklist_analyzer.utils.rate_limiter import RateLimiter
+from decklist_analyzer.utils.single_flight import SingleFlight
+from decklist_analyzer.views import api_analyze_async
+
+CARD_POOL_PATH = Path(__file__).parent / 'fixtures' / 'card_pool.json'
+
+RUN_BENCHMARKS = os.getenv('HOW_MANY_BENCHMARKS') == '1'
+
+SAMPLE_DECKLIST = '\r\n'.join(
+    [
+        'Companion',
+        '1 Jegantha, the Wellspring',
+        '',
+        'Deck',
+        '2 Sulfurous Springs',
+        '3 Blackcleave Cliffs',
+        '1 Mountain',
+        '1 Swamp',
+        '4 Blood Crypt',
+        '4 Fatal Push',
+        '1 Ramunap Ruins',
+        '4 Thoughtseize',
+        '4 Mayhem Devil',
+        '3 Cauldron Familiar',
+        '3 Claim the Firstborn',
+        "4 Witch's Oven",
+        "1 Kroxa, Titan of Death's Hunger",
+        '4 Blightstep Pathway',
+        '4 Deadly Dispute',
+        '2 Den of the Bugbear',
+        '2 Hive of the Eye Tyrant',
+        '4 Bloodtithe Harvester',
+        '4 Fable of the Mirror-Breaker',
+        '1 Takenuma, Abandoned Mire',
+        '1 Sokenzan, Crucible of Defiance',
+        '3 Unlucky Witness',
+        '',
+        'Sideboard',
+        "1 Kolaghan's Command",
+        '2 Duress',
+    ]
+)
+
+
+class LocalScryfallTestCase(SimpleTestCase):
+    """
+    Base class for tests that fetch card data from a local stand-in for the
+    Scryfall API serving the fixture card pool.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.scryfall = LocalScryfallServer.from_fixture(CARD_POOL_PATH).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.scryfall.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.scryfall.reset()
+
+    def make_fetcher(self, **kwargs):
+        return CardDataFetcher(api_url=self.scryfall.url, **kwargs)
+
+
+class CardCacheTests(SimpleTestCase):
+    def test_least_recently_used_card_is_evicted(self):
+        cache = CardCache(max_entries=2)
+        cache.set('fatal push', 1)
+        cache.set('thoughtseize', 2)
+        cache.get('fatal push')
+        cache.set('duress', 3)
+
+        self.assertEqual(list(cache._entries), ['fatal push', 'duress'])
+        self.assertIsNone(cache.get('thoughtseize'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_card_expires_after_ttl(self):
+        cache = CardCache(ttl=10)
+        with mock.patch('decklist_analyzer.utils.card_cache.time') as clock:
+            clock.monotonic.return_value = 100.0
+            cache.set('fatal push', 1)
+            clock.monotonic.return_value = 109.0
+            self.assertEqual(cache.get('fatal push'), 1)
+            clock.monotonic.return_value = 110.0
+            self.assertIsNone(cache.get('fatal push'))
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_max_bytes_bounds_estimated_size(self):
+        card_data = {'name': 'Fatal Push', 'oracle_text': 'x' * 100}
+        size = CardCache()._estimate_size(card_data)
+        self.assertGreater(size, sys.getsizeof(card_data) + 100)
+
+        cache = CardCache(max_bytes=2 * size)
+        for name in ('fatal push', 'thoughtseize', 'duress'):
+            cache.set(name, dict(card_data))
+        cache.set('duress', dict(card_data))
+
+        self.assertEqual(list(cache._entries), ['thoughtseize', 'duress'])
+        stats = cache.stats()
+        self.assertEqual(stats['bytes'], 2 * size)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_stats_count_hits_backend_hits_and_misses(self):
+        backend = LocMemCache('card-cache-tests', {})
+        CardCache(backend=backend).set('fatal push', 1)
+        cache = CardCache(backend=backend)
+
+        self.assertEqual(cache.get('fatal push'), 1)
+        self.assertEqual(cache.get('fatal push'), 1)
+        self.assertIsNone(cache.get('duress'))
+        cache.get('fatal push', count=False)
+        cache.get('duress', count=False)
+
+        self.assertEqual(
+            cache.stats(),
+            {
+                'hits': 1,
+                'backend_hits': 1,
+                'misses': 1,
+                'evictions': 0,
+                'entries': 1,
+                'bytes': cache._estimate_size(1),
+            },
+        )
+
+
+class CardDataFetcherCollectionTests(LocalScryfallTestCase):
+    def test_get_cards_data_batches_uncached_cards(self):
+        fetcher = self.make_fetcher()
+        cards = [f'missing card {i}' for i in range(100)] + ['fatal push']
+
+        cards_data, not_found = fetcher.get_cards_data(cards)
+
+        self.assertEqual(list(cards_data), ['fatal push'])
+        self.assertEqual(cards_data['fatal push'].name, 'Fatal Push')
+        self.assertEqual(not_found, cards[:100])
+        self.assertEqual(
+            self.scryfall.requests, [('POST', '/cards/collection')] * 2
+        )
+
+    def test_get_cards_data_matches_face_names(self):
+        fetcher = self.make_fetcher()
+
+        cards_data, not_found = fetcher.get_cards_data(
+            ['fable of the mirror-breaker', 'blightstep pathway']
+        )
+
+        self.assertEqual(not_found, [])
+        self.assertEqual(cards_data['blightstep pathway'].layout, 'modal_dfc')
+
+    def test_get_cards_data_returns_classified_records(self):
+        fetcher = self.make_fetcher()
+
+        cards_data, _ = fetcher.get_cards_data(['fatal push'])
+
+        card = cards_data['fatal push']
+        self.assertIsInstance(card, CardRecord)
+        self.assertIsNotNone(card.flags)
+        self.assertNotIn('collector_number', card.to_card_data())
+
+    def test_get_cards_data_skips_cached_cards(self):
+        fetcher = self.make_fetcher()
+        fetcher.get_cards_data(['fatal push', 'thoughtseize'])
+        self.scryfall.reset()
+
+        cards_data, not_found = fetcher.get_cards_data(
+            ['fatal push', 'thoughtseize']
+        )
+
+        self.assertEqual(len(cards_data), 2)
+        self.assertEqual(self.scryfall.requests, [])
+
+    def test_cards_not_found_are_not_requested_again(self):
+        fetcher = self.make_fetcher()
+        cards = ['fatal pus', 'thoughtsieze', '???', 'x' * 200]
+
+        _, not_found = fetcher.get_cards_data(cards)
+        self.assertEqual(not_found, cards)
+        self.assertEqual(
+            self.scryfall.requests, [('POST', '/cards/collection')]
+        )
+        self.scryfall.reset()
+
+        _, not_found = fetcher.get_cards_data(cards)
+        self.assertEqual(not_found, cards)
+        self.assertIsNone(fetcher.get_card_data('fatal pus'))
+        self.assertEqual(self.scryfall.requests, [])
+
+    def test_only_cards_listed_not_found_are_cached_as_not_found(self):
+        fatal_push = next(
+            card for card in load_card_pool() if card['name'] == 'Fatal Push'
+        )
+        session = mock.Mock()
+        session.request.return_value.status_code = 200
+        session.request.return_value.json.return_value = {
+            'data': [fatal_push],
+            'not_found': [{'name': 'fatal pus'}],
+        }
+        not_found_cache = CardCache()
+        fetcher = self.make_fetcher(
+            session=session, not_found_cache=not_found_cache
+        )
+
+        # Scryfall found the first card, under a spelling not matched here
+        fetcher.get_cards_data(['fatal push!', 'fatal pus'])
+
+        self.assertIsNone(not_found_cache.get('fatal push!'))
+        self.assertTrue(not_found_cache.get('fatal pus'))
+
+    def test_aget_cards_data_reads_caches_off_the_event_loop(self):
+        threads = set()
+
+        class ThreadRecordingCache(CardCache):
+            def get(self, key, count=True):
+                threads.add(threading.get_ident())
+                return super().get(key, count)
+
+        class ThreadRecordingBackend(LocMemCache):
+            def add(self, *args, **kwargs):
+                threads.add(threading.get_ident())
+                return super().add(*args, **kwargs)
+
+            def delete_many(self, *args, **kwargs):
+                threads.add(threading.get_ident())
+                return super().delete_many(*args, **kwargs)
+
+        fetcher = self.make_fetcher(
+            card_cache=ThreadRecordingCache(),
+            not_found_cache=ThreadRecordingCache(),
+            single_flight=SingleFlight(
+                backend=ThreadRecordingBackend('async-lock-tests', {})
+            ),
+        )
+
+        _, not_found = asyncio.run(
+            fetcher.aget_cards_data(['fatal push', 'fatal pus'])
+        )
+
+        self.assertEqual(not_found, ['fatal pus'])
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_stale_cards_are_served_and_revalidated(self):
+        card_cache = CardCache(ttl=0.05, stale_ttl=60)
+        fetcher = self.make_fetcher(card_cache=card_cache)
+        fetcher.get_cards_data(['fatal push'])
+        time.sleep(0.1)
+        self.scryfall.reset()
+
+        cards_data, not_found = fetcher.get_cards_data(['fatal push'])
+
+        self.assertEqual(cards_data['fatal push'].name, 'Fatal Push')
+        self.assertEqual(not_found, [])
+        deadline = time.monotonic() + 5
+        while card_cache.get('fatal push', count=False) is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(
+            self.scryfall.requests, [('POST', '/cards/collection')]
+        )
+
+    def test_circuit_breaker_stops_requesting_failing_upstream(self):
+        session = mock.Mock()
+        session.request.side_effect = requests.exceptions.ConnectionError
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        fetcher = self.make_fetcher(
+            session=session, circuit_breaker=circuit_breaker
+        )
+
+        for card in ('fatal push', 'thoughtseize', 'opt'):
+            with self.assertRaises(UpstreamUnavailable):
+                fetcher.get_card_data(card)
+
+        self.assertEqual(session.request.call_count, 2)
+        self.assertEqual(session.request.call_args.kwargs['timeout'], 10.0)
+        self.assertEqual(circuit_breaker.state, 'open')
+
+    def test_circuit_breaker_records_every_failed_probe(self):
+        session = mock.Mock()
+        session.request.side_effect = requests.exceptions.TooManyRedirects
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        fetcher = self.make_fetcher(
+            session=session, circuit_breaker=circuit_breaker
+        )
+
+        with self.assertRaises(UpstreamUnavailable):
+            fetcher.get_card_data('fatal push')
+        self.assertEqual(circuit_breaker.state, 'open')
+
+        # The probe of the half open circuit fails without a response
+        later = time.monotonic() + 61
+        with mock.patch('time.monotonic', return_value=later):
+            with self.assertRaises(UpstreamUnavailable):
+                fetcher.get_card_data('thoughtseize')
+            self.assertEqual(circuit_breaker.state, 'open')
+            self.assertFalse(circuit_breaker.allow_request())
+        self.assertEqual(session.request.call_count, 2)
+
+        # A probe whose outcome is never recorded does not keep it half open
+        with mock.patch('time.monotonic', return_value=later + 61):
+            self.assertTrue(circuit_breaker.allow_request())
+            self.assertFalse(circuit_breaker.allow_request())
+        with mock.patch('time.monotonic', return_value=later + 122):
+            self.assertTrue(circuit_breaker.allow_request())
+
+
+    def make_response(self, status_code, retry_after=None):
+        response = requests.Response()
+        response.status_code = status_code
+        if retry_after is not None:
+            response.headers['Retry-After'] = retry_after
+        return response
+
+    def test_retry_after_longer_than_max_retry_delay_is_not_waited(self):
+        session = mock.Mock()
+        session.request.return_value = self.make_response(429, '120')
+        fetcher = self.make_fetcher(session=session, max_retries=3)
+
+        with mock.patch('time.sleep') as sleep:
+            with self.assertRaises(UpstreamUnavailable):
+                fetcher.get_cards_data(['fatal push'])
+
+        self.assertEqual(session.request.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_retries_stop_at_retry_deadline(self):
+        session = mock.Mock()
+        session.request.return_value = self.make_response(503)
+        fetcher = self.make_fetcher(
+            session=session,
+            max_retries=10,
+            retry_backoff=1.0,
+            max_retry_delay=2.0,
+            retry_deadline=5.0,
+        )
+        clock = mock.Mock()
+        clock.monotonic.return_value = 0.0
+        clock.perf_counter.return_value = 0.0
+        clock.sleep.side_effect = lambda delay: setattr(
+            clock.monotonic, 'return_value', clock.monotonic() + delay
+        )
+
+        with mock.patch('decklist_analyzer.utils.card_data_fetcher.time', clock):
+            with self.assertRaises(UpstreamUnavailable):
+                fetcher.get_cards_data(['fatal push'])
+
+        # Backoffs of 1 and 2 seconds, then a third one would end at 5
+        self.assertEqual(
+            [call.args[0] for call in clock.sleep.call_args_list], [1.0, 2.0]
+        )
+        self.assertEqual(
+            [call.kwargs['timeout'] for call in session.request.call_args_list],
+            [5.0, 4.0, 2.0],
+        )
+
+    def test_open_circuit_with_cold_cache_is_not_reported_as_not_found(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        circuit_breaker.record_failure()
+        not_found_cache = CardCache()
+        fetcher = self.make_fetcher(
+            circuit_breaker=circuit_breaker, not_found_cache=not_found_cache
+        )
+
+        with self.assertRaisesMessage(UpstreamUnavailable, 'Try again later'):
+            fetcher.get_cards_data(['fatal push', 'thoughtseize'])
+        with self.assertRaises(UpstreamUnavailable):
+            asyncio.run(fetcher.aget_cards_data(['fatal push']))
+
+        self.assertEqual(self.scryfall.requests, [])
+        self.assertEqual(len(not_found_cache), 0)
+
+
+class CardDataFetcherConcurrencyTests(SimpleTestCase):
+    def test_named_lookups_overlap_on_pooled_session(self):
+        cards = ['fatal push', 'thoughtseize', 'opt', 'ponder', 'sol ring']
+
+        with LocalScryfallServer.from_fixture(
+            CARD_POOL_PATH, latency=0.2
+        ) as scryfall:
+            fetcher = CardDataFetcher(
+                api_url=scryfall.url,
+                lookup='named',
+                max_workers=5,
+                rate_limiter=RateLimiter(0.01, capacity=5),
+            )
+            start = time.perf_counter()
+            cards_data, not_found = fetcher.get_cards_data(cards)
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(list(cards_data), cards)
+        self.assertEqual(not_found, [])
+        self.assertLess(elapsed, 0.2 * len(cards) / 2)
+
+    def test_rate_limiter_spaces_out_requests_after_burst(self):
+        rate_limiter = RateLimiter(0.05, capacity=2)
+
+        start = time.perf_counter()
+        for _ in range(4):
+            rate_limiter.acquire()
+        elapsed = time.perf_counter() - start
+
+        self.assertGreaterEqual(elapsed, 0.09)
+
+    def test_concurrent_lookups_of_a_card_make_one_request(self):
+        with LocalScryfallServer.from_fixture(
+            CARD_POOL_PATH, latency=0.2
+        ) as scryfall:
+            fetcher = CardDataFetcher(api_url=scryfall.url)
+            barrier = threading.Barrier(16)
+
+            def lookup(_):
+                barrier.wait()
+                return fetcher.get_cards_data(['fatal push'])
+
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                results = list(executor.map(lookup, range(16)))
+
+            self.assertEqual(
+                scryfall.requests, [('POST', '/cards/collection')]
+            )
+        for cards_data, not_found in results:
+            self.assertEqual(cards_data['fatal push'].name, 'Fatal Push')
+            self.assertEqual(not_found, [])
+
+    def test_lookups_of_workers_sharing_a_lock_backend_make_one_request(self):
+        backend = LocMemCache('single-flight-tests', {})
+        with LocalScryfallServer.from_fixture(
+            CARD_POOL_PATH, latency=0.2
+        ) as scryfall:
+            # Two workers, with their own caches and coalescers
+            fetchers = [
+                CardDataFetcher(
+                    api_url=scryfall.url,
+                    card_cache=CardCache(backend=backend),
+                    single_flight=SingleFlight(
+                        backend=backend, poll_interval=0.01
+                    ),
+                )
+                for _ in range(2)
+            ]
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(
+                    executor.map(
+                        lambda fetcher: fetcher.get_card_data('fatal push'),
+                        fetchers,
+                    )
+                )
+
+            self.assertEqual(len(scryfall.requests), 1)
+        self.assertEqual([card.name for card in results], ['Fatal Push'] * 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = LocMemCache('single-flight-lock-tests', {})
+        self.backend.clear()
+
+    def test_backend_locks_are_taken_without_the_process_lock(self):
+        single_flight = SingleFlight(backend=self.backend)
+        add = self.backend.add
+
+        def add_unlocked(*args, **kwargs):
+            self.assertFalse(single_flight._lock.locked())
+            return add(*args, **kwargs)
+
+        with mock.patch.object(self.backend, 'add', side_effect=add_unlocked):
+            claimed, flights = single_flight.claim(['fatal push', 'duress'])
+
+        self.assertEqual(claimed, ['fatal push', 'duress'])
+        self.assertEqual(flights, {})
+
+    def test_keys_locked_by_another_worker_are_waited_for(self):
+        other_worker = SingleFlight(backend=self.backend)
+        other_worker.claim(['fatal push'])
+        single_flight = SingleFlight(backend=self.backend, poll_interval=0.01)
+
+        claimed, flights = single_flight.claim(['fatal push', 'duress'])
+
+        self.assertEqual(claimed, ['duress'])
+        self.assertEqual(flights, {'fatal push': None})
+        self.assertEqual(list(single_flight._flights), ['duress'])
+
+        # A caller of this process that claimed the key in the meantime was
+        # woken up, and waits for the other worker instead
+        released = threading.Event()
+        released.set()
+        waiter = threading.Thread(
+            target=single_flight.wait, args=({'fatal push': released},)
+        )
+        waiter.start()
+        time.sleep(0.05)
+        self.assertTrue(waiter.is_alive())
+        other_worker.release(['fatal push'])
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+
+
+class AnalyzerTests(LocalScryfallTestCase):
+    def analyze(self, decklist):
+        parser = DecklistParser(decklist)
+        parser.parse_decklist()
+        analyzer = Analyzer(parser.parsed_decklist, fetcher=self.make_fetcher())
+        analyzer.analyze_decklist()
+        return analyzer
+
+    def test_analyze_sample_decklist_in_one_request(self):
+        analyzer = self.analyze(SAMPLE_DECKLIST)
+
+        self.assertEqual(analyzer.card_count, 60)
+        self.assertEqual(analyzer.non_land_count, 38)
+        self.assertEqual(analyzer.non_land_cmcs_count, 63)
+        self.assertEqual(analyzer.cheap_card_draw_list, ['deadly dispute'])
+        self.assertEqual(analyzer.recommended_number_of_lands, 22)
+        self.assertEqual(
+            self.scryfall.requests, [('POST', '/cards/collection')]
+        )
+
+    def test_analyze_reports_every_card_not_found(self):
+        decklist = SAMPLE_DECKLIST.replace(
+            '4 Fatal Push', '4 Fatal Pus'
+        ).replace('4 Thoughtseize', '4 Thoughtsieze')
+
+        with self.assertRaisesMessage(
+            AttributeError, 'Card data not found for fatal pus, thoughtsieze.'
+        ):
+            self.analyze(decklist)
+
+
+class AnalysisCacheTests(LocalScryfallTestCase):
+    def test_identical_decklists_share_cached_result(self):
+        fetcher = self.make_fetcher()
+        result_cache = CardCache()
+        decklist = SAMPLE_DECKLIST.replace(
+            '4 Fatal Push', '3 Fatal Push (AER) 57\r\n1 Fatal Push'
+        )
+        reordered_decklist = (
+            decklist.replace(
+                '3 Fatal Push (AER) 57\r\n1 Fatal Push',
+                '1 Fatal Push\r\n2 Fatal Push (AER) 57\r\n1 Fatal Push (AER) 57',
+            )
+            .replace('4 Thoughtseize\r\n', '')
+            .replace('4 Deadly Dispute', '4 Deadly Dispute\r\n4 Thoughtseize')
+        )
+
+        result = get_analysis(decklist, fetcher, result_cache)
+        self.scryfall.reset()
+        cached_result = get_analysis(reordered_decklist, fetcher, result_cache)
+
+        self.assertIs(cached_result, result)
+        self.assertEqual(self.scryfall.requests, [])
+        self.assertEqual(result_cache.stats()['hits'], 1)
+
+    def test_card_data_version_invalidates_cached_result(self):
+        fetcher = self.make_fetcher()
+        result_cache = CardCache()
+
+        with mock.patch.object(
+            CardDataFetcher, 'data_version', new_callable=mock.PropertyMock
+        ) as data_version:
+            data_version.return_value = '1'
+            get_analysis(SAMPLE_DECKLIST, fetcher, result_cache)
+            data_version.return_value = '2'
+            get_analysis(SAMPLE_DECKLIST, fetcher, result_cache)
+
+        self.assertEqual(result_cache.stats()['misses'], 2)
+        self.assertEqual(len(result_cache), 2)
+
+
+    def test_previous_analysis_is_updated_for_changed_cards(self):
+        fetcher = self.make_fetcher()
+        previous = analysis_state(
+            SAMPLE_DECKLIST, get_analysis(SAMPLE_DECKLIST, fetcher), fetcher
+        )
+        decklist = (
+            SAMPLE_DECKLIST.replace('4 Fatal Push', '2 Fatal Push')
+            .replace('4 Deadly Dispute\r\n', '')
+            .replace('3 Unlucky Witness', '3 Unlucky Witness\r\n2 Duress')
+        )
+
+        with mock.patch.object(
+            fetcher, 'get_cards_data', wraps=fetcher.get_cards_data
+        ) as get_cards_data:
+            result = get_analysis(decklist, fetcher, previous=previous)
+
+        get_cards_data.assert_called_once_with(
+            ['fatal push', 'deadly dispute', 'duress']
+        )
+        self.assertEqual(result['card_count'], 56)
+        self.assertEqual(result['cheap_card_draw_list'], [])
+        self.assertEqual(result, get_analysis(decklist, self.make_fetcher()))
+
+    def test_updated_analysis_lists_cards_in_deck_order(self):
+        fetcher = self.make_fetcher()
+        decklist = SAMPLE_DECKLIST.replace(
+            '4 Fatal Push', '4 Fatal Push\r\n4 Consider'
+        )
+        previous = analysis_state(
+            decklist, get_analysis(decklist, fetcher), fetcher
+        )
+        decklist = decklist.replace('4 Consider', '2 Consider')
+
+        result = get_analysis(decklist, fetcher, previous=previous)
+
+        self.assertEqual(
+            result['cheap_card_draw_list'], ['consider', 'deadly dispute']
+        )
+        self.assertEqual(result, get_analysis(decklist, self.make_fetcher()))
+
+
+class AnalyzeApiTests(LocalScryfallTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            'decklist_analyzer.views.get_card_data_fetcher',
+            return_value=self.make_fetcher(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_analyze_json_decklist(self):
+        response = self.client.post(
+            reverse('api_analyze'),
+            {'decklist': SAMPLE_DECKLIST.replace('\r\n', '\n')},
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['companion'], ['jegantha, the wellspring'])
+        self.assertEqual(result['card_count'], 60)
+        self.assertEqual(result['recommended_number_of_lands'], 22)
+        self.assertNotIn('sessionid', response.cookies)
+
+    def test_analyze_text_decklist(self):
+        response = self.client.post(
+            reverse('api_analyze'),
+            SAMPLE_DECKLIST,
+            content_type='text/plain',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cheap_card_draw_count'], 4)
+
+    @override_settings(SERVER_TIMING_LOG=True)
+    def test_analyze_reports_server_timing(self):
+        decklist = SAMPLE_DECKLIST.replace('1 Swamp', '1 Swamp\r\n1 Island')
+
+        with self.assertLogs('decklist_analyzer.timing') as logs:
+            response = self.client.post(
+                reverse('api_analyze'), decklist, content_type='text/plain'
+            )
+
+        phases = [
+            timing.split(';')[0]
+            for timing in response['Server-Timing'].split(', ')
+        ]
+        self.assertCountEqual(
+            phases, ['parse', 'analyze', 'fetch', 'upstream', 'classify', 'total']
+        )
+        log_line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(log_line['card_count'], 61)
+        self.assertEqual(log_line['cache_misses'], 23)
+        self.assertEqual(log_line['upstream_requests'], 1)
+        self.assertGreater(log_line['phases']['upstream'], 0)
+
+    def test_analyze_uploaded_decklist(self):
+        upload = SimpleUploadedFile(
+            'decklist.txt', SAMPLE_DECKLIST.replace('\r\n', '\n').encode()
+        )
+
+        response = self.client.post(reverse('api_analyze'), {'decklist': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['card_count'], 60)
+
+    def test_analyze_form_without_decklist(self):
+        upload = SimpleUploadedFile('deck.txt', SAMPLE_DECKLIST.encode())
+
+        for data in ({'deck': upload}, {}):
+            with self.subTest(data=list(data)):
+                response = self.client.post(reverse('api_analyze'), data)
+
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json()['error'],
+                    'The form must have a decklist field or file.',
+                )
+
+    def test_analyze_with_scryfall_unavailable(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        circuit_breaker.record_failure()
+        fetcher = self.make_fetcher(circuit_breaker=circuit_breaker)
+
+        with mock.patch(
+            'decklist_analyzer.views.get_card_data_fetcher', return_value=fetcher
+        ), mock.patch(
+            'decklist_analyzer.views.get_analysis_cache', return_value=CardCache()
+        ):
+            response = self.client.post(
+                reverse('api_analyze'), SAMPLE_DECKLIST, content_type='text/plain'
+            )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Scryfall is not responding', response.json()['error'])
+        self.assertEqual(self.scryfall.requests, [])
+
+    def test_analyze_invalid_decklist(self):
+        response = self.client.post(
+            reverse('api_analyze'), '4 Fatal Push', content_type='text/plain'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid entry', response.json()['error'])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed.')
+    @override_settings(MANA_SIMULATOR={'GAMES': 20000, 'TIME_BUDGET': 1.0})
+    def test_simulate_land_counts_around_recommended_number(self):
+        response = self.client.post(
+            reverse('api_simulate') + '?on_play=false',
+            SAMPLE_DECKLIST,
+            content_type='text/plain',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        simulation = response.json()['simulation']
+        self.assertEqual([s['lands'] for s in simulation], list(range(19, 26)))
+        self.assertEqual(simulation[0]['method'], 'monte_carlo')
+        self.assertLess(simulation[0]['flood'], simulation[-1]['flood'])
+        self.assertGreater(simulation[0]['screw'], simulation[-1]['screw'])
+
+    def test_colors_compares_sources_with_requirements(self):
+        response = self.client.post(
+            reverse('api_colors') + '?target=0.8',
+            SAMPLE_DECKLIST,
+            content_type='text/plain',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        colors = response.json()['colors']
+        self.assertEqual(list(colors), ['B', 'R'])
+        self.assertEqual(colors['R']['sources'], 14)
+        self.assertEqual(colors['B']['card'], 'Fatal Push')
+        self.assertEqual((colors['B']['pips'], colors['B']['turn']), (1, 1))
+        self.assertGreaterEqual(colors['B']['probability'], 0.8)
+
+        response = self.client.post(
+            reverse('api_colors') + '?target=1',
+            SAMPLE_DECKLIST,
+            content_type='text/plain',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncAnalyzeApiTests(LocalScryfallTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch(
+            'decklist_analyzer.views.get_card_data_fetcher',
+            return_value=self.make_fetcher(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_async_view_analyzes_and_reports_server_timing(self):
+        decklist = SAMPLE_DECKLIST.replace('1 Swamp', '1 Swamp\r\n1 Plains')
+        request = AsyncRequestFactory().post(
+            '/api/analyze', decklist, content_type='text/plain'
+        )
+
+        response = await ServerTimingMiddleware(api_analyze_async)(request)
+
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content)
+        self.assertEqual(result['card_count'], 61)
+        self.assertEqual(result['recommended_number_of_lands'], 22)
+        self.assertIn('upstream;dur=', response['Server-Timing'])
+        self.assertEqual(self.scryfall.requests, [('POST', '/cards/collection')])
+
+    async def test_async_analysis_matches_sync_analysis(self):
+        result = await aget_analysis(SAMPLE_DECKLIST, self.make_fetcher())
+
+        self.assertEqual(
+            result,
+            await asyncio.to_thread(
+                get_analysis, SAMPLE_DECKLIST, self.make_fetcher()
+            ),
+        )
+
+
+class MetricsTests(LocalScryfallTestCase):
+    def test_metrics_endpoint_reports_analyses(self):
+        with mock.patch(
+            'decklist_analyzer.views.get_card_data_fetcher',
+            return_value=self.make_fetcher(),
+        ):
+            self.client.post(
+                reverse('api_analyze'), SAMPLE_DECKLIST, content_type='text/plain'
+            )
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE how_many_upstream_latency_seconds histogram', text)
+        self.assertIn('how_many_analyses_total{outcome="ok"}', text)
+        self.assertIn('how_many_card_cache_entries ', text)
+        self.assertIn('how_many_process_resident_memory_bytes ', text)
+
+    def test_registry_merges_process_snapshots(self):
+        registry = MetricsRegistry()
+        counter = registry.counter('requests_total', 'Requests.')
+        registry.gauge('entries', 'Entries.', lambda: 3)
+        counter.inc(2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # The snapshot of a worker process that has exited
+            dead_snapshot = {
+                'pid': 2**22 + 1,
+                'metrics': {
+                    'requests_total': {
+                        'type': 'counter',
+                        'help': 'Requests.',
+                        'samples': [['requests_total', {}, 5]],
+                    },
+                    'entries': {
+                        'type': 'gauge',
+                        'help': 'Entries.',
+                        'samples': [['entries', {}, 7]],
+                    },
+                },
+            }
+            Path(tmp_dir, f'{2**22 + 1}-0.json').write_text(
+                json.dumps(dead_snapshot)
+            )
+            registry.set_directory(tmp_dir)
+
+            text = registry.render()
+            registry.set_directory(None)
+
+        self.assertIn('requests_total 7\n', text)
+        self.assertIn('entries 3\n', text)
+
+    def test_registry_keeps_counters_of_workers_with_a_reused_pid(self):
+        pid = 2**22 + 1
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Two workers with the same PID, the first one killed before the
+            # second one starts
+            workers = []
+            for value in (5, 2):
+                worker = MetricsRegistry(tmp_dir)
+                worker.counter('requests_total', 'Requests.').inc(value)
+                worker.gauge('entries', 'Entries.', lambda: 3)
+                with mock.patch(
+                    'decklist_analyzer.utils.metrics.os.getpid', return_value=pid
+                ):
+                    worker.flush()
+                workers.append(worker)
+
+            registry = MetricsRegistry(tmp_dir)
+            with mock.patch(
+                'decklist_analyzer.utils.metrics._is_alive', return_value=True
+            ):
+                live_text = registry.render()
+
+            with mock.patch(
+                'decklist_analyzer.utils.metrics.os.getpid', return_value=pid
+            ):
+                workers[1]._mark_own_process_dead()
+            exited_text = registry.render()
+            snapshot_names = sorted(
+                path.name for path in Path(tmp_dir).glob('*.json')
+            )
+            registry.set_directory(None)
+
+        self.assertIn('requests_total 7\n', live_text)
+        self.assertIn('entries 3\n', live_text)
+        self.assertIn('requests_total 7\n', exited_text)
+        self.assertNotIn('entries', exited_text)
+        self.assertEqual(len(snapshot_names), 2)
+        self.assertIn('dead-workers.json', snapshot_names)
+
+
+class CardStoreLookupTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.card_store = CardStore(Path(cls.tmp_dir.name) / 'cards.sqlite3')
+
+        # A second, rare printing of a mythic modal double-faced card
+        card_pool = json.loads(CARD_POOL_PATH.read_text(encoding='utf-8'))
+        awakening = next(
+            card for card in card_pool if card['name'].startswith('Agadeem')
+        )
+        card_pool.append(
+            {**awakening, 'set': 'sld', 'collector_number': '1500', 'rarity': 'rare'}
+        )
+        cls.card_store.ingest_bulk_data(io.StringIO(json.dumps(card_pool)))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_get_card_data_resolves_name_variants(self):
+        for card, name in (
+            ('lorien revealed', 'Lórien Revealed'),
+            ('FIRE/ICE', 'Fire // Ice'),
+            ('lim-dul’s vault', "Lim-Dûl's Vault"),
+            ('borrowing 100000 arrows', 'Borrowing 100,000 Arrows'),
+            ('stomp', 'Bonecrusher Giant // Stomp'),
+            ('jegantha', 'Jegantha, the Wellspring'),
+        ):
+            with self.subTest(card=card):
+                self.assertEqual(self.card_store.get_card_data(card).name, name)
+
+    def test_get_card_data_does_not_guess_ambiguous_names(self):
+        self.assertIsNone(self.card_store.get_card_data('elvish'))
+        self.assertIsNone(self.card_store.get_card_data('mountain goat'))
+
+    def test_analyzer_uses_rarity_of_listed_printings(self):
+        parser = DecklistParser(
+            "Deck\n2 Agadeem's Awakening (ZNR) 90\n"
+            "2 Agadeem's Awakening (SLD) 1500\n1 Agadeem's Awakening"
+        )
+        analyzer = Analyzer(
+            parser.parse_decklist(),
+            fetcher=CardDataFetcher(card_store=self.card_store, offline=True),
+        )
+        analyzer.analyze_decklist()
+
+        self.assertEqual(analyzer.card_count, 5)
+        self.assertEqual(analyzer.mythic_land_spell_mdfc_count, 3)
+        self.assertEqual(analyzer.non_mythic_land_spell_mdfc_count, 2)
+        self.assertIsNone(self.card_store.get_printing_data('sld', '1501'))
+
+
+class CardStoreIngestTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = Path(tmp_dir.name)
+        self.card_pool = json.loads(CARD_POOL_PATH.read_text(encoding='utf-8'))
+
+    def test_bulk_cards_are_decoded_across_chunk_boundaries(self):
+        card_store = CardStore(self.tmp_path / 'cards.sqlite3')
+        bulk_data = json.dumps(self.card_pool, indent=2)
+
+        for chunk_size in (1, 7, 1 << 20):
+            with self.subTest(chunk_size=chunk_size):
+                cards = card_store._iter_bulk_cards(
+                    io.StringIO(bulk_data), chunk_size=chunk_size
+                )
+                self.assertEqual(list(cards), self.card_pool)
+
+        with self.assertRaisesMessage(ValueError, 'Invalid bulk-data file.'):
+            list(card_store._iter_bulk_cards(io.StringIO(bulk_data[:-10])))
+
+    def test_first_printing_of_each_card_is_kept(self):
+        card_store = CardStore(self.tmp_path / 'cards.sqlite3')
+        fatal_push = next(
+            card for card in self.card_pool if card['name'] == 'Fatal Push'
+        )
+        bulk_data = [
+            fatal_push,
+            {**fatal_push, 'set': 'sld', 'collector_number': '1', 'rarity': 'rare'},
+            {**fatal_push, 'name': 'Fatal Push Token', 'layout': 'token'},
+        ]
+
+        card_count = card_store.ingest_bulk_data(
+            io.StringIO(json.dumps(bulk_data)), batch_size=1
+        )
+
+        self.assertEqual(card_count, 1)
+        self.assertEqual(card_store.get_card_data('fatal push').rarity, 'uncommon')
+        self.assertEqual(card_store.get_printing_data('SLD', '1').rarity, 'rare')
+        self.assertIsNone(card_store.get_card_data('fatal push token'))
+
+    def test_ingest_card_data_command(self):
+        bulk_path = self.tmp_path / 'oracle-cards.json'
+        bulk_path.write_text(json.dumps(self.card_pool), encoding='utf-8')
+        store_path = self.tmp_path / 'cards.sqlite3'
+        stdout = io.StringIO()
+
+        call_command(
+            'ingest_card_data', str(bulk_path), store=str(store_path), stdout=stdout
+        )
+
+        card_store = CardStore(store_path)
+        self.assertIn(f'Ingested {len(self.card_pool)} cards', stdout.getvalue())
+        self.assertEqual(
+            card_store.get_metadata()['card_count'], str(len(self.card_pool))
+        )
+        self.assertEqual(card_store.get_card_data('fatal push').name, 'Fatal Push')
+
+        with self.assertRaisesMessage(
+            CommandError, 'Pass either a bulk-data file or --download TYPE.'
+        ):
+            call_command('ingest_card_data', store=str(store_path))
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed.')
+class DeckMatrixTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.card_store = CardStore(Path(cls.tmp_dir.name) / 'cards.sqlite3')
+        with open(CARD_POOL_PATH, encoding='utf-8') as bulk_file:
+            cls.card_store.ingest_bulk_data(bulk_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def test_results_match_analyzer(self):
+        decklists = [
+            deck_path.read_text(encoding='utf-8')
+            for deck_path in sorted(
+                (CARD_POOL_PATH.parent / 'decks').glob('*.txt')
+            )
+        ] + [
+            SAMPLE_DECKLIST,
+            SAMPLE_DECKLIST.replace('4 Fatal Push', '4 Fatal Pus'),
+            'Deck\n4 Mountain\n4 Swamp',
+        ]
+        fetcher = CardDataFetcher(card_store=self.card_store, offline=True)
+
+        analyses = DeckMatrix(fetcher).analyze_decklists(
+            [DecklistParser(decklist).parse_decklist() for decklist in decklists]
+        )
+
+        self.assertEqual(len(analyses), len(decklists))
+        for decklist, (result, error) in zip(decklists, analyses):
+            with self.subTest(decklist=decklist[:40]):
+                try:
+                    expected = get_analysis(decklist, fetcher)
+                except (ValueError, AttributeError) as e:
+                    self.assertIsNone(result)
+                    self.assertEqual(type(error), type(e))
+                    self.assertEqual(str(error), str(e))
+                else:
+                    self.assertIsNone(error)
+                    self.assertEqual(
+                        json.dumps(result), json.dumps(expected)
+                    )
+
+
+class AnalyzeDecksCommandTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.store_path = Path(cls.tmp_dir.name) / 'cards.sqlite3'
+        with open(CARD_POOL_PATH, encoding='utf-8') as bulk_file:
+            CardStore(cls.store_path).ingest_bulk_data(bulk_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+        super().tearDownClass()
+
+    def analyze_decks(self, workers, engine='analyzer'):
+        decks_path = Path(self.tmp_dir.name) / 'decks.jsonl'
+        with open(decks_path, 'w', encoding='utf-8') as decks_file:
+            for deck_id in range(5):
+                decklist = SAMPLE_DECKLIST.replace('\r\n', '\n')
+                decks_file.write(json.dumps({'id': deck_id, 'decklist': decklist}))
+                decks_file.write('\n')
+            decks_file.write(json.dumps({'id': 'bad', 'decklist': 'Deck'}) + '\n')
+
+        output, errors = io.StringIO(), io.StringIO()
+        with self.settings(
+            CARD_STORE_PATH=str(self.store_path), CARD_DATA_OFFLINE=True
+        ), mock.patch('sys.stdout', output), mock.patch('sys.stderr', errors):
+            call_command(
+                'analyze_decks',
+                str(decks_path),
+                workers=workers,
+                batch_size=2,
+                engine=engine,
+                stderr=io.StringIO(),
+            )
+
+        results = [json.loads(line) for line in output.getvalue().splitlines()]
+        errors = [json.loads(line) for line in errors.getvalue().splitlines()]
+        return results, errors
+
+    def test_analyze_decks_in_order(self):
+        runs = [(1, 'analyzer'), (2, 'analyzer')]
+        if numpy is not None:
+            runs.append((2, 'matrix'))
+        for workers, engine in runs:
+            with self.subTest(workers=workers, engine=engine):
+                results, errors = self.analyze_decks(workers, engine)
+
+                self.assertEqual([r['id'] for r in results], [0, 1, 2, 3, 4])
+                self.assertEqual(results[0]['result']['card_count'], 60)
+                self.assertEqual(
+                    results[0]['result']['recommended_number_of_lands'], 22
+                )
+                self.assertEqual([e['id'] for e in errors], ['bad'])
+
+
+class WarmCardCacheCommandTests(SimpleTestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_path = Path(tmp_dir.name)
+        with open(CARD_POOL_PATH, encoding='utf-8') as bulk_file:
+            CardStore(self.tmp_path / 'cards.sqlite3').ingest_bulk_data(
+                bulk_file
+            )
+
+    def test_snapshot_restores_unexpired_cards(self):
+        cache = CardCache(max_entries=10, ttl=60)
+        cache.set('Mountain', 'mountain')
+        cache.set('Swamp', 'swamp')
+        cache.dump(self.tmp_path / 'cards.snapshot')
+
+        restored = CardCache(max_entries=1)
+        restored.set('Island', 'island')
+        self.assertEqual(restored.load(self.tmp_path / 'cards.snapshot'), 0)
+        self.assertEqual(restored.get('Island'), 'island')
+
+        with mock.patch('time.time', return_value=time.time() + 120):
+            self.assertEqual(
+                CardCache().load(self.tmp_path / 'cards.snapshot'), 0
+            )
+        self.assertEqual(
+            CardCache().load(self.tmp_path / 'cards.snapshot'), 2
+        )
+
+    def test_warm_card_cache_keeps_most_played_cards(self):
+        decks_path = self.tmp_path / 'decks.jsonl'
+        decks_path.write_text(
+            json.dumps({'id': 1, 'decklist': 'Deck\n4 Mountain\n1 Swamp'})
+            + '\n'
+            + json.dumps({'id': 2, 'decklist': 'Deck\n2 Mountain\n3 Island'})
+            + '\n'
+            + json.dumps({'id': 3, 'decklist': 'Deck'})
+            + '\n',
+            encoding='utf-8',
+        )
+        snapshot_path = self.tmp_path / 'cards.snapshot'
+
+        stdout = io.StringIO()
+        with self.settings(
+            CARD_STORE_PATH=str(self.tmp_path / 'cards.sqlite3'),
+            CARD_DATA_OFFLINE=True,
+        ), mock.patch('decklist_analyzer.card_data._card_cache', None):
+            call_command(
+                'warm_card_cache',
+                decks=str(decks_path),
+                top=2,
+                snapshot=str(snapshot_path),
+                stdout=stdout,
+            )
+
+        self.assertIn('Warmed 2 cards (0 not found)', stdout.getvalue())
+        # The most played card is the last to be evicted
+        cache = CardCache(max_entries=1)
+        self.assertEqual(cache.load(snapshot_path), 1)
+        self.assertEqual(cache.get('mountain').name, 'Mountain')
+
+    def test_warm_card_cache_caches_format_cards_under_parsed_names(self):
+        decks_path = self.tmp_path / 'decks.jsonl'
+        decks_path.write_text(
+            json.dumps({'id': 1, 'decklist': 'Deck\n4 Mountain'}) + '\n',
+            encoding='utf-8',
+        )
+        snapshot_path = self.tmp_path / 'cards.snapshot'
+
+        # Scryfall's search returns the printed names of the cards
+        search_format = mock.patch(
+            'decklist_analyzer.management.commands.warm_card_cache.Command.'
+            '_search_format',
+            return_value=['Mountain', 'Fatal Push'],
+        )
+
+        stdout = io.StringIO()
+        with self.settings(
+            CARD_STORE_PATH=str(self.tmp_path / 'cards.sqlite3'),
+            CARD_DATA_OFFLINE=True,
+        ), mock.patch(
+            'decklist_analyzer.card_data._card_cache', None
+        ), search_format:
+            call_command(
+                'warm_card_cache',
+                formats=['pioneer'],
+                decks=str(decks_path),
+                snapshot=str(snapshot_path),
+                stdout=stdout,
+            )
+
+        self.assertIn('Warmed 2 cards (0 not found)', stdout.getvalue())
+        cache = CardCache()
+        self.assertEqual(cache.load(snapshot_path), 2)
+        self.assertEqual(cache.get('fatal push').name, 'Fatal Push')
+        self.assertIsNone(cache.get('Fatal Push'))
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    def test_benchmark_fails_on_regression(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results_path = Path(tmp_dir) / 'results.json'
+            call_command(
+                'benchmark',
+                iterations=1,
+                bulk_decks=3,
+                load_analyses=4,
+                load_latency=0.01,
+                output=str(results_path),
+            )
+            results = json.loads(results_path.read_text())['results']
+
+            self.assertIn('analyze_warm/commander_100', results)
+            self.assertEqual(results['analyze_bulk']['iterations'], 3)
+
+            baseline_path = Path(tmp_dir) / 'baseline.json'
+            baseline = {
+                name: {'median_us': result['median_us'] / 10}
+                for name, result in results.items()
+            }
+            baseline_path.write_text(json.dumps({'results': baseline}))
+
+            with self.assertRaisesMessage(CommandError, 'Regressions over 20%'):
+                call_command(
+                    'benchmark',
+                    iterations=1,
+                    bulk_decks=3,
+                    load_analyses=4,
+                    load_latency=0.01,
+                    output=str(results_path),
+                    baseline=str(baseline_path),
+                    stderr=io.StringIO(),
+                )
+
+
+class ReferenceCardClassifier:
+    """
+    The chained substring checks the CardClassifier rule table replaced, kept
+    as the reference of the differential tests.
+    """
+
+    def classify(self, card_data):
+        type_line = card_data.get('type_line', '').lower()
+        layout = card_data.get('layout', '').lower()
+        oracle_text = card_data.get('oracle_text', '').lower()
+        cmc = card_data.get('cmc', 0)
+        flags = {
+            'non_land': False,
+            'cmc': cmc,
+            'land_spell_mdfc': False,
+            'mythic': 'mythic' in card_data.get('rarity', '').lower(),
+            'cheap_card_draw': False,
+            'cheap_mana_ramp': False,
+            'cheap_card_scry': False,
+        }
+        faces = card_data.get('card_faces', [{}])
+        if not ('land' in type_line) or (
+            'modal_dfc' in layout
+            and not ('land' in faces[0].get('type_line', '').lower())
+        ):
+            flags['non_land'] = True
+            flags['land_spell_mdfc'] = (
+                'modal_dfc' in layout
+                and 'land' in faces[1].get('type_line', '').lower()
+            )
+            draw = self._is_cheap_card_draw(oracle_text, cmc, type_line)
+            flags['cheap_card_draw'] = draw
+            flags['cheap_mana_ramp'] = self._is_cheap_mana_ramp(
+                oracle_text, cmc, type_line, draw
+            )
+            flags['cheap_card_scry'] = self._is_cheap_card_scry(
+                oracle_text, cmc, type_line, draw
+            )
+        return flags
+
+    def _is_cheap_card_draw(self, oracle_text, cmc, type_line):
+        if oracle_text:
+            if cmc <= 2.0:
+                if 'draw' in oracle_text:
+                    if not (
+                        '{4}' in oracle_text
+                        or 'blood token' in oracle_text
+                        or 'investigate' in oracle_text
+                    ):
+                        if 'creature' in type_line:
+                            if (
+                                'when' in oracle_text
+                                and 'enters' in oracle_text
+                            ):
+                                return True
+                        else:
+                            return True
+                elif not ('creature' in type_line):
+                    if (
+                        'look' in oracle_text
+                        and 'library' in oracle_text
+                        and 'put' in oracle_text
+                        and 'your hand' in oracle_text
+                    ):
+                        if not ('pay' in oracle_text):
+                            return True
+            if (
+                r'cycling {1}' in oracle_text
+                or r'cycling {w}' in oracle_text
+                or r'cycling {b}' in oracle_text
+                or r'cycling {u}' in oracle_text
+                or r'cycling {r}' in oracle_text
+                or r'cycling {g}' in oracle_text
+            ):
+                return True
+        return False
+
+    def _is_cheap_mana_ramp(self, oracle_text, cmc, type_line, draw):
+        if oracle_text:
+            if cmc <= 2.0:
+                if not draw:
+                    if 'add ' in oracle_text:
+                        if not ('add its ability' in oracle_text) or not (
+                            'add a lore counter' in oracle_text
+                        ):
+                            if 'creature' in type_line:
+                                if not ('dies' in oracle_text):
+                                    return True
+                            else:
+                                return True
+                    elif (
+                        ('untap target land' in oracle_text)
+                        or ('untap target snow land' in oracle_text)
+                        or ('untap target forest' in oracle_text)
+                        or ('untap target swamp' in oracle_text)
+                        or ('untap target mountain' in oracle_text)
+                        or ('untap target island' in oracle_text)
+                        or ('untap target plains' in oracle_text)
+                    ):
+                        return True
+                    elif (
+                        'search' in oracle_text
+                        and 'your library' in oracle_text
+                        and 'land' in oracle_text
+                    ):
+                        if not ('sacrifice' in oracle_text):
+                            return True
+                    elif (
+                        ('enchanted land' in oracle_text)
+                        or ('enchanted snow land' in oracle_text)
+                        or ('enchanted forest' in oracle_text)
+                        or ('enchanted swamp' in oracle_text)
+                        or ('enchanted mountain' in oracle_text)
+                        or ('enchanted island' in oracle_text)
+                        or ('enchanted plains' in oracle_text)
+                    ):
+                        if 'adds an additional' in oracle_text:
+                            return True
+                    elif (
+                        'put' in oracle_text
+                        and 'creature card with' in oracle_text
+                        and 'from your hand onto the battlefield'
+                        in oracle_text
+                    ):
+                        return True
+        return False
+
+    def _is_cheap_card_scry(self, oracle_text, cmc, type_line, draw):
+        if oracle_text:
+            if cmc <= 2.0:
+                if not draw:
+                    if 'scry ' in oracle_text:
+                        if 'creature' in type_line:
+                            if (
+                                'when' in oracle_text
+                                and 'enters' in oracle_text
+                            ):
+                                return True
+                        else:
+                            return True
+        return False
+
+
+def load_card_pool():
+    """
+    Returns the fixture card pool, with every card of the local card store
+    when one has been ingested.
+    """
+    with open(CARD_POOL_PATH, encoding='utf-8') as fixture:
+        card_pool = json.load(fixture)
+
+    card_store = CardStore(settings.CARD_STORE_PATH)
+    if card_store.exists():
+        card_pool.extend(
+            card.to_card_data() for card in card_store.iter_card_data()
+        )
+    return card_pool
+
+
+def generate_card_pool(size, seed=0):
+    """
+    Returns random cards whose oracle texts are made of rule tokens, glued
+    together so that the tokens overlap and contain each other.
+    """
+    rng = random.Random(seed)
+    tokens = sorted(ORACLE_TEXT_TOKENS) + ['island', 'whenever', ' ', '.']
+    type_lines = ['Instant', 'Creature — Elf', 'Land', 'Artifact Creature']
+    card_pool = []
+    for _ in range(size):
+        card_pool.append(
+            {
+                'name': 'Generated Card',
+                'layout': rng.choice(['normal', 'modal_dfc']),
+                'type_line': rng.choice(type_lines),
+                'oracle_text': ''.join(
+                    rng.choice(tokens) for _ in range(rng.randint(0, 12))
+                ),
+                'cmc': float(rng.randint(0, 4)),
+                'rarity': rng.choice(['common', 'mythic']),
+                'card_faces': [
+                    {'type_line': rng.choice(type_lines)},
+                    {'type_line': rng.choice(type_lines)},
+                ],
+            }
+        )
+    return card_pool
+
+
+class ManaSimulatorTests(SimpleTestCase):
+    def test_exact_land_drops(self):
+        simulation = ManaSimulator(60).simulate([17, 24])
+
+        self.assertEqual(simulation[1]['method'], 'exact')
+        for result in simulation:
+            drops = result['land_drops']
+            self.assertEqual(drops, sorted(drops, reverse=True))
+        # Seeing at least 4 lands in 10 cards of a 60-card deck with 24 lands
+        self.assertAlmostEqual(
+            ManaSimulator(60, max_mulligans=0).simulate([24])[0]['land_drops'][3],
+            0.6318,
+            places=4,
+        )
+        self.assertGreater(simulation[1]['keep_rate'], simulation[0]['keep_rate'])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed.')
+    def test_sampled_games_match_exact_probabilities(self):
+        simulator = ManaSimulator(100, games=200000, time_budget=10, seed=1)
+
+        exact = simulator.simulate([36, 40])
+        sampled = simulator._simulate_games([36, 40])
+
+        for exact_result, sampled_result in zip(exact, sampled):
+            self.assertEqual(sampled_result['games'], 200000)
+            for key in ('keep_rate', 'average_mulligans', 'flood', 'screw'):
+                self.assertAlmostEqual(
+                    exact_result[key], sampled_result[key], delta=0.005
+                )
+
+
+class ColorRequirementsTests(SimpleTestCase):
+    def test_parse_pips_and_mana_value(self):
+        self.assertEqual(parse_mana_cost('{1}{R}{R}'), ({'R': 2}, 3))
+        self.assertEqual(parse_mana_cost('{X}{B}{R/G}{2/U}{W/P}'), ({'B': 1}, 5))
+
+    def test_required_sources_from_tables(self):
+        tables = SourceTables()
+
+        # Seeing a source in the 7 cards of the opening hand with 90%
+        self.assertEqual(tables.required_sources(60, 7, 1, 0.9), 16)
+        self.assertLess(tables.probability(60, 7, 1, 15), 0.9)
+        self.assertGreaterEqual(tables.probability(60, 7, 1, 16), 0.9)
+        self.assertGreater(
+            tables.required_sources(60, 8, 2, 0.9),
+            tables.required_sources(60, 8, 1, 0.9),
+        )
+        self.assertEqual(tables.required_sources(60, 7, 0, 0.9), 0)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'source_tables.pickle'
+            tables.dump(path)
+            loaded = SourceTables.load(path)
+        self.assertEqual(loaded._tables, tables._tables)
+        # Other deck sizes are computed when they are first used
+        self.assertNotIn(61, loaded._tables)
+        self.assertEqual(loaded.required_sources(61, 7, 1, 0.9), 17)
+
+    def test_source_tables_are_only_written_to_a_configured_path(self):
+        tables = _load_source_tables(None)
+        self.assertEqual(tables._tables, {})
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'source_tables.pickle'
+            tables = _load_source_tables(path)
+            loaded = _load_source_tables(path)
+        self.assertEqual(sorted(tables._tables), list(DECK_SIZES))
+        self.assertEqual(loaded._tables, tables._tables)
+
+
+class CardClassifierTests(SimpleTestCase):
+    def assert_same_flags(self, card_pool):
+        classifier = CardClassifier()
+        reference = ReferenceCardClassifier()
+
+        for card_data in card_pool:
+            flags = classifier.classify(card_data)
+            del flags['rules']
+            self.assertEqual(
+                flags, reference.classify(card_data), card_data['name']
+            )
+
+    def test_same_flags_as_reference_on_card_pool(self):
+        self.assert_same_flags(load_card_pool())
+
+    def test_same_flags_as_reference_on_overlapping_tokens(self):
+        self.assert_same_flags(generate_card_pool(5000))
+
+    def assert_stored_flags_match_reference(self, card_store):
+        reference = ReferenceCardClassifier()
+
+        for card in card_store.iter_card_data():
+            flags = dict(card.flags)
+            self.assertEqual(flags.pop('rules'), RULES_FINGERPRINT)
+            self.assertEqual(
+                flags, reference.classify(card.to_card_data()), card.name
+            )
+
+    def test_flags_stored_on_ingest_match_reference(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            card_store = CardStore(Path(tmp_dir) / 'cards.sqlite3')
+            with open(CARD_POOL_PATH, encoding='utf-8') as bulk_file:
+                card_store.ingest_bulk_data(bulk_file)
+
+            self.assert_stored_flags_match_reference(card_store)
+
+    def test_classify_cards_recomputes_flags_of_other_rules(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store_path = Path(tmp_dir) / 'cards.sqlite3'
+            card_store = CardStore(store_path)
+            with open(CARD_POOL_PATH, encoding='utf-8') as bulk_file:
+                card_count = card_store.ingest_bulk_data(bulk_file)
+            with sqlite3.connect(store_path) as connection:
+                connection.execute(
+                    "UPDATE cards SET flags = json_object('rules', 'old')"
+                )
+            connection.close()
+            stdout = io.StringIO()
+
+            call_command('classify_cards', store=str(store_path), stdout=stdout)
+
+            self.assertIn(f'Classified {card_count} cards', stdout.getvalue())
+            self.assert_stored_flags_match_reference(card_store)
+            self.assertEqual(card_store.classify_cards(), 0)
+
+    def test_get_flags_reclassifies_flags_of_other_rules(self):
+        card = CardRecord(
+            'Opt',
+            type_line='Instant',
+            cmc=1.0,
+            oracle_text='Draw a card.',
+            flags={'rules': 'old', 'cheap_card_draw': False},
+        )
+
+        flags = CardClassifier().get_flags(card)
+
+        self.assertTrue(flags['cheap_card_draw'])
+        self.assertIs(card.flags, flags)
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'Set HOW_MANY_BENCHMARKS=1 to run.')
+class CardClassifierBenchmark(SimpleTestCase):
+    def test_classify_card_pool(self):
+        card_pool = load_card_pool() * 20
+        # The replaced checks read the Scryfall objects, and CardClassifier
+        # classifies the card records they are stored as since then
+        card_records = [CardRecord.from_card_data(card) for card in card_pool]
+        timings = {}
+
+        for name, classifier, cards in (
+            ('reference', ReferenceCardClassifier(), card_pool),
+            ('rule table', CardClassifier(), card_records),
+        ):
+            start = time.perf_counter()
+            for card in cards:
+                classifier.classify(card)
+            timings[name] = time.perf_counter() - start
+
+        print(
+            f'\nClassified {len(card_pool)} cards: '
+            + ', '.join(
+                f'{name} {seconds * 1e6 / len(card_pool):.2f} us/card'
+                for name, seconds in timings.items()
+            )
+            + f', speedup {timings["reference"] / timings["rule table"]:.2f}x'
+        )
+
+
+class ReferenceDecklistParser:
+    """
+    The multi-pass parser the streaming DecklistParser replaced, kept as the
+    reference of the differential tests.
+    """
+
+    def __init__(self, decklist):
+        self._decklist = decklist.lower().strip()
+        self.parsed_decklist = {'companion': {}, 'deck': {}, 'sideboard': {}}
+
+    def parse_decklist(self):
+        lines = self._decklist.split('\r\n')
+        if not self._is_valid_decklist(lines):
+            raise KeyError('Invalid entry.')
+
+        current_section = None
+        for line in lines:
+            if line.startswith(('companion', 'deck', 'sideboard')):
+                current_section = line.strip()
+                continue
+
+            match = re.search(
+                r'^\s*(?P<quantity>\d+)\s+(?P<card_name>[\w\s\'\,\-]+)', line
+            )
+            if match:
+                set_info = re.search(
+                    r'\((?P<set_code>\w+)\)\s+(?P<card_set_id>\d+)', line
+                )
+                self.parsed_decklist[current_section].setdefault(
+                    match.group('card_name').strip(), []
+                ).append(
+                    {
+                        'quantity': int(match.group('quantity')),
+                        'set_code': set_info and set_info.group('set_code'),
+                        'card_set_id': set_info
+                        and set_info.group('card_set_id'),
+                    }
+                )
+        return self.parsed_decklist
+
+    def _is_valid_decklist(self, lines):
+        if 'companion' in lines[0]:
+            if 'deck' not in lines[3]:
+                return False
+        elif 'deck' not in lines[0]:
+            return False
+
+        after_deck = lines[lines.index('deck') + 1 :]
+        if '' in after_deck:
+            if 'sideboard' in after_deck:
+                return after_deck.index('') == after_deck.index('sideboard') - 1
+            return after_deck.index('') + 1 == len(after_deck)
+        return 'sideboard' not in after_deck
+
+
+DECKLIST_VARIANTS = [
+    SAMPLE_DECKLIST,
+    '  \r\n' + SAMPLE_DECKLIST + '\r\n \r\n',
+    SAMPLE_DECKLIST.split('\r\n\r\nSideboard')[0],
+    SAMPLE_DECKLIST.split('Deck\r\n', 1)[1].join(['Deck\r\n', '']),
+    SAMPLE_DECKLIST.replace('4 Fatal Push', '4 Fatal Push (AER) 57'),
+    SAMPLE_DECKLIST.replace('\r\n\r\nSideboard', '\r\nSideboard'),
+    SAMPLE_DECKLIST.replace('Sideboard', 'Sideboard\r\n'),
+    SAMPLE_DECKLIST.replace('Deck', 'Decklist'),
+    'Deck\r\n4 Fatal Push\r\n4 Fatal Push (AER) 57\r\n\r\nSideboard\r\n2 Duress',
+    'Deck',
+    '4 Fatal Push',
+]
+
+
+class DecklistParserTests(SimpleTestCase):
+    def parse(self, parser_class, decklist):
+        try:
+            return parser_class(decklist).parse_decklist()
+        except (KeyError, ValueError, IndexError) as e:
+            return type(e)
+
+    def test_parser_matches_reference_parser(self):
+        for decklist in DECKLIST_VARIANTS:
+            with self.subTest(decklist=decklist[:40]):
+                expected = self.parse(ReferenceDecklistParser, decklist)
+                if expected in (ValueError, IndexError):
+                    expected = KeyError
+
+                self.assertEqual(self.parse(DecklistParser, decklist), expected)
+
+    def test_parser_keeps_punctuation_of_card_names(self):
+        parsed_decklist = DecklistParser(
+            'Deck\n2 Fire // Ice (MH2) 290\n1 Ach! Hans, Run!'
+        ).parse_decklist()
+
+        self.assertEqual(
+            list(parsed_decklist['deck']), ['fire // ice', 'ach! hans, run!']
+        )
+
+    def test_parser_strips_printing_markers_from_card_names(self):
+        parsed_decklist = DecklistParser(
+            'Deck\n2 Fatal Push *F*\n2 Fatal Push (AER) 57 *E*\n1 Duress *F* '
+        ).parse_decklist()
+
+        self.assertEqual(
+            parsed_decklist['deck'],
+            {
+                'fatal push': [
+                    {'quantity': 2, 'set_code': None, 'card_set_id': None},
+                    {'quantity': 2, 'set_code': 'aer', 'card_set_id': '57'},
+                ],
+                'duress': [
+                    {'quantity': 1, 'set_code': None, 'card_set_id': None}
+                ],
+            },
+        )
+
+    def test_parser_accepts_any_line_ending_and_iterator(self):
+        expected = ReferenceDecklistParser(SAMPLE_DECKLIST).parse_decklist()
+        lf_decklist = SAMPLE_DECKLIST.replace('\r\n', '\n')
+
+        for decklist in (
+            lf_decklist,
+            SAMPLE_DECKLIST.replace('\r\n', '\r'),
+            io.StringIO(lf_decklist),
+            io.BytesIO(SAMPLE_DECKLIST.encode()),
+            iter(SAMPLE_DECKLIST.split('\r\n')),
+        ):
+            with self.subTest(decklist=type(decklist).__name__):
+                self.assertEqual(
+                    DecklistParser(decklist).parse_decklist(), expected
+                )
+
+
+@unittest.skipUnless(RUN_BENCHMARKS, 'Set HOW_MANY_BENCHMARKS=1 to run.')
+class DecklistParserBenchmark(SimpleTestCase):
+    def test_parse_decklists(self):
+        decklists = [SAMPLE_DECKLIST] * 5000
+        line_count = sum(decklist.count('\r\n') + 1 for decklist in decklists)
+        timings = {}
+
+        for name, parser_class in (
+            ('reference', ReferenceDecklistParser),
+            ('streaming', DecklistParser),
+        ):
+            start = time.perf_counter()
+            for decklist in decklists:
+                parser_class(decklist).parse_decklist()
+            timings[name] = time.perf_counter() - start
+
+        print(
+            f'\nParsed {len(decklists)} decklists: '
+            + ', '.join(
+                f'{name} {line_count / seconds:,.0f} lines/s'
+                for name, seconds in timings.items()
+            )
+            + f', speedup {timings["reference"] / timings["streaming"]:.2f}x'
+        )
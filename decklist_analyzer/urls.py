@@ -1,9 +1,32 @@
+from django.conf import settings
 from django.urls import path
 
-from decklist_analyzer.views import index
+from decklist_analyzer.views import (
+    api_analyze,
+    api_analyze_async,
+    api_colors,
+    api_simulate,
+    index,
+    index_async,
+    metrics,
+)
+
+# The async views are served when the project runs under an ASGI server
+if getattr(settings, 'ASYNC_VIEWS', False):
+    index_view, api_analyze_view = index_async, api_analyze_async
+else:
+    index_view, api_analyze_view = index, api_analyze
 
 # Define URL patterns for the Django project.
 urlpatterns = [
     # Pattern for the root URL (Homepage)
-    path('', index, name='index'),
+    path('', index_view, name='index'),
+    # Pattern for the JSON analysis API
+    path('api/analyze', api_analyze_view, name='api_analyze'),
+    # Pattern for the mana base simulation API
+    path('api/simulate', api_simulate, name='api_simulate'),
+    # Pattern for the color requirements API
+    path('api/colors', api_colors, name='api_colors'),
+    # Pattern for the Prometheus metrics
+    path('metrics', metrics, name='metrics'),
 ]
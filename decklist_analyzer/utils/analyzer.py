@@ -1,7 +1,27 @@
 import math
 
+from decklist_analyzer.utils.card_classifier import CardClassifier
 from decklist_analyzer.utils.card_data_fetcher import CardDataFetcher
 
+# The statistics of an analysis, restored by Analyzer.from_analysis()
+STATISTICS = (
+    'card_count',
+    'non_land_count',
+    'non_land_cmcs_count',
+    'cheap_card_draw_count',
+    'cheap_card_draw_list',
+    'cheap_card_scry_count',
+    'cheap_card_scry_list',
+    'cheap_mana_ramp_count',
+    'cheap_mana_ramp_list',
+    'non_mythic_land_spell_mdfc_count',
+    'non_mythic_land_spell_mdfc_list',
+    'mythic_land_spell_mdfc_count',
+    'mythic_land_spell_mdfc_list',
+    'average_cmc',
+    'recommended_number_of_lands',
+)
+
 
 class Analyzer:
     """
@@ -9,6 +29,8 @@ class Analyzer:
 
     Attributes:
         _parsed_decklist (dict): A dictionary containing the parsed decklist data.
+        _fetcher (CardDataFetcher): The fetcher used to look up card data.
+        _classifier (CardClassifier): The classifier of the deck's cards.
         _card_count (int): Total count of cards in the deck.
         _non_land_count (int): Count of non-land cards in the deck.
         _non_land_cmcs_count (int): Total converted mana cost of non-land cards.
@@ -26,17 +48,25 @@ class Analyzer:
         _recommended_number_of_lands (float): Recommended number of lands based on analysis.
 
     Methods:
+        from_analysis(): Creates an Analyzer with the statistics of a previous analysis.
         analyze_decklist(): Analyzes the parsed decklist and populates statistics attributes.
+        aanalyze_decklist(): Analyzes the parsed decklist without blocking the event loop.
+        update_decklist(): Updates the statistics for the changed cards of a new decklist.
+        aupdate_decklist(): Updates the statistics without blocking the event loop.
     """
 
-    def __init__(self, parsed_decklist):
+    def __init__(self, parsed_decklist, fetcher=None):
         """
         Initializes the Analyzer instance.
 
         Args:
             parsed_decklist (dict): A dictionary containing the parsed decklist data.
+            fetcher (CardDataFetcher): The fetcher used to look up card data.
+                A new CardDataFetcher is used if not given.
         """
         self._parsed_decklist = parsed_decklist
+        self._fetcher = fetcher
+        self._classifier = CardClassifier()
         self._card_count = 0
         self._non_land_count = 0
         self._non_land_cmcs_count = 0
@@ -53,6 +83,30 @@ class Analyzer:
         self._average_cmc = 0.0
         self._recommended_number_of_lands = 0.0
 
+    @classmethod
+    def from_analysis(cls, parsed_decklist, result, fetcher=None):
+        """
+        Creates an Analyzer with the statistics of a previous analysis of a
+        decklist, so that they can be updated with update_decklist().
+
+        Args:
+            parsed_decklist (dict): The parsed decklist that was analyzed.
+            result (dict): The statistics of the analysis, as serialized by
+                serialize_analysis().
+            fetcher (CardDataFetcher): The fetcher used to look up card data.
+
+        Returns:
+            Analyzer: The Analyzer of the decklist.
+        """
+        analyzer = cls(parsed_decklist, fetcher=fetcher)
+        for statistic in STATISTICS:
+            value = result[statistic]
+            # The lists of the result may be shared with a cache
+            if isinstance(value, list):
+                value = list(value)
+            setattr(analyzer, f'_{statistic}', value)
+        return analyzer
+
     @property
     def card_count(self):
         """
@@ -162,24 +216,248 @@ class Analyzer:
         """
         Analyzes the parsed decklist and populates various statistics attributes.
         """
-        fetcher = CardDataFetcher()
+        fetcher = self._fetcher or CardDataFetcher()
+        maindeck = self._parsed_decklist['deck']
 
-        # Count the number of cards in the companion and maindeck
-        companion = len(self._parsed_decklist['companion'])
+        # Resolve the listed printings first, then by name every maindeck card
+        # with a printing that is not listed or not found, in as few requests
+        # as possible
+        printings_data = fetcher.get_printings_data(
+            self._listed_printings(maindeck)
+        )
+        cards_data, not_found = fetcher.get_cards_data(
+            self._cards_to_look_up(maindeck, printings_data)
+        )
+        self._analyze_cards(printings_data, cards_data, not_found)
+
+    async def aanalyze_decklist(self):
+        """
+        Analyzes the parsed decklist like analyze_decklist() does, awaiting
+        the card data instead of blocking while it is fetched.
+        """
+        fetcher = self._fetcher or CardDataFetcher()
+        maindeck = self._parsed_decklist['deck']
+
+        printings_data = await fetcher.aget_printings_data(
+            self._listed_printings(maindeck)
+        )
+        cards_data, not_found = await fetcher.aget_cards_data(
+            self._cards_to_look_up(maindeck, printings_data)
+        )
+        self._analyze_cards(printings_data, cards_data, not_found)
+
+    def update_decklist(self, parsed_decklist, changed_cards):
+        """
+        Updates the statistics for a new version of the analyzed decklist, in
+        time proportional to the number of changed cards.
+
+        The copies of the changed cards in the analyzed decklist are taken
+        out of the statistics, and their copies in the new decklist are added.
+        Only the changed cards are looked up, from the card cache for the
+        ones that were just analyzed.
+
+        Args:
+            parsed_decklist (dict): The new version of the parsed decklist.
+            changed_cards (list): The maindeck cards whose copies differ
+                between the analyzed decklist and the new one.
+        """
+        fetcher = self._fetcher or CardDataFetcher()
+        changes = self._changes(parsed_decklist, changed_cards)
+
+        printings_data = fetcher.get_printings_data(
+            self._listed_printings(changes)
+        )
+        cards_data, not_found = fetcher.get_cards_data(
+            self._cards_to_look_up(changes, printings_data)
+        )
+        self._update_cards(
+            parsed_decklist, changed_cards, printings_data, cards_data, not_found
+        )
+
+    async def aupdate_decklist(self, parsed_decklist, changed_cards):
+        """
+        Updates the statistics for a new version of the analyzed decklist like
+        update_decklist() does, awaiting the card data instead of blocking
+        while it is fetched.
+
+        Args:
+            parsed_decklist (dict): The new version of the parsed decklist.
+            changed_cards (list): The maindeck cards whose copies differ
+                between the analyzed decklist and the new one.
+        """
+        fetcher = self._fetcher or CardDataFetcher()
+        changes = self._changes(parsed_decklist, changed_cards)
+
+        printings_data = await fetcher.aget_printings_data(
+            self._listed_printings(changes)
+        )
+        cards_data, not_found = await fetcher.aget_cards_data(
+            self._cards_to_look_up(changes, printings_data)
+        )
+        self._update_cards(
+            parsed_decklist, changed_cards, printings_data, cards_data, not_found
+        )
+
+    def _changes(self, parsed_decklist, changed_cards):
+        """
+        Returns the copies of the changed cards in the analyzed decklist and
+        in its new version, to be looked up at once.
+
+        Args:
+            parsed_decklist (dict): The new version of the parsed decklist.
+            changed_cards (list): The changed maindeck cards.
+
+        Returns:
+            dict: The old and new printings of each changed card.
+        """
         maindeck = self._parsed_decklist['deck']
+        new_maindeck = parsed_decklist['deck']
+        return {
+            card: maindeck.get(card, []) + new_maindeck.get(card, [])
+            for card in changed_cards
+        }
+
+    def _listed_printings(self, maindeck):
+        """
+        Returns the printings listed for the maindeck cards.
+
+        Args:
+            maindeck (dict): The parsed maindeck of the decklist.
+
+        Returns:
+            list: The set code and collector number of each listed printing.
+        """
+        return [
+            self._printing(card_info)
+            for card_info_list in maindeck.values()
+            for card_info in card_info_list
+            if card_info['set_code']
+        ]
+
+    def _cards_to_look_up(self, maindeck, printings_data):
+        """
+        Returns the maindeck cards to look up by name.
+
+        Args:
+            maindeck (dict): The parsed maindeck of the decklist.
+            printings_data (dict): The card data of the found printings.
+
+        Returns:
+            list: The cards with a printing that is not listed or not found.
+        """
+        return [
+            card
+            for card, card_info_list in maindeck.items()
+            if any(
+                self._printing(card_info) not in printings_data
+                for card_info in card_info_list
+            )
+        ]
+
+    def _analyze_cards(self, printings_data, cards_data, not_found):
+        """
+        Analyzes the maindeck cards once their card data has been fetched.
+
+        Args:
+            printings_data (dict): The card data of the found printings.
+            cards_data (dict): The card data of the cards found by name.
+            not_found (list): The cards that could not be found by name.
+        """
+        if not_found:
+            raise AttributeError(
+                f'Card data not found for {", ".join(not_found)}.'
+            )
 
         # Iterate through maindeck cards and analyze each card
-        for card, card_info_list in maindeck.items():
-            total_quantity = sum(
-                card_info['quantity'] for card_info in card_info_list
+        for card, card_info_list in self._parsed_decklist['deck'].items():
+            self._analyze_copies(card, card_info_list, printings_data, cards_data)
+
+        self._calculate_averages()
+
+    def _update_cards(
+        self, parsed_decklist, changed_cards, printings_data, cards_data, not_found
+    ):
+        """
+        Updates the statistics for the changed cards once their card data has
+        been fetched.
+
+        Args:
+            parsed_decklist (dict): The new version of the parsed decklist.
+            changed_cards (list): The changed maindeck cards.
+            printings_data (dict): The card data of the found printings.
+            cards_data (dict): The card data of the cards found by name.
+            not_found (list): The cards that could not be found by name.
+        """
+        if not_found:
+            raise AttributeError(
+                f'Card data not found for {", ".join(not_found)}.'
+            )
+
+        maindeck = self._parsed_decklist['deck']
+        new_maindeck = parsed_decklist['deck']
+        for card in changed_cards:
+            self._analyze_copies(
+                card, maindeck.get(card, []), printings_data, cards_data, -1
+            )
+            for card_list in self._card_lists():
+                if card in card_list:
+                    card_list.remove(card)
+
+            self._analyze_copies(
+                card, new_maindeck.get(card, []), printings_data, cards_data
+            )
+
+        # The changed cards were appended to the lists, which are put back in
+        # the order of the decklist, like a full analysis lists them
+        deck_order = {card: index for index, card in enumerate(new_maindeck)}
+        for card_list in self._card_lists():
+            card_list.sort(key=deck_order.__getitem__)
+
+        self._parsed_decklist = parsed_decklist
+        self._calculate_averages()
+
+    def _analyze_copies(
+        self, card, card_info_list, printings_data, cards_data, sign=1
+    ):
+        """
+        Adds the copies of a maindeck card to the statistics, or takes them
+        out of the counts if sign is -1.
+
+        Args:
+            card (str): The name of the card.
+            card_info_list (list): The printings of the card, as parsed by
+                DecklistParser.
+            printings_data (dict): The card data of the found printings.
+            cards_data (dict): The card data of the cards found by name.
+            sign (int): 1 to add the copies, -1 to take them out.
+        """
+        total_quantity = sum(card_info['quantity'] for card_info in card_info_list)
+        self._card_count += sign * total_quantity
+
+        # The printings of a card only differ by their rarity
+        quantities_by_rarity = {}
+        for card_info in card_info_list:
+            card_data = printings_data.get(self._printing(card_info))
+            if card_data is None:
+                card_data = cards_data[card]
+            card_data, card_quantity = quantities_by_rarity.get(
+                card_data.rarity, (card_data, 0)
+            )
+            quantities_by_rarity[card_data.rarity] = (
+                card_data,
+                card_quantity + card_info['quantity'],
             )
-            self._card_count += total_quantity
-            card_quantity = total_quantity
-            try:
-                card_data = fetcher.get_card_data(card)
-                self._analyze_card(card, card_data, card_quantity)
-            except AttributeError:
-                raise AttributeError(f'Card data not found for {card}.')
+
+        for card_data, card_quantity in quantities_by_rarity.values():
+            self._analyze_card(card, card_data, sign * card_quantity)
+
+    def _calculate_averages(self):
+        """
+        Calculates the average converted mana cost and the recommended number
+        of lands from the counts.
+        """
+        # Count the number of cards in the companion
+        companion = len(self._parsed_decklist['companion'])
 
         # Calculate average converted mana cost and recommended number of lands
         if self.non_land_cmcs_count > 0 and self.non_land_count > 0:
@@ -194,232 +472,73 @@ class Analyzer:
         """
         Analyzes a single card in the decklist and updates relevant statistics.
 
+        The card is classified once by the CardClassifier, and its flags are
+        stored with the card data, so the analysis only sums them up.
+
         Args:
             card (str): The name of the card being analyzed.
-            card_data (dict): Card data fetched using CardDataFetcher.
-            card_quantity (int): The quantity of the card in the deck.
-        """
-        type_line = card_data.get('type_line', '').lower()
-        layout = card_data.get('layout', '').lower()
-        oracle_text = card_data.get('oracle_text', '').lower()
-
-        # Determine if the card is a non-land card, possibly with a land/spell modal double-faced layout
-        if not ('land' in type_line) or (
-            'modal_dfc' in layout
-            and not (
-                'land'
-                in card_data.get('card_faces', [{}])[0]
-                .get('type_line', '')
-                .lower()
-            )
-        ):
+            card_data (CardRecord): The card record fetched using
+                CardDataFetcher.
+            card_quantity (int): The quantity of the card in the deck, which
+                is negative when the copies are taken out of the counts.
+        """
+        flags = self._classifier.get_flags(card_data)
+
+        if flags['non_land']:
             self._non_land_count += card_quantity
-            cmc = card_data.get('cmc', 0)
-            self._non_land_cmcs_count += card_quantity * cmc
-
-            # Check if the card provides land/spell modal double-faced card
-            if self._is_land_spell_mdfc(layout, card_data):
-                # Determine if the land/spell modal double-faced card is mythic or non-mythic
-                rarity = card_data.get('rarity', '').lower()
-                if 'mythic' in rarity:
-                    self._mythic_land_spell_mdfc_list.append(card)
+            self._non_land_cmcs_count += card_quantity * flags['cmc']
+
+            # Determine if the land/spell modal double-faced card is mythic or non-mythic
+            if flags['land_spell_mdfc']:
+                if flags['mythic']:
+                    self._add_to_list(self._mythic_land_spell_mdfc_list, card, card_quantity)
                     self._mythic_land_spell_mdfc_count += card_quantity
                 else:
-                    self._non_mythic_land_spell_mdfc_list.append(card)
+                    self._add_to_list(self._non_mythic_land_spell_mdfc_list, card, card_quantity)
                     self._non_mythic_land_spell_mdfc_count += card_quantity
 
-            # Check if the card provides cheap card draw
-            if self._is_cheap_card_draw(oracle_text, cmc, type_line):
-                self._cheap_card_draw_list.append(card)
+            if flags['cheap_card_draw']:
+                self._add_to_list(self._cheap_card_draw_list, card, card_quantity)
                 self._cheap_card_draw_count += card_quantity
 
-            # Check if the card provides cheap mana ramp
-            if self._is_cheap_mana_ramp(oracle_text, cmc, type_line, card):
-                self._cheap_mana_ramp_list.append(card)
+            if flags['cheap_mana_ramp']:
+                self._add_to_list(self._cheap_mana_ramp_list, card, card_quantity)
                 self._cheap_mana_ramp_count += card_quantity
 
-            # Check if the card provides cheap scrying
-            if self._is_cheap_card_scry(oracle_text, cmc, type_line, card):
-                self._cheap_card_scry_list.append(card)
+            if flags['cheap_card_scry']:
+                self._add_to_list(self._cheap_card_scry_list, card, card_quantity)
                 self._cheap_card_scry_count += card_quantity
 
-    def _is_land_spell_mdfc(self, layout, card_data):
-        """
-        Checks if a card provides land/spell modal double-faced card based on its attributes.
-
-        Args:
-            layout (str): The layout of the card.
-            cmc (float): The converted mana cost of the card.
-            type_line (str): The type line of the card.
-
-        Returns:
-            bool: True if the card provides land/spell modal double-faced card, False otherwise.
-        """
-        if (
-            'modal_dfc' in layout
-            and 'land'
-            in card_data.get('card_faces', [{}])[1]
-            .get('type_line', '')
-            .lower()
-        ):
-            return True
+    def _card_lists(self):
+        return (
+            self._cheap_card_draw_list,
+            self._cheap_card_scry_list,
+            self._cheap_mana_ramp_list,
+            self._non_mythic_land_spell_mdfc_list,
+            self._mythic_land_spell_mdfc_list,
+        )
 
-        return False
+    def _add_to_list(self, card_list, card, card_quantity):
+        # Cards are listed once, whatever the rarities of their printings, and
+        # the copies taken out are unlisted by _update_cards()
+        if card_quantity > 0 and card not in card_list:
+            card_list.append(card)
 
-    def _is_cheap_card_draw(self, oracle_text, cmc, type_line):
+    def _printing(self, card_info):
         """
-        Checks if a card provides cheap card draw based on its attributes.
-
-        Args:
-            oracle_text (str): The oracle text of the card.
-            cmc (float): The converted mana cost of the card.
-            type_line (str): The type line of the card.
-
-        Returns:
-            bool: True if the card provides cheap card draw, False otherwise.
-        """
-        # Check for simple card draw effects
-        if oracle_text:
-            if cmc <= 2.0:
-                if 'draw' in oracle_text:
-                    if not (
-                        '{4}' in oracle_text
-                        or 'blood token' in oracle_text
-                        or 'investigate' in oracle_text
-                    ):
-                        if 'creature' in type_line:
-                            if (
-                                'when' in oracle_text
-                                and 'enters' in oracle_text
-                            ):
-                                return True
-                        else:
-                            return True
-
-                # Check for "look at the top of your library" effects
-                elif not ('creature' in type_line):
-                    if (
-                        'look' in oracle_text
-                        and 'library' in oracle_text
-                        and 'put' in oracle_text
-                        and 'your hand' in oracle_text
-                    ):
-                        if not ('pay' in oracle_text):
-                            return True
-
-            # Check for cycling abilities
-            if (
-                r'cycling {1}' in oracle_text
-                or r'cycling {w}' in oracle_text
-                or r'cycling {b}' in oracle_text
-                or r'cycling {u}' in oracle_text
-                or r'cycling {r}' in oracle_text
-                or r'cycling {g}' in oracle_text
-            ):
-                return True
-
-        return False
-
-    def _is_cheap_mana_ramp(self, oracle_text, cmc, type_line, card):
-        """
-        Checks if a card provides cheap mana ramp based on its attributes.
+        Returns the printing listed for a card.
 
         Args:
-            oracle_text (str): The oracle text of the card.
-            cmc (float): The converted mana cost of the card.
-            type_line (str): The type line of the card.
-            card (str): The name of the card being analyzed.
+            card_info (dict): The quantity, set code and collector number of
+                the card, as parsed by DecklistParser.
 
         Returns:
-            bool: True if the card provides cheap mana ramp, False otherwise.
-        """
-        # Check for mana ramp effects
-        if oracle_text:
-            if cmc <= 2.0:
-                if not (card in self.cheap_card_draw_list):
-                    if 'add ' in oracle_text:
-                        if not ('add its ability' in oracle_text) or not (
-                            'add a lore counter' in oracle_text
-                        ):
-                            if 'creature' in type_line:
-                                if not ('dies' in oracle_text):
-                                    return True
-                            else:
-                                return True
-
-                    # Check for land untap effects
-                    elif (
-                        ('untap target land' in oracle_text)
-                        or ('untap target snow land' in oracle_text)
-                        or ('untap target forest' in oracle_text)
-                        or ('untap target swamp' in oracle_text)
-                        or ('untap target mountain' in oracle_text)
-                        or ('untap target island' in oracle_text)
-                        or ('untap target plains' in oracle_text)
-                    ):
-                        return True
-
-                    # Check for land search effects
-                    elif (
-                        'search' in oracle_text
-                        and 'your library' in oracle_text
-                        and 'land' in oracle_text
-                    ):
-                        if not ('sacrifice' in oracle_text):
-                            return True
-
-                    # Check for mana enhancement through tapping enchanted land
-                    elif (
-                        ('enchanted land' in oracle_text)
-                        or ('enchanted snow land' in oracle_text)
-                        or ('enchanted forest' in oracle_text)
-                        or ('enchanted swamp' in oracle_text)
-                        or ('enchanted mountain' in oracle_text)
-                        or ('enchanted island' in oracle_text)
-                        or ('enchanted plains' in oracle_text)
-                    ):
-                        if 'adds an additional' in oracle_text:
-                            return True
-
-                    # Check for putting creatures into play from hand
-                    elif (
-                        'put' in oracle_text
-                        and 'creature card with' in oracle_text
-                        and 'from your hand onto the battlefield'
-                        in oracle_text
-                    ):
-                        return True
-
-        return False
-
-    def _is_cheap_card_scry(self, oracle_text, cmc, type_line, card):
-        """
-        Checks if a card provides cheap scrying based on its attributes.
-
-        Args:
-            oracle_text (str): The oracle text of the card.
-            cmc (float): The converted mana cost of the card.
-            type_line (str): The type line of the card.
-            card (str): The name of the card being analyzed.
-
-        Returns:
-            bool: True if the card provides cheap scrying, False otherwise.
-        """
-        # Check for scry effects
-        if oracle_text:
-            if cmc <= 2.0:
-                if not (card in self.cheap_card_draw_list):
-                    if 'scry ' in oracle_text:
-                        if 'creature' in type_line:
-                            if (
-                                'when' in oracle_text
-                                and 'enters' in oracle_text
-                            ):
-                                return True
-                        else:
-                            return True
-
-        return False
+            tuple: The set code and collector number of the printing, or None
+                   if the decklist does not list it.
+        """
+        if card_info['set_code'] is None:
+            return None
+        return (card_info['set_code'], card_info['card_set_id'])
 
     def _calculate_number_of_lands(self, companion):
         """
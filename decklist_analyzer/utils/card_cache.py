@@ -0,0 +1,319 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+SNAPSHOT_VERSION = 1
+
+
+class CardCache:
+    """
+    A class for caching card data across requests, with a least recently used
+    eviction policy, a size bound and a time to live.
+
+    The cache is safe to share between threads. When a Django cache is given as
+    backend, entries missing from the in-process cache are looked up in it, so
+    that the card data can be shared between worker processes. With a stale
+    time to live, expired entries are kept in the in-process cache for that
+    many more seconds, and can still be read with get_stale() while they are
+    revalidated.
+
+    Attributes:
+        _max_entries (int): The maximum number of cached cards, or None.
+        _max_bytes (int): The maximum estimated memory of cached cards, or None.
+        _ttl (float): The number of seconds a card stays cached, or None.
+        _stale_ttl (float): The number of seconds an expired card can still be
+            read with get_stale(), or None.
+        _backend (BaseCache): An optional Django cache shared between workers.
+        _namespace (str): The prefix of the keys in the Django cache.
+        _entries (OrderedDict): The cached cards, from least to most recently used.
+        _bytes (int): The estimated memory of the cached cards.
+
+    Methods:
+        get(): Returns the cached data for a card.
+        get_stale(): Returns the expired data for a card, if it is still kept.
+        set(): Caches the data for a card.
+        clear(): Removes every card from the in-process cache.
+        stats(): Returns the hit and miss counts and the cache size.
+        dump(): Writes the in-process cache to a snapshot file.
+        load(): Restores the cards of a snapshot file.
+    """
+
+    def __init__(
+        self,
+        max_entries=None,
+        max_bytes=None,
+        ttl=None,
+        backend=None,
+        namespace='card',
+        stale_ttl=None,
+    ):
+        """
+        Initializes the CardCache instance.
+
+        Args:
+            max_entries (int): The maximum number of cached cards, or None.
+            max_bytes (int): The maximum estimated memory of cached cards, or None.
+            ttl (float): The number of seconds a card stays cached, or None.
+            backend (BaseCache): An optional Django cache shared between workers.
+            namespace (str): The prefix of the keys in the Django cache, so that
+                several caches can share the same backend.
+            stale_ttl (float): The number of seconds an expired card can still
+                be read with get_stale(), or None.
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._stale_ttl = stale_ttl
+        self._backend = backend
+        self._namespace = namespace
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._backend_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, count=True):
+        """
+        Returns the cached data for the specified card.
+
+        Args:
+            key (str): The cache key of the card.
+            count (bool): If False, the lookup is not counted in the stats.
+
+        Returns:
+            object: The cached card data, or None if the card is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, size = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    if count:
+                        self._hits += 1
+                    return value
+                if not self._is_stale(expires_at):
+                    self._remove(key)
+
+        if self._backend is not None:
+            value = self._backend.get(self._backend_key(key))
+            if value is not None:
+                self._set_local(key, value)
+                if count:
+                    with self._lock:
+                        self._backend_hits += 1
+                return value
+
+        if count:
+            with self._lock:
+                self._misses += 1
+        return None
+
+    def get_stale(self, key):
+        """
+        Returns the data for the specified card once it expired, while it is
+        kept for the stale time to live. The lookup is not counted in the
+        stats.
+
+        Args:
+            key (str): The cache key of the card.
+
+        Returns:
+            object: The expired card data, or None if the card is fresh, not
+                    cached or expired for longer than the stale time to live.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at, size = entry
+            if expires_at is None or expires_at > time.monotonic():
+                return None
+            if not self._is_stale(expires_at):
+                self._remove(key)
+                return None
+            return value
+
+    def set(self, key, value):
+        """
+        Caches the data for the specified card.
+
+        Args:
+            key (str): The cache key of the card.
+            value (object): The card data to be cached.
+        """
+        self._set_local(key, value)
+        if self._backend is not None:
+            self._backend.set(self._backend_key(key), value, self._ttl)
+
+    def clear(self):
+        """
+        Removes every card from the in-process cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Returns the hit and miss counts and the size of the cache.
+
+        Returns:
+            dict: A dictionary with the hits, backend hits, misses, evictions,
+                  number of entries and estimated bytes of the cache.
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'backend_hits': self._backend_hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _set_local(self, key, value):
+        size = self._estimate_size(value)
+        expires_at = None
+        if self._ttl is not None:
+            expires_at = time.monotonic() + self._ttl
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            self._evict()
+
+    def dump(self, path):
+        """
+        Writes the cards of the in-process cache to a snapshot file, from the
+        least to the most recently used, with their remaining time to live.
+
+        The snapshot is a pickle, written to a temporary file and moved into
+        place, so that concurrent readers never see a partial snapshot.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Returns:
+            int: The number of cards written.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = [
+                (
+                    key,
+                    value,
+                    None if expires_at is None else expires_at - now,
+                    size,
+                )
+                for key, (value, expires_at, size) in self._entries.items()
+                if expires_at is None or expires_at > now
+            ]
+
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'created_at': time.time(),
+            'entries': entries,
+        }
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as snapshot_file:
+            pickle.dump(snapshot, snapshot_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return len(entries)
+
+    def load(self, path):
+        """
+        Restores the cards of a snapshot file written by dump(), as less
+        recently used than the cards already cached, which are kept.
+
+        Snapshots are pickles, so they must only be loaded from a trusted
+        path. Cards whose time to live ran out since the snapshot was written
+        are skipped, and the size bounds of the cache are respected.
+
+        Args:
+            path (str): The path of the snapshot file.
+
+        Returns:
+            int: The number of cards restored.
+        """
+        with open(path, 'rb') as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f'Unsupported card cache snapshot: {path}.')
+
+        age = time.time() - snapshot['created_at']
+        now = time.monotonic()
+        with self._lock:
+            restored = OrderedDict()
+            for key, value, ttl, size in snapshot['entries']:
+                if key in self._entries:
+                    continue
+                expires_at = None
+                if ttl is not None:
+                    if ttl <= age:
+                        continue
+                    expires_at = now + ttl - age
+                restored[key] = (value, expires_at, size)
+                self._bytes += size
+
+            # The restored cards are the first to be evicted
+            restored_count = len(restored)
+            restored.update(self._entries)
+            self._entries = restored
+            entry_count = len(self._entries)
+            self._evict()
+            return max(restored_count - (entry_count - len(self._entries)), 0)
+
+    def _is_stale(self, expires_at):
+        # Expired, but still kept for the stale time to live
+        return (
+            self._stale_ttl is not None
+            and expires_at + self._stale_ttl > time.monotonic()
+        )
+
+    def _evict(self):
+        while self._entries and (
+            (
+                self._max_entries is not None
+                and len(self._entries) > self._max_entries
+            )
+            or (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _backend_key(self, key):
+        # Card names have spaces and punctuation, which memcached keys reject
+        return (
+            f'how_many:{self._namespace}:'
+            + hashlib.md5(key.encode()).hexdigest()
+        )
+
+    def _estimate_size(self, value):
+        size = sys.getsizeof(value)
+        if isinstance(value, dict):
+            for item_key, item_value in value.items():
+                size += self._estimate_size(item_key)
+                size += self._estimate_size(item_value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                size += self._estimate_size(item)
+        elif hasattr(value, '__slots__'):
+            for slot in value.__slots__:
+                size += self._estimate_size(getattr(value, slot, None))
+        return size
@@ -0,0 +1,291 @@
+import hashlib
+from pathlib import Path
+
+from decklist_analyzer.utils.card_record import CardRecord
+
+# Fingerprint of the classification rules: any change to this module changes
+# it, so flags computed by an older version of the rules are recomputed.
+RULES_FINGERPRINT = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+
+# Rule table: the lowercase tokens looked for in the oracle text of a card
+LAND_TYPES = (
+    'land',
+    'snow land',
+    'forest',
+    'swamp',
+    'mountain',
+    'island',
+    'plains',
+)
+ENTERS_TOKENS = frozenset({'when', 'enters'})
+CARD_DRAW_TOKEN = 'draw'
+CARD_DRAW_EXCLUDED_TOKENS = frozenset({'{4}', 'blood token', 'investigate'})
+LOOK_AT_LIBRARY_TOKENS = frozenset({'look', 'library', 'put', 'your hand'})
+LOOK_AT_LIBRARY_EXCLUDED_TOKEN = 'pay'
+# The tokens of a group share their beginning, which is looked up first
+CYCLING_TOKEN = 'cycling {'
+CHEAP_CYCLING_TOKENS = frozenset(f'{CYCLING_TOKEN}{mana}}}' for mana in '1wburg')
+ADD_MANA_TOKEN = 'add '
+ADD_MANA_EXCLUDED_TOKENS = frozenset({'add its ability', 'add a lore counter'})
+DIES_TOKEN = 'dies'
+UNTAP_TOKEN = 'untap target '
+UNTAP_LAND_TOKENS = frozenset(f'{UNTAP_TOKEN}{land}' for land in LAND_TYPES)
+LAND_SEARCH_TOKENS = frozenset({'search', 'your library', 'land'})
+LAND_SEARCH_EXCLUDED_TOKEN = 'sacrifice'
+ENCHANTED_TOKEN = 'enchanted '
+ENCHANTED_LAND_TOKENS = frozenset(
+    f'{ENCHANTED_TOKEN}{land}' for land in LAND_TYPES
+)
+ENCHANTED_LAND_MANA_TOKEN = 'adds an additional'
+PUT_CREATURE_TOKENS = frozenset(
+    {'put', 'creature card with', 'from your hand onto the battlefield'}
+)
+SCRY_TOKEN = 'scry '
+
+ORACLE_TEXT_TOKENS = (
+    ENTERS_TOKENS
+    | {CARD_DRAW_TOKEN}
+    | CARD_DRAW_EXCLUDED_TOKENS
+    | LOOK_AT_LIBRARY_TOKENS
+    | {LOOK_AT_LIBRARY_EXCLUDED_TOKEN}
+    | CHEAP_CYCLING_TOKENS
+    | {ADD_MANA_TOKEN}
+    | ADD_MANA_EXCLUDED_TOKENS
+    | {DIES_TOKEN}
+    | UNTAP_LAND_TOKENS
+    | LAND_SEARCH_TOKENS
+    | {LAND_SEARCH_EXCLUDED_TOKEN}
+    | ENCHANTED_LAND_TOKENS
+    | {ENCHANTED_LAND_MANA_TOKEN}
+    | PUT_CREATURE_TOKENS
+    | {SCRY_TOKEN}
+)
+
+
+class CardClassifier:
+    """
+    A class for classifying a card once, so that its classification flags can
+    be stored with the card record and reused by every analysis.
+
+    The card draw, mana ramp, scry and MDFC decisions are taken from the
+    tokens of the rule table. The tokens are looked up in the oracle text of
+    the card when a decision needs them, in the order of the rules, so the
+    lookups of a card stop at its first decisive rule.
+
+    The flags are a dictionary with the keys:
+        rules (str): The fingerprint of the rules that computed the flags.
+        non_land (bool): If the card counts as a non-land card.
+        cmc (float): The converted mana cost of the card.
+        land_spell_mdfc (bool): If the card is a land/spell modal double-faced card.
+        mythic (bool): If the card is mythic.
+        cheap_card_draw (bool): If the card provides cheap card draw.
+        cheap_mana_ramp (bool): If the card provides cheap mana ramp.
+        cheap_card_scry (bool): If the card provides cheap scrying.
+
+    Methods:
+        get_flags(): Returns the up-to-date flags of a card, classifying it if needed.
+        classify(): Computes the flags of a card.
+    """
+
+    def get_flags(self, card):
+        """
+        Returns the flags stored with the card record, classifying the card
+        and storing its flags if they are missing or were computed by other
+        rules.
+
+        Args:
+            card (CardRecord): The record of the card.
+
+        Returns:
+            dict: The classification flags of the card.
+        """
+        flags = card.flags
+        if flags is None or flags.get('rules') != RULES_FINGERPRINT:
+            flags = self.classify(card)
+            card.flags = flags
+        return flags
+
+    def classify(self, card):
+        """
+        Computes the classification flags of a card.
+
+        Args:
+            card (CardRecord | dict): The record of the card, or a card object
+                in Scryfall's format.
+
+        Returns:
+            dict: The classification flags of the card.
+        """
+        if not isinstance(card, CardRecord):
+            card = CardRecord.from_card_data(card)
+
+        type_line = card.type_line.lower()
+        layout = card.layout.lower()
+        cmc = card.cmc
+
+        flags = {
+            'rules': RULES_FINGERPRINT,
+            'non_land': False,
+            'cmc': cmc,
+            'land_spell_mdfc': False,
+            'mythic': 'mythic' in card.rarity.lower(),
+            'cheap_card_draw': False,
+            'cheap_mana_ramp': False,
+            'cheap_card_scry': False,
+        }
+
+        # Determine if the card is a non-land card, possibly with a land/spell modal double-faced layout
+        if 'land' not in type_line or (
+            'modal_dfc' in layout and not self._is_land_face(card, 0)
+        ):
+            oracle_text = card.oracle_text.lower()
+            is_creature = 'creature' in type_line
+
+            flags['non_land'] = True
+            flags['land_spell_mdfc'] = (
+                'modal_dfc' in layout and self._is_land_face(card, 1)
+            )
+            flags['cheap_card_draw'] = self._is_cheap_card_draw(
+                oracle_text, cmc, is_creature
+            )
+            flags['cheap_mana_ramp'] = self._is_cheap_mana_ramp(
+                oracle_text, cmc, is_creature, flags['cheap_card_draw']
+            )
+            flags['cheap_card_scry'] = self._is_cheap_card_scry(
+                oracle_text, cmc, is_creature, flags['cheap_card_draw']
+            )
+
+        return flags
+
+    def _is_land_face(self, card, face_index):
+        """
+        Checks if a face of a card is a land.
+
+        Args:
+            card (CardRecord): The record of the card.
+            face_index (int): The index of the face in the card faces.
+
+        Returns:
+            bool: True if the face is a land, False otherwise.
+        """
+        if face_index >= len(card.face_type_lines):
+            return False
+        return 'land' in card.face_type_lines[face_index].lower()
+
+    def _is_cheap_card_draw(self, oracle_text, cmc, is_creature):
+        """
+        Checks if a card provides cheap card draw based on its attributes.
+
+        Args:
+            oracle_text (str): The lowercase oracle text of the card.
+            cmc (float): The converted mana cost of the card.
+            is_creature (bool): If the card is a creature.
+
+        Returns:
+            bool: True if the card provides cheap card draw, False otherwise.
+        """
+        if not oracle_text:
+            return False
+
+        if cmc <= 2.0:
+            # Check for simple card draw effects
+            if CARD_DRAW_TOKEN in oracle_text:
+                if not _contains_any(oracle_text, CARD_DRAW_EXCLUDED_TOKENS):
+                    if not is_creature or _contains_all(
+                        oracle_text, ENTERS_TOKENS
+                    ):
+                        return True
+
+            # Check for "look at the top of your library" effects
+            elif not is_creature:
+                if (
+                    _contains_all(oracle_text, LOOK_AT_LIBRARY_TOKENS)
+                    and LOOK_AT_LIBRARY_EXCLUDED_TOKEN not in oracle_text
+                ):
+                    return True
+
+        # Check for cycling abilities
+        return CYCLING_TOKEN in oracle_text and _contains_any(
+            oracle_text, CHEAP_CYCLING_TOKENS
+        )
+
+    def _is_cheap_mana_ramp(
+        self, oracle_text, cmc, is_creature, is_cheap_card_draw
+    ):
+        """
+        Checks if a card provides cheap mana ramp based on its attributes.
+
+        Args:
+            oracle_text (str): The lowercase oracle text of the card.
+            cmc (float): The converted mana cost of the card.
+            is_creature (bool): If the card is a creature.
+            is_cheap_card_draw (bool): If the card already provides cheap card draw.
+
+        Returns:
+            bool: True if the card provides cheap mana ramp, False otherwise.
+        """
+        if not oracle_text or cmc > 2.0 or is_cheap_card_draw:
+            return False
+
+        # Check for mana ramp effects
+        if ADD_MANA_TOKEN in oracle_text:
+            if not _contains_all(oracle_text, ADD_MANA_EXCLUDED_TOKENS):
+                return not is_creature or DIES_TOKEN not in oracle_text
+            return False
+
+        # Check for land untap effects
+        if UNTAP_TOKEN in oracle_text and _contains_any(
+            oracle_text, UNTAP_LAND_TOKENS
+        ):
+            return True
+
+        # Check for land search effects
+        if _contains_all(oracle_text, LAND_SEARCH_TOKENS):
+            return LAND_SEARCH_EXCLUDED_TOKEN not in oracle_text
+
+        # Check for mana enhancement through tapping enchanted land
+        if ENCHANTED_TOKEN in oracle_text and _contains_any(
+            oracle_text, ENCHANTED_LAND_TOKENS
+        ):
+            return ENCHANTED_LAND_MANA_TOKEN in oracle_text
+
+        # Check for putting creatures into play from hand
+        return _contains_all(oracle_text, PUT_CREATURE_TOKENS)
+
+    def _is_cheap_card_scry(
+        self, oracle_text, cmc, is_creature, is_cheap_card_draw
+    ):
+        """
+        Checks if a card provides cheap scrying based on its attributes.
+
+        Args:
+            oracle_text (str): The lowercase oracle text of the card.
+            cmc (float): The converted mana cost of the card.
+            is_creature (bool): If the card is a creature.
+            is_cheap_card_draw (bool): If the card already provides cheap card draw.
+
+        Returns:
+            bool: True if the card provides cheap scrying, False otherwise.
+        """
+        # Check for scry effects
+        if cmc <= 2.0 and not is_cheap_card_draw:
+            if SCRY_TOKEN in oracle_text:
+                return not is_creature or _contains_all(
+                    oracle_text, ENTERS_TOKENS
+                )
+
+        return False
+
+
+def _contains_any(text, tokens):
+    for token in tokens:
+        if token in text:
+            return True
+    return False
+
+
+def _contains_all(text, tokens):
+    for token in tokens:
+        if token not in text:
+            return False
+    return True
@@ -1,39 +1,732 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from decklist_analyzer.utils.card_cache import CardCache
+from decklist_analyzer.utils.card_classifier import CardClassifier
+from decklist_analyzer.utils.card_record import CardRecord
+from decklist_analyzer.utils.metrics import (
+    UPSTREAM_ERRORS,
+    UPSTREAM_LATENCY,
+    UPSTREAM_REQUESTS,
+)
+from decklist_analyzer.utils.single_flight import SingleFlight
+from decklist_analyzer.utils.timing import count, timed
+
+UPSTREAM_UNAVAILABLE_MESSAGE = (
+    'Card data is unavailable, Scryfall is not responding. Try again later.'
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised instead of requesting Scryfall while the circuit breaker is open.
+    """
+
+
+class UpstreamUnavailable(Exception):
+    """
+    Raised when cards cannot be looked up because Scryfall is failing, so
+    that they are not reported as not found.
+    """
 
 
 class CardDataFetcher:
     """
     A class for fetching card data from the Scryfall API and caching it.
+
+    When a CardStore is given, cards are looked up in the local store first and
+    the Scryfall API is only used for cards missing from it, unless the
+    fetcher is offline. When a CardCache is given, it can be shared between
+    fetchers so that the cached cards outlive a single analysis. Cards
+    fetched from Scryfall are projected into compact CardRecords and
+    classified before being cached, so their classification flags are cached
+    with them.
+
+    Requests go through a pooled HTTP session, are spaced out by an optional
+    RateLimiter and are retried with an exponential backoff when Scryfall
+    rate limits them or fails. Every request has a timeout, and an optional
+    CircuitBreaker stops requesting Scryfall after consecutive failures. The
+    lookups whose requests fail raise UpstreamUnavailable, so that a failing
+    Scryfall is not mistaken for cards that do not exist. With more than one
+    worker, the cards missing from the cache are requested concurrently. The
+    aget_cards_data() and aget_printings_data() coroutines share the cache,
+    the store and the session, and let async views await the card data.
+
+    Cards that Scryfall does not find are cached in a cache of their own, with
+    a time to live of its own, so that unknown names are not requested again
+    by every analysis that has them. Names that no card can have are never
+    requested.
+
+    Concurrent lookups of the same missing cards are coalesced by a
+    SingleFlight, so that only one of them requests Scryfall and the others
+    wait for it and read its cards from the cache, in this process or, with
+    a shared lock backend, in every worker.
+
+    When the card cache has a stale time to live, an expired card that is
+    not in the local store is served right away from the cache, and
+    requested again from Scryfall in the background, so that slow or failing
+    requests do not delay the analyses of known cards.
     ...
     """
 
-    def __init__(self):
+    SCRYFALL_API_URL = 'https://api.scryfall.com'
+
+    # Maximum number of identifiers accepted by /cards/collection
+    COLLECTION_BATCH_SIZE = 75
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    # Longer than the longest card name, with a margin for both faces
+    MAX_NAME_LENGTH = 150
+    # Seconds a card not found by Scryfall stays cached by default
+    NOT_FOUND_TTL = 60 * 60
+
+    def __init__(
+        self,
+        card_store=None,
+        card_cache=None,
+        offline=False,
+        api_url=None,
+        lookup='collection',
+        max_workers=1,
+        max_async_requests=32,
+        rate_limiter=None,
+        max_retries=0,
+        retry_backoff=0.5,
+        max_retry_delay=5.0,
+        retry_deadline=20.0,
+        session=None,
+        timeout=10.0,
+        circuit_breaker=None,
+        not_found_cache=None,
+        single_flight=None,
+    ):
         """
-        Initializes the CardDataFetcher instance with an empty card cache.
+        Initializes the CardDataFetcher instance.
+
+        Args:
+            card_store (CardStore): An optional local store of card data.
+            card_cache (CardCache): An optional shared card cache. A new,
+                unbounded cache is used if not given.
+            offline (bool): If True, the Scryfall API is never requested.
+            api_url (str): The base URL of the Scryfall API.
+            lookup (str): How get_cards_data requests missing cards, either
+                'collection' (batches of 75 cards) or 'named' (one per card).
+            max_workers (int): The number of requests made concurrently.
+            max_async_requests (int): The number of requests made concurrently
+                by the coroutines, across every analysis awaiting them.
+            rate_limiter (RateLimiter): An optional limiter for the requests.
+            max_retries (int): The number of times a failed request is retried.
+            retry_backoff (float): The number of seconds before the first retry,
+                doubled on every following retry.
+            max_retry_delay (float): The number of seconds a retry waits at
+                most. A request that Scryfall asks to retry later than that
+                is not retried.
+            retry_deadline (float): The number of seconds a request and its
+                retries take at most.
+            session (requests.Session): The HTTP session used for the requests.
+                A new pooled session is used if not given.
+            timeout (float): The number of seconds a request waits for
+                Scryfall to connect and to respond.
+            circuit_breaker (CircuitBreaker): An optional breaker that stops
+                the requests while Scryfall is failing.
+            not_found_cache (CardCache): An optional shared cache of the cards
+                not found by Scryfall. A new, unbounded cache keeping them for
+                an hour is used if not given.
+            single_flight (SingleFlight): The coalescer of the concurrent
+                lookups of the same cards. A new one, coalescing the lookups
+                of this process only, is used if not given.
         """
-        self._card_cache = {}
+        if lookup not in ('collection', 'named'):
+            raise ValueError(f'Invalid card lookup: {lookup}.')
+
+        self._card_cache = card_cache if card_cache is not None else CardCache()
+        self._not_found_cache = (
+            not_found_cache
+            if not_found_cache is not None
+            else CardCache(ttl=self.NOT_FOUND_TTL, namespace='not_found')
+        )
+        self._card_store = card_store
+        self._offline = offline
+        self._api_url = api_url or self.SCRYFALL_API_URL
+        self._lookup = lookup
+        self._max_workers = max_workers
+        self._rate_limiter = rate_limiter
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._max_retry_delay = max_retry_delay
+        self._retry_deadline = retry_deadline
+        self._timeout = timeout
+        self._circuit_breaker = circuit_breaker
+        self._max_async_requests = max_async_requests
+        self._session = session or self._create_session(
+            max(max_workers, max_async_requests)
+        )
+        self._single_flight = single_flight or SingleFlight()
+        self._executor = None
+        self._async_executor = None
+        self._revalidation_executor = None
+        self._executor_lock = threading.Lock()
+        # The stale cards waiting to be revalidated, in a dict used as an
+        # ordered set, and if a revalidation is running
+        self._revalidating = {}
+        self._revalidation_running = False
+        self._revalidation_lock = threading.Lock()
+        self._classifier = CardClassifier()
+
+    @property
+    def card_store(self):
+        """
+        CardStore: The local store of card data, or None.
+        """
+        return self._card_store
+
+    @property
+    def data_version(self):
+        """
+        str: The version of the local card data, which changes when the card
+        store is ingested again. Empty if there is no card store.
+        """
+        if self._card_store is None or not self._card_store.exists():
+            return ''
+        return self._card_store.version
 
     def get_card_data(self, card):
         """
-        Fetches card data from the Scryfall API for the specified card.
+        Fetches card data from the cache, the local store or the Scryfall API
+        for the specified card.
 
         Args:
             card (str): The name of the card to fetch data for.
 
         Returns:
-            dict: A dictionary containing the card data from the API response.
-                  Returns None if the request fails.
+            CardRecord: The record of the card, with its classification flags.
+                        Returns None if the card is not found.
+
+        Raises:
+            UpstreamUnavailable: If the card must be requested from Scryfall
+                and the request fails.
+        """
+        card_data = self._get_local_card_data(card)
+        if card_data is not None or self._offline:
+            return card_data
+
+        if not self._cards_to_request([card]):
+            return None
+        return self._fetch_cards([card], lookup='named').get(card)
+
+    def get_cards_data(self, cards):
+        """
+        Fetches card data for several cards at once.
+
+        Cards missing from the cache and the local store are requested from the
+        Scryfall /cards/collection endpoint, in batches of up to 75 cards, or
+        from /cards/named, one card per request, depending on the lookup.
+
+        Args:
+            cards (iterable): The names of the cards to fetch data for.
+
+        Returns:
+            tuple: A dictionary mapping each found card name to its CardRecord,
+                   and a list of the card names that could not be found.
+
+        Raises:
+            UpstreamUnavailable: If some cards must be requested from Scryfall
+                and the requests fail.
+        """
+        with timed('fetch'):
+            return self._get_cards_data(cards)
+
+    def get_printings_data(self, printings):
+        """
+        Looks up card data for several printings of cards in the cache and
+        the local store.
+
+        Printings are only looked up locally: a printing missing from the
+        local store is looked up by the name of its card instead.
+
+        Args:
+            printings (iterable): The (set code, collector number) of each
+                printing to look up.
+
+        Returns:
+            dict: A dictionary mapping each found printing to the CardRecord
+                  of its card, with the rarity of the printing.
+        """
+        printings_data = {}
+        if self._card_store is None:
+            return printings_data
+
+        with timed('fetch'):
+            for printing in dict.fromkeys(printings):
+                card_data = self._get_local_printing_data(*printing)
+                if card_data is not None:
+                    printings_data[printing] = card_data
+        return printings_data
+
+    async def aget_cards_data(self, cards):
+        """
+        Fetches card data for several cards at once, without blocking the
+        event loop.
+
+        The cards are looked up like get_cards_data() does, in the same cache
+        and local store. The requests to Scryfall are made from a pool of
+        max_async_requests threads shared by every analysis, up to max_workers
+        at a time for each of them, so that the event loop keeps serving other
+        requests while Scryfall responds.
+
+        Args:
+            cards (iterable): The names of the cards to fetch data for.
+
+        Returns:
+            tuple: A dictionary mapping each found card name to its CardRecord,
+                   and a list of the card names that could not be found.
+
+        Raises:
+            UpstreamUnavailable: If some cards must be requested from Scryfall
+                and the requests fail.
         """
-        if card in self._card_cache:
-            return self._card_cache[card]
+        with timed('fetch'):
+            # The caches may have a Django backend, only used from threads
+            (
+                cards_data,
+                missing_cards,
+                cards_to_request,
+            ) = await asyncio.to_thread(self._get_missing_cards, list(cards))
+            if cards_to_request:
+                cards_data.update(await self._afetch_cards(cards_to_request))
 
+        not_found = [card for card in missing_cards if card not in cards_data]
+        return cards_data, not_found
+
+    async def aget_printings_data(self, printings):
+        """
+        Looks up card data for several printings of cards, like
+        get_printings_data() does, without blocking the event loop.
+
+        Args:
+            printings (iterable): The (set code, collector number) of each
+                printing to look up.
+
+        Returns:
+            dict: A dictionary mapping each found printing to the CardRecord
+                  of its card, with the rarity of the printing.
+        """
+        return await asyncio.to_thread(
+            self.get_printings_data, list(printings)
+        )
+
+    def _get_cards_data(self, cards):
+        cards_data, missing_cards, cards_to_request = self._get_missing_cards(
+            cards
+        )
+        if cards_to_request:
+            cards_data.update(self._fetch_cards(cards_to_request))
+
+        not_found = [card for card in missing_cards if card not in cards_data]
+        return cards_data, not_found
+
+    def _fetch_cards(self, cards, lookup=None):
+        # Only request the cards that no other lookup is requesting, and wait
+        # for the others
+        claimed, flights = self._single_flight.claim(cards)
         try:
-            response = requests.get(
-                f'https://api.scryfall.com/cards/named?exact={card}'
+            cards_data, cards_to_fetch = self._recheck(claimed)
+            if (lookup or self._lookup) == 'collection':
+                batches = self._batches(cards_to_fetch)
+                for batch_data in self._map(self._fetch_collection, batches):
+                    cards_data.update(batch_data)
+            else:
+                for card, card_data in zip(
+                    cards_to_fetch, self._map(self._fetch_named, cards_to_fetch)
+                ):
+                    if card_data is not None:
+                        cards_data[card] = card_data
+        finally:
+            self._single_flight.release(claimed)
+
+        if flights:
+            cards_data.update(self._wait_for(flights))
+        return cards_data
+
+    async def _afetch_cards(self, cards):
+        # The locks and the caches may have a Django backend, only used from
+        # threads
+        claimed, flights = await asyncio.to_thread(
+            self._single_flight.claim, cards
+        )
+        try:
+            cards_data, cards_to_fetch = await asyncio.to_thread(
+                self._recheck, claimed
             )
-            response.raise_for_status()
-            card_data = response.json()
-            self._card_cache[card] = card_data
+            semaphore = asyncio.Semaphore(self._max_workers)
+
+            async def fetch(function, item):
+                async with semaphore:
+                    return await self._run_async(function, item)
+
+            if self._lookup == 'collection':
+                for batch_data in await asyncio.gather(
+                    *(
+                        fetch(self._fetch_collection, batch)
+                        for batch in self._batches(cards_to_fetch)
+                    )
+                ):
+                    cards_data.update(batch_data)
+            else:
+                for card, card_data in zip(
+                    cards_to_fetch,
+                    await asyncio.gather(
+                        *(
+                            fetch(self._fetch_named, card)
+                            for card in cards_to_fetch
+                        )
+                    ),
+                ):
+                    if card_data is not None:
+                        cards_data[card] = card_data
+        finally:
+            await asyncio.to_thread(self._single_flight.release, claimed)
+
+        if flights:
+            cards_data.update(
+                await asyncio.to_thread(self._wait_for, flights)
+            )
+        return cards_data
+
+    def _recheck(self, claimed):
+        # A lookup of the same cards may have ended between the cache miss
+        # and the claim
+        cards_data = {}
+        cards_to_fetch = []
+        for card in claimed:
+            card_data = self._card_cache.get(card, count=False)
+            if card_data is not None:
+                cards_data[card] = card_data
+            elif self._not_found_cache.get(card, count=False) is None:
+                cards_to_fetch.append(card)
+        return cards_data, cards_to_fetch
+
+    def _wait_for(self, flights):
+        # Wait for the lookups of other callers, then read their cards
+        self._single_flight.wait(flights)
+        count('coalesced_lookups', len(flights))
+        cards_data = {}
+        for card in flights:
+            card_data = self._card_cache.get(card, count=False)
+            if card_data is not None:
+                cards_data[card] = card_data
+            elif self._not_found_cache.get(card, count=False) is None:
+                # The other lookup failed or timed out
+                raise UpstreamUnavailable(UPSTREAM_UNAVAILABLE_MESSAGE)
+        return cards_data
+
+    def _get_local_cards_data(self, cards):
+        cards_data = {}
+        missing_cards = []
+
+        for card in dict.fromkeys(cards):
+            card_data = self._get_local_card_data(card)
+            if card_data is not None:
+                cards_data[card] = card_data
+            else:
+                missing_cards.append(card)
+        return cards_data, missing_cards
+
+    def _get_missing_cards(self, cards):
+        cards_data, missing_cards = self._get_local_cards_data(cards)
+
+        cards_to_request = []
+        if missing_cards and not self._offline:
+            cards_to_request = self._cards_to_request(missing_cards)
+        return cards_data, missing_cards, cards_to_request
+
+    def _cards_to_request(self, missing_cards):
+        # Skip the names known not to be found and the names of no card
+        cards_to_request = []
+        for card in missing_cards:
+            if (
+                len(card) > self.MAX_NAME_LENGTH
+                or not any(char.isalpha() for char in card)
+                or self._not_found_cache.get(card) is not None
+            ):
+                count('known_not_found')
+                continue
+            cards_to_request.append(card)
+        return cards_to_request
+
+    def _batches(self, cards):
+        return [
+            cards[start : start + self.COLLECTION_BATCH_SIZE]
+            for start in range(0, len(cards), self.COLLECTION_BATCH_SIZE)
+        ]
+
+    def _get_local_card_data(self, card):
+        card_data = self._card_cache.get(card)
+        if card_data is not None:
             return card_data
-        except requests.exceptions.RequestException:
-            return None
+        count('cache_misses')
+
+        if self._card_store is not None:
+            card_data = self._card_store.get_card_data(card)
+            if card_data is not None:
+                self._card_cache.set(card, card_data)
+                return card_data
+
+        card_data = self._card_cache.get_stale(card)
+        if card_data is not None and not self._offline:
+            count('stale_hits')
+            self._revalidate(card)
+        return card_data
+
+    def _revalidate(self, card):
+        with self._revalidation_lock:
+            self._revalidating[card] = None
+            if self._revalidation_running:
+                return
+            self._revalidation_running = True
+
+        if self._revalidation_executor is None:
+            with self._executor_lock:
+                if self._revalidation_executor is None:
+                    self._revalidation_executor = ThreadPoolExecutor(
+                        max_workers=1,
+                        thread_name_prefix='card-data-fetcher-revalidate',
+                    )
+        # Not in the caller's context, so that the requests made in the
+        # background are not added to the timings of the request
+        try:
+            self._revalidation_executor.submit(self._run_revalidation)
+        except RuntimeError:
+            # The interpreter is shutting down
+            with self._revalidation_lock:
+                self._revalidation_running = False
+
+    def _run_revalidation(self):
+        # Revalidate the stale cards in batches until none is left, keeping
+        # the stale card data when the requests fail
+        while True:
+            with self._revalidation_lock:
+                cards = list(self._revalidating)
+                self._revalidating.clear()
+                if not cards:
+                    self._revalidation_running = False
+                    return
+
+            try:
+                self._fetch_cards(cards)
+            except UpstreamUnavailable:
+                pass
+
+    def _get_local_printing_data(self, set_code, collector_number):
+        # Printings are cached like they are written in decklists, which no
+        # card name looks like
+        key = f'({set_code}) {collector_number}'
+        card_data = self._card_cache.get(key)
+        if card_data is not None:
+            return card_data
+        count('cache_misses')
+
+        card_data = self._card_store.get_printing_data(
+            set_code, collector_number
+        )
+        if card_data is not None:
+            with timed('classify'):
+                self._classifier.get_flags(card_data)
+            self._card_cache.set(key, card_data)
+        return card_data
+
+    def _fetch_named(self, card):
+        try:
+            response = self._request(
+                'GET', '/cards/named', params={'exact': card}
+            )
+            if response.status_code == 404:
+                self._not_found_cache.set(card, True)
+                return None
+            response.raise_for_status()
+            card_data = CardRecord.from_card_data(response.json())
+        except requests.exceptions.RequestException as e:
+            raise UpstreamUnavailable(UPSTREAM_UNAVAILABLE_MESSAGE) from e
+
+        with timed('classify'):
+            self._classifier.get_flags(card_data)
+        self._card_cache.set(card, card_data)
+        return card_data
+
+    def _fetch_collection(self, batch):
+        try:
+            response = self._request(
+                'POST',
+                '/cards/collection',
+                json={'identifiers': [{'name': card} for card in batch]},
+            )
+            response.raise_for_status()
+            payload = response.json()
+        except requests.exceptions.RequestException as e:
+            raise UpstreamUnavailable(UPSTREAM_UNAVAILABLE_MESSAGE) from e
+        returned_cards = payload.get('data', [])
+        # Scryfall lists the identifiers it did not find as they were sent
+        not_found = {
+            identifier.get('name')
+            for identifier in payload.get('not_found', [])
+        }
+
+        # Scryfall matches names case-insensitively and by face name, so map
+        # each returned card back to the names that were requested
+        returned_by_name = {}
+        for returned_card in returned_cards:
+            card_data = CardRecord.from_card_data(returned_card)
+            returned_by_name[card_data.name.lower()] = card_data
+            for face in returned_card.get('card_faces', []):
+                returned_by_name.setdefault(face['name'].lower(), card_data)
+
+        cards_data = {}
+        for card in batch:
+            card_data = returned_by_name.get(card.lower())
+            if card_data is None:
+                # A card found under another spelling is not cached as not
+                # found, only the cards Scryfall did not find
+                if card in not_found:
+                    self._not_found_cache.set(card, True)
+                continue
+            with timed('classify'):
+                self._classifier.get_flags(card_data)
+            self._card_cache.set(card, card_data)
+            cards_data[card] = card_data
+        return cards_data
+
+    def _request(self, method, path, **kwargs):
+        # Retry rate limited, failed and dropped requests with a backoff, as
+        # long as the retry deadline is not reached
+        deadline = time.monotonic() + self._retry_deadline
+        for attempt in range(self._max_retries + 1):
+            if (
+                self._circuit_breaker is not None
+                and not self._circuit_breaker.allow_request()
+            ):
+                UPSTREAM_ERRORS.inc(reason='circuit_open')
+                raise CircuitOpenError('Scryfall is failing, not requested.')
+
+            if self._rate_limiter is not None:
+                with timed('rate_limit'):
+                    self._rate_limiter.acquire()
+
+            error = retry_after = None
+            count('upstream_requests')
+            UPSTREAM_REQUESTS.inc()
+            start = time.perf_counter()
+            try:
+                with timed('upstream'):
+                    response = self._session.request(
+                        method,
+                        f'{self._api_url}{path}',
+                        timeout=min(
+                            self._timeout,
+                            max(deadline - time.monotonic(), 0.001),
+                        ),
+                        **kwargs,
+                    )
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                UPSTREAM_ERRORS.inc(reason=type(e).__name__)
+                self._record(success=False)
+                if attempt == self._max_retries:
+                    raise
+                error = e
+            except requests.exceptions.RequestException as e:
+                # Not retried, but a failure of the circuit probe too
+                UPSTREAM_ERRORS.inc(reason=type(e).__name__)
+                self._record(success=False)
+                raise
+            else:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - start)
+                # A 404 of /cards/named is a card that does not exist
+                if response.status_code >= 400 and response.status_code != 404:
+                    UPSTREAM_ERRORS.inc(reason=response.status_code)
+                # Only server errors mean that Scryfall is failing
+                self._record(success=response.status_code < 500)
+                if (
+                    response.status_code not in self.RETRY_STATUS_CODES
+                    or attempt == self._max_retries
+                ):
+                    return response
+                retry_after = response.headers.get('Retry-After')
+
+            delay = min(self._retry_backoff * 2**attempt, self._max_retry_delay)
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if (
+                delay > self._max_retry_delay
+                or time.monotonic() + delay >= deadline
+            ):
+                # Fail now rather than retrying too late
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay)
+
+    def _record(self, success):
+        if self._circuit_breaker is None:
+            return
+        if success:
+            self._circuit_breaker.record_success()
+        else:
+            self._circuit_breaker.record_failure()
+
+    def _map(self, function, items):
+        if self._max_workers <= 1 or len(items) <= 1:
+            return [function(item) for item in items]
+
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._max_workers,
+                        thread_name_prefix='card-data-fetcher',
+                    )
+        # Run each item in a copy of the caller's context, so that the worker
+        # threads add to the timings of the request
+        contexts = [contextvars.copy_context() for _ in items]
+        return list(
+            self._executor.map(
+                lambda context, item: context.run(function, item),
+                contexts,
+                items,
+            )
+        )
+
+    async def _run_async(self, function, item):
+        if self._async_executor is None:
+            with self._executor_lock:
+                if self._async_executor is None:
+                    self._async_executor = ThreadPoolExecutor(
+                        max_workers=self._max_async_requests,
+                        thread_name_prefix='card-data-fetcher-async',
+                    )
+        # Like asyncio.to_thread, run in a copy of the caller's context
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._async_executor, context.run, function, item
+        )
+
+    def _create_session(self, max_workers):
+        # Keep connections alive and pooled across requests and threads
+        session = requests.Session()
+        session.headers.update(
+            {'User-Agent': 'HowManyMTG/0.1', 'Accept': 'application/json'}
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=max(max_workers, 1)
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
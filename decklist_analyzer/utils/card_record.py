@@ -0,0 +1,177 @@
+import sys
+
+
+class CardRecord:
+    """
+    A class for the compact card data the analysis needs, projected from a
+    Scryfall card object.
+
+    A Scryfall card object has several KB of prices, image URIs, legalities
+    and purchase links that the analysis never reads. The record only keeps
+    the fields read by the CardClassifier, in slots, with the low-cardinality
+    strings interned so that every record shares the same copies.
+
+    Attributes:
+        name (str): The name of the card.
+        type_line (str): The type line of the card.
+        layout (str): The layout of the card, e.g. normal or modal_dfc.
+        oracle_text (str): The oracle text of the card.
+        cmc (float): The converted mana cost of the card.
+        rarity (str): The rarity of the card.
+        face_type_lines (tuple): The type line of each face of the card.
+        flags (dict): The classification flags of the card, or None.
+        mana_cost (str): The mana cost of the card, or of its front face.
+        produced_mana (tuple): The colors of mana the card produces.
+
+    Methods:
+        from_card_data(): Projects a Scryfall card object into a record.
+        to_card_data(): Returns the record as a Scryfall-like card object.
+    """
+
+    __slots__ = (
+        'name',
+        'type_line',
+        'layout',
+        'oracle_text',
+        'cmc',
+        'rarity',
+        'face_type_lines',
+        'flags',
+        'mana_cost',
+        'produced_mana',
+    )
+
+    def __init__(
+        self,
+        name,
+        type_line='',
+        layout='',
+        oracle_text='',
+        cmc=0,
+        rarity='',
+        face_type_lines=(),
+        flags=None,
+        mana_cost='',
+        produced_mana=(),
+    ):
+        """
+        Initializes the CardRecord instance.
+
+        Args:
+            name (str): The name of the card.
+            type_line (str): The type line of the card.
+            layout (str): The layout of the card.
+            oracle_text (str): The oracle text of the card.
+            cmc (float): The converted mana cost of the card.
+            rarity (str): The rarity of the card.
+            face_type_lines (tuple): The type line of each face of the card.
+            flags (dict): The classification flags of the card, or None.
+            mana_cost (str): The mana cost of the card, or of its front face.
+            produced_mana (tuple): The colors of mana the card produces.
+        """
+        self.name = name
+        self.type_line = sys.intern(type_line)
+        self.layout = sys.intern(layout)
+        self.oracle_text = oracle_text
+        self.cmc = cmc
+        self.rarity = sys.intern(rarity)
+        self.face_type_lines = tuple(
+            sys.intern(face_type_line) for face_type_line in face_type_lines
+        )
+        self.flags = flags
+        self.mana_cost = sys.intern(mana_cost)
+        self.produced_mana = tuple(sys.intern(color) for color in produced_mana)
+
+    def __eq__(self, other):
+        if not isinstance(other, CardRecord):
+            return NotImplemented
+        return all(
+            getattr(self, slot) == getattr(other, slot)
+            for slot in self.__slots__
+        )
+
+    def __repr__(self):
+        return f'CardRecord({self.name!r})'
+
+    def __reduce__(self):
+        # Pickled as constructor arguments, so that unpickled records intern
+        # their strings again and the pickles do not repeat the slot names
+        return (
+            CardRecord,
+            (
+                self.name,
+                self.type_line,
+                self.layout,
+                self.oracle_text,
+                self.cmc,
+                self.rarity,
+                self.face_type_lines,
+                self.flags,
+                self.mana_cost,
+                self.produced_mana,
+            ),
+        )
+
+    @classmethod
+    def from_card_data(cls, card_data, flags=None):
+        """
+        Projects a Scryfall card object into a record.
+
+        Args:
+            card_data (dict): A card object in Scryfall's format, or the card
+                object returned by to_card_data().
+            flags (dict): The classification flags of the card, or None.
+
+        Returns:
+            CardRecord: The record of the card.
+        """
+        return cls(
+            card_data['name'],
+            type_line=card_data.get('type_line', ''),
+            layout=card_data.get('layout', ''),
+            oracle_text=card_data.get('oracle_text', ''),
+            cmc=card_data.get('cmc', 0),
+            rarity=card_data.get('rarity', ''),
+            face_type_lines=[
+                face.get('type_line', '')
+                for face in card_data.get('card_faces', [])
+            ],
+            flags=flags,
+            # Double-faced cards only have the mana cost of each face
+            mana_cost=card_data.get('mana_cost')
+            or next(
+                (
+                    face['mana_cost']
+                    for face in card_data.get('card_faces', [])
+                    if face.get('mana_cost')
+                ),
+                '',
+            ),
+            produced_mana=card_data.get('produced_mana', ()),
+        )
+
+    def to_card_data(self):
+        """
+        Returns the record as a Scryfall-like card object with only the
+        projected fields, without the flags.
+
+        Returns:
+            dict: A dictionary in Scryfall's format.
+        """
+        card_data = {
+            'name': self.name,
+            'type_line': self.type_line,
+            'layout': self.layout,
+            'oracle_text': self.oracle_text,
+            'cmc': self.cmc,
+            'rarity': self.rarity,
+            'mana_cost': self.mana_cost,
+        }
+        if self.produced_mana:
+            card_data['produced_mana'] = list(self.produced_mana)
+        if self.face_type_lines:
+            card_data['card_faces'] = [
+                {'type_line': face_type_line}
+                for face_type_line in self.face_type_lines
+            ]
+        return card_data
@@ -0,0 +1,418 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from decklist_analyzer.utils.card_classifier import (
+    RULES_FINGERPRINT,
+    CardClassifier,
+)
+from decklist_analyzer.utils.card_record import CardRecord
+from decklist_analyzer.utils.name_index import NameIndex
+
+
+class CardStore:
+    """
+    A class for storing card data from Scryfall bulk-data files in a local
+    SQLite database and looking it up by card name or by printing.
+
+    Each card is stored as the fields of its CardRecord, with its
+    classification flags, computed by the CardClassifier when the card is
+    ingested, and recomputed by classify_cards() when the classification rules
+    change. The set code, collector number and rarity of each printing of the
+    card are stored with it, so a printing is looked up by its primary key.
+
+    Cards are looked up by their exact name first, and by a NameIndex of the
+    stored names otherwise, so that names written with other casing, accents,
+    punctuation or face separators, or only their beginning, still resolve
+    to the card without asking Scryfall.
+
+    Attributes:
+        _path (str): The path of the SQLite database file.
+        _local (threading.local): Per-thread storage for read-only connections.
+
+    Methods:
+        ingest_bulk_data(): Streams a bulk-data file into a new database.
+        classify_cards(): Recomputes the flags computed by other rules.
+        get_card_data(): Looks up the card record for a card name.
+        get_printing_data(): Looks up the card record for a printing.
+        iter_card_data(): Iterates over every card in the store.
+        get_metadata(): Returns the metadata recorded by the last ingest.
+    """
+
+    SKIPPED_LAYOUTS = {'art_series', 'token', 'double_faced_token', 'emblem'}
+
+    def __init__(self, path):
+        """
+        Initializes the CardStore instance.
+
+        Args:
+            path (str): The path of the SQLite database file.
+        """
+        self._path = str(path)
+        self._local = threading.local()
+        self._classifier = CardClassifier()
+        self._name_index = None
+        self._name_index_version = None
+        self._name_index_lock = threading.Lock()
+
+    @property
+    def path(self):
+        """
+        str: The path of the SQLite database file.
+        """
+        return self._path
+
+    def exists(self):
+        """
+        Checks if the database file has been created by an ingest.
+
+        Returns:
+            bool: True if the database file exists, False otherwise.
+        """
+        return os.path.exists(self._path)
+
+    @property
+    def version(self):
+        """
+        str: An identifier of the current database file, which changes with
+        every ingest and every classification of the cards.
+        """
+        stat = os.stat(self._path)
+        return f'{stat.st_ino}-{stat.st_mtime_ns}'
+
+    def ingest_bulk_data(self, bulk_file, source='', batch_size=1000):
+        """
+        Streams a Scryfall bulk-data file (oracle-cards, default-cards, ...)
+        into the store.
+
+        The database is built next to the current one and swapped in once the
+        ingest is complete, so readers never see a partially written store.
+
+        Args:
+            bulk_file (file): A text file object with the bulk-data JSON array.
+            source (str): A description of the bulk-data file being ingested.
+            batch_size (int): The number of cards inserted per transaction.
+
+        Returns:
+            int: The number of cards ingested.
+        """
+        tmp_path = f'{self._path}.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        connection = sqlite3.connect(tmp_path)
+        try:
+            self._create_schema(connection)
+            card_count = 0
+            card_ids = {}
+            seen_names = set()
+            batch = []
+            printings = []
+
+            for card_data in self._iter_bulk_cards(bulk_file):
+                if card_data.get('layout') in self.SKIPPED_LAYOUTS:
+                    continue
+
+                # default-cards has one entry per printing, keep the first one
+                # and only index the printing of the others
+                names = self._card_names(card_data)
+                card_id = card_ids.get(names[0])
+                if card_id is None:
+                    if names[0] in seen_names:
+                        continue
+                    card_id = card_ids[names[0]] = len(card_ids) + 1
+                    seen_names.update(names)
+                    batch.append(
+                        (card_id, names, CardRecord.from_card_data(card_data))
+                    )
+
+                printing = self._printing(card_data, card_id)
+                if printing is not None:
+                    printings.append(printing)
+
+                if len(batch) >= batch_size or len(printings) >= batch_size:
+                    self._insert_cards(connection, batch, printings)
+                    card_count += len(batch)
+                    batch = []
+                    printings = []
+
+            self._insert_cards(connection, batch, printings)
+            card_count += len(batch)
+
+            connection.executemany(
+                'INSERT INTO metadata (key, value) VALUES (?, ?)',
+                [
+                    ('source', source),
+                    ('card_count', str(card_count)),
+                    ('ingested_at', datetime.now(timezone.utc).isoformat()),
+                ],
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+        os.replace(tmp_path, self._path)
+        self._local = threading.local()
+        return card_count
+
+    def classify_cards(self, batch_size=1000):
+        """
+        Recomputes the classification flags of the cards whose flags were
+        computed by other classification rules.
+
+        Args:
+            batch_size (int): The number of cards updated per transaction.
+
+        Returns:
+            int: The number of cards classified.
+        """
+        connection = sqlite3.connect(self._path)
+        try:
+            rows = connection.execute(
+                'SELECT id, data FROM cards '
+                "WHERE flags IS NULL OR json_extract(flags, '$.rules') != ?",
+                (RULES_FINGERPRINT,),
+            ).fetchall()
+
+            for start in range(0, len(rows), batch_size):
+                connection.executemany(
+                    'UPDATE cards SET flags = ? WHERE id = ?',
+                    [
+                        (self._classify(json.loads(data)), card_id)
+                        for card_id, data in rows[start : start + batch_size]
+                    ],
+                )
+                connection.commit()
+        finally:
+            connection.close()
+
+        return len(rows)
+
+    def get_card_data(self, card):
+        """
+        Looks up the card record for the specified card name.
+
+        Args:
+            card (str): The name of the card, or the name of one of its faces,
+                written in any case, with or without accents and punctuation,
+                or its beginning if no other card starts like it.
+
+        Returns:
+            CardRecord: The record of the card, with its stored classification
+                        flags. Returns None if the card is not in the store.
+        """
+        connection = self._get_connection()
+        row = connection.execute(
+            'SELECT cards.data, cards.flags FROM names '
+            'JOIN cards ON cards.id = names.card_id '
+            'WHERE names.name = ?',
+            (card.lower(),),
+        ).fetchone()
+
+        if row is None:
+            card_id = self._get_name_index().resolve(card)
+            if card_id is None:
+                return None
+            row = connection.execute(
+                'SELECT data, flags FROM cards WHERE id = ?', (card_id,)
+            ).fetchone()
+        return self._to_record(*row)
+
+    def get_printing_data(self, set_code, collector_number):
+        """
+        Looks up the card record of a printing of a card.
+
+        Args:
+            set_code (str): The code of the set of the printing, e.g. 'aer'.
+            collector_number (str): The collector number of the printing in
+                its set.
+
+        Returns:
+            CardRecord: The record of the card, with the rarity of the
+                        printing. Returns None if the printing is not in the
+                        store.
+        """
+        try:
+            row = (
+                self._get_connection()
+                .execute(
+                    'SELECT cards.data, cards.flags, printings.rarity '
+                    'FROM printings JOIN cards ON cards.id = printings.card_id '
+                    'WHERE printings.set_code = ? '
+                    'AND printings.collector_number = ?',
+                    (set_code.lower(), collector_number.lower()),
+                )
+                .fetchone()
+            )
+        except sqlite3.OperationalError:
+            # Stores ingested before the printings were indexed
+            return None
+
+        if row is None:
+            return None
+        return self._to_record(*row)
+
+    def iter_card_data(self):
+        """
+        Iterates over every card in the store.
+
+        Yields:
+            CardRecord: The record of the card, with its stored classification
+                        flags.
+        """
+        rows = self._get_connection().execute(
+            'SELECT data, flags FROM cards ORDER BY id'
+        )
+        for data, flags in rows:
+            yield self._to_record(data, flags)
+
+    def get_metadata(self):
+        """
+        Returns the metadata recorded by the last ingest.
+
+        Returns:
+            dict: A dictionary with the source, card count and ingest time.
+        """
+        rows = self._get_connection().execute(
+            'SELECT key, value FROM metadata'
+        )
+        return dict(rows.fetchall())
+
+    def _get_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                f'file:{self._path}?mode=ro', uri=True, check_same_thread=False
+            )
+            self._local.connection = connection
+        return connection
+
+    def _get_name_index(self):
+        # Built on the first name missing from the names table, and built
+        # again once the store has been ingested again
+        version = self.version
+        with self._name_index_lock:
+            if self._name_index is None or self._name_index_version != version:
+                self._name_index = NameIndex(
+                    self._get_connection().execute(
+                        'SELECT name, card_id FROM names ORDER BY card_id'
+                    )
+                )
+                self._name_index_version = version
+            return self._name_index
+
+    def _create_schema(self, connection):
+        connection.executescript(
+            '''
+            CREATE TABLE cards (
+                id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                flags TEXT
+            );
+            CREATE TABLE names (
+                name TEXT PRIMARY KEY,
+                card_id INTEGER NOT NULL REFERENCES cards (id)
+            ) WITHOUT ROWID;
+            CREATE TABLE printings (
+                set_code TEXT NOT NULL,
+                collector_number TEXT NOT NULL,
+                card_id INTEGER NOT NULL REFERENCES cards (id),
+                rarity TEXT NOT NULL,
+                PRIMARY KEY (set_code, collector_number)
+            ) WITHOUT ROWID;
+            CREATE TABLE metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID;
+            '''
+        )
+
+    def _insert_cards(self, connection, batch, printings):
+        for card_id, names, card in batch:
+            connection.execute(
+                'INSERT INTO cards (id, data, flags) VALUES (?, ?, ?)',
+                (
+                    card_id,
+                    json.dumps(card.to_card_data(), separators=(',', ':')),
+                    self._classify(card),
+                ),
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO names (name, card_id) VALUES (?, ?)',
+                [(name, card_id) for name in names],
+            )
+        connection.executemany(
+            'INSERT OR IGNORE INTO printings '
+            '(set_code, collector_number, card_id, rarity) VALUES (?, ?, ?, ?)',
+            printings,
+        )
+        connection.commit()
+
+    def _printing(self, card_data, card_id):
+        set_code = card_data.get('set')
+        collector_number = card_data.get('collector_number')
+        if not set_code or not collector_number:
+            return None
+        return (
+            set_code.lower(),
+            collector_number.lower(),
+            card_id,
+            card_data.get('rarity', ''),
+        )
+
+    def _classify(self, card):
+        return json.dumps(
+            self._classifier.classify(card), separators=(',', ':')
+        )
+
+    def _to_record(self, data, flags, rarity=None):
+        # Stores ingested before the records kept the whole Scryfall object
+        card_data = json.loads(data)
+        if rarity is not None and rarity != card_data.get('rarity'):
+            # The flags were computed with the rarity of another printing
+            card_data['rarity'] = rarity
+            flags = None
+        return CardRecord.from_card_data(
+            card_data, json.loads(flags) if flags is not None else None
+        )
+
+    def _card_names(self, card_data):
+        # Index the full name and each face name, like Scryfall's exact search
+        names = [card_data['name'].lower()]
+        for face in card_data.get('card_faces', []):
+            face_name = face.get('name', '').lower()
+            if face_name and face_name not in names:
+                names.append(face_name)
+        return names
+
+    def _iter_bulk_cards(self, bulk_file, chunk_size=1 << 20):
+        # Decode one card object at a time instead of loading the whole array
+        decoder = json.JSONDecoder()
+        buffer = ''
+        position = 0
+        eof = False
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n[,':
+                position += 1
+
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            try:
+                card_data, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    if buffer[position:].strip():
+                        raise ValueError('Invalid bulk-data file.')
+                    return
+                chunk = bulk_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            position = end
+            yield card_data
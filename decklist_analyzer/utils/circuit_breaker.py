@@ -0,0 +1,98 @@
+import threading
+import time
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class CircuitBreaker:
+    """
+    A class for stopping requests to a failing upstream API.
+
+    The circuit is closed while the upstream API responds, and opens after a
+    number of consecutive failures. While it is open, requests are refused
+    without being made. Once the reset timeout has passed, the circuit is
+    half open and lets a single request through: the circuit closes again if
+    it succeeds, and opens for another reset timeout if it fails. If the
+    outcome of that request is never recorded, another request is let through
+    after another reset timeout. The breaker is safe to share between
+    threads.
+
+    Attributes:
+        _failure_threshold (int): The consecutive failures that open the
+            circuit.
+        _reset_timeout (float): The number of seconds the circuit stays open.
+        _failures (int): The current number of consecutive failures.
+        _state (str): The state of the circuit.
+        _opened_at (float): The monotonic time the circuit last opened, or
+            last let a request through while half open.
+
+    Methods:
+        allow_request(): Returns if a request can be made.
+        record_success(): Records a request that succeeded.
+        record_failure(): Records a request that failed.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        Initializes the CircuitBreaker instance with a closed circuit.
+
+        Args:
+            failure_threshold (int): The consecutive failures that open the
+                circuit.
+            reset_timeout (float): The number of seconds the circuit stays
+                open before a request is tried again.
+        """
+        self._failure_threshold = max(failure_threshold, 1)
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        str: The state of the circuit, closed, open or half_open.
+        """
+        with self._lock:
+            return self._state
+
+    def allow_request(self):
+        """
+        Returns if a request can be made, and lets the single request of a
+        half open circuit through.
+
+        Returns:
+            bool: True if the request can be made.
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at >= self._reset_timeout:
+                self._state = HALF_OPEN
+                self._opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Records a request that succeeded, which closes the circuit.
+        """
+        with self._lock:
+            self._failures = 0
+            self._state = CLOSED
+
+    def record_failure(self):
+        """
+        Records a request that failed, which opens the circuit after enough
+        consecutive failures, or right away if it was half open.
+        """
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == HALF_OPEN
+                or self._failures >= self._failure_threshold
+            ):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
@@ -0,0 +1,400 @@
+import math
+import os
+import pickle
+import re
+import threading
+from bisect import bisect_left
+
+from decklist_analyzer.utils.card_data_fetcher import CardDataFetcher
+
+COLORS = 'WUBRG'
+# The deck sizes of the tables written to a file: Limited, constructed,
+# companion and Commander decks, with or without their commander
+DECK_SIZES = (40, 60, 80, 99, 100)
+MAX_DECK_SIZE = 250
+OPENING_HAND_SIZE = 7
+# The tables cover the cards seen up to this turn and up to this many pips of
+# one color. Later turns and more pips use the last row, which is optimistic
+# only for the few cards with more pips of one color.
+MAX_TURN = 10
+MAX_PIPS = 5
+TABLES_VERSION = 1
+
+BASIC_LAND_TYPES = {
+    'Plains': 'W',
+    'Island': 'U',
+    'Swamp': 'B',
+    'Mountain': 'R',
+    'Forest': 'G',
+}
+
+_MANA_SYMBOL = re.compile(r'\{([^}]+)\}')
+_ADDED_MANA = re.compile(r'\{([WUBRG])\}')
+
+
+class SourceTables:
+    """
+    A class for the probabilities of drawing colored sources, computed for
+    each deck size the first time it is used.
+
+    The table of a deck size has, for every number of cards seen, number of
+    pips and number of sources of a color in the deck, the hypergeometric
+    probability of having seen at least that many sources. As the
+    probabilities grow with the number of sources, the sources needed for a
+    target probability are found with a binary search in a row of the table.
+
+    Attributes:
+        _tables (dict): The table of each deck size.
+        _lock (Lock): The lock of the tables computed on demand.
+
+    Methods:
+        probability(): Returns the probability of having seen enough sources.
+        required_sources(): Returns the sources needed for a probability.
+        dump(): Writes the tables to a file.
+        load(): Loads the tables written by dump().
+    """
+
+    def __init__(self, deck_sizes=()):
+        """
+        Initializes the SourceTables instance.
+
+        Args:
+            deck_sizes (iterable): The deck sizes whose tables are computed
+                right away, e.g. DECK_SIZES before the tables are written to
+                a file.
+        """
+        self._tables = {}
+        self._lock = threading.Lock()
+        for deck_size in deck_sizes:
+            self._table(deck_size)
+
+    def probability(self, deck_size, cards_seen, pips, sources):
+        """
+        Returns the probability of having seen at least as many sources of a
+        color as the pips of a spell.
+
+        Args:
+            deck_size (int): The number of cards of the deck.
+            cards_seen (int): The number of cards seen.
+            pips (int): The number of pips of the color.
+            sources (int): The number of sources of the color in the deck.
+
+        Returns:
+            float: The probability of having seen enough sources.
+        """
+        row = self._row(deck_size, cards_seen, pips)
+        return row[min(max(sources, 0), deck_size)]
+
+    def required_sources(self, deck_size, cards_seen, pips, target):
+        """
+        Returns the sources of a color needed to have seen at least as many
+        of them as the pips of a spell, with a target probability.
+
+        Args:
+            deck_size (int): The number of cards of the deck.
+            cards_seen (int): The number of cards seen.
+            pips (int): The number of pips of the color.
+            target (float): The target probability.
+
+        Returns:
+            int: The number of sources needed, or None if even a deck of
+                 sources does not reach the target.
+        """
+        row = self._row(deck_size, cards_seen, pips)
+        sources = bisect_left(row, target)
+        return sources if sources <= deck_size else None
+
+    def dump(self, path):
+        """
+        Writes the tables to a file, written to a temporary file and moved
+        into place like the card cache snapshots.
+
+        Args:
+            path (str): The path of the tables file.
+        """
+        tables = {
+            'version': TABLES_VERSION,
+            'max_turn': MAX_TURN,
+            'max_pips': MAX_PIPS,
+            'tables': dict(self._tables),
+        }
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as tables_file:
+            pickle.dump(tables, tables_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the tables written by dump(). The tables files are pickles, so
+        they must only be loaded from a trusted path.
+
+        Args:
+            path (str): The path of the tables file.
+
+        Returns:
+            SourceTables: The loaded tables.
+
+        Raises:
+            ValueError: If the file was written for other table bounds.
+        """
+        with open(path, 'rb') as tables_file:
+            tables = pickle.load(tables_file)
+        if (
+            not isinstance(tables, dict)
+            or tables.get('version') != TABLES_VERSION
+            or tables.get('max_turn') != MAX_TURN
+            or tables.get('max_pips') != MAX_PIPS
+        ):
+            raise ValueError(f'Unsupported source tables: {path}.')
+
+        source_tables = cls(deck_sizes=())
+        source_tables._tables.update(tables['tables'])
+        return source_tables
+
+    def _row(self, deck_size, cards_seen, pips):
+        table = self._table(deck_size)
+        cards_seen = min(max(cards_seen, 0), len(table) - 1)
+        return table[cards_seen][min(max(pips, 0), MAX_PIPS)]
+
+    def _table(self, deck_size):
+        table = self._tables.get(deck_size)
+        if table is None:
+            if not 0 < deck_size <= MAX_DECK_SIZE:
+                raise ValueError(
+                    f'The deck must have between 1 and {MAX_DECK_SIZE} cards.'
+                )
+            with self._lock:
+                table = self._tables.get(deck_size)
+                if table is None:
+                    table = self._tables[deck_size] = _compute_table(deck_size)
+        return table
+
+
+class ColorRequirements:
+    """
+    A class for computing the sources of each color a decklist needs to cast
+    its spells on curve.
+
+    The pips of each spell are parsed from its mana cost. A spell with N pips
+    of a color and a mana value of M needs N sources of the color among the
+    cards seen by turn M, and the sources of the deck needed for that with
+    the target probability are looked up in the source tables. The colors of
+    the deck need the sources of their most demanding spell, and are compared
+    with the sources of the lands of the deck. Hybrid and Phyrexian pips can
+    be paid otherwise, so they are not required.
+
+    Attributes:
+        _parsed_decklist (dict): The parsed decklist.
+        _fetcher (CardDataFetcher): The fetcher used to look up card data.
+        _tables (SourceTables): The tables of the probabilities.
+        _target (float): The target probability.
+        _on_play (bool): If the spells are cast on the play.
+
+    Methods:
+        analyze(): Computes the requirements of each color of the decklist.
+    """
+
+    def __init__(
+        self,
+        parsed_decklist,
+        fetcher=None,
+        tables=None,
+        target=0.9,
+        on_play=True,
+    ):
+        """
+        Initializes the ColorRequirements instance.
+
+        Args:
+            parsed_decklist (dict): The parsed decklist, as returned by
+                DecklistParser.
+            fetcher (CardDataFetcher): The fetcher used to look up card data.
+                A new CardDataFetcher is used if not given.
+            tables (SourceTables): The tables of the probabilities. New tables
+                are computed if not given.
+            target (float): The target probability, between 0 and 1.
+            on_play (bool): If the spells are cast on the play, so without
+                the draw of the first turn.
+
+        Raises:
+            ValueError: If the target probability is not between 0 and 1.
+        """
+        if not 0 < target < 1:
+            raise ValueError('The target probability must be between 0 and 1.')
+
+        self._parsed_decklist = parsed_decklist
+        self._fetcher = fetcher or CardDataFetcher()
+        self._tables = tables or SourceTables()
+        self._target = target
+        self._on_play = on_play
+
+    def analyze(self):
+        """
+        Computes the requirements of each color of the decklist.
+
+        Returns:
+            dict: The card count, target and colors of the decklist. Each
+                  color has its sources, the sources it requires, the spell
+                  that requires them with its pips and turn, and the
+                  probability of casting that spell on curve with the
+                  sources of the deck.
+
+        Raises:
+            AttributeError: If the card data of some cards is not found.
+        """
+        maindeck = self._parsed_decklist['deck']
+        cards_data, not_found = self._fetcher.get_cards_data(list(maindeck))
+        if not_found:
+            raise AttributeError(
+                f'Card data not found for {", ".join(not_found)}.'
+            )
+
+        card_count = sum(
+            card_info['quantity']
+            for card_info_list in maindeck.values()
+            for card_info in card_info_list
+        )
+        sources = dict.fromkeys(COLORS, 0)
+        requirements = {}
+        for card, card_info_list in maindeck.items():
+            card_data = cards_data[card]
+            if _is_land(card_data):
+                quantity = sum(
+                    card_info['quantity'] for card_info in card_info_list
+                )
+                for color in produced_colors(card_data):
+                    sources[color] += quantity
+                continue
+
+            for mana_cost in card_data.mana_cost.split(' // '):
+                pips, mana_value = parse_mana_cost(mana_cost)
+                turn = max(mana_value, 1)
+                for color, pip_count in pips.items():
+                    required = self._tables.required_sources(
+                        card_count, self._cards_seen(turn), pip_count, self._target
+                    )
+                    if required is None:
+                        required = card_count
+                    current = requirements.get(color)
+                    if current is None or required > current['required']:
+                        requirements[color] = {
+                            'required': required,
+                            'card': card_data.name,
+                            'pips': pip_count,
+                            'turn': turn,
+                        }
+
+        colors = {}
+        for color in COLORS:
+            requirement = requirements.get(color)
+            if requirement is None:
+                if sources[color]:
+                    colors[color] = {'sources': sources[color], 'required': 0}
+                continue
+            colors[color] = {
+                'sources': sources[color],
+                **requirement,
+                'probability': self._tables.probability(
+                    card_count,
+                    self._cards_seen(requirement['turn']),
+                    requirement['pips'],
+                    sources[color],
+                ),
+            }
+
+        return {
+            'card_count': card_count,
+            'target': self._target,
+            'on_play': self._on_play,
+            'colors': colors,
+        }
+
+    def _cards_seen(self, turn):
+        return OPENING_HAND_SIZE + turn - (1 if self._on_play else 0)
+
+
+def parse_mana_cost(mana_cost):
+    """
+    Parses the pips and the mana value of a mana cost, e.g. {1}{R}{R}.
+
+    Args:
+        mana_cost (str): The mana cost, of a single face or half.
+
+    Returns:
+        tuple: The number of pips of each color that must be paid with that
+               color, and the mana value of the cost.
+    """
+    pips = {}
+    mana_value = 0
+    for symbol in _MANA_SYMBOL.findall(mana_cost):
+        if symbol.isdigit():
+            mana_value += int(symbol)
+        elif symbol in COLORS:
+            pips[symbol] = pips.get(symbol, 0) + 1
+            mana_value += 1
+        elif symbol.startswith('2/'):
+            mana_value += 2
+        elif symbol not in ('X', 'Y', 'Z'):
+            # Colorless, snow, hybrid and Phyrexian pips
+            mana_value += 1
+    return pips, mana_value
+
+
+def produced_colors(card_data):
+    """
+    Returns the colors of mana a land produces.
+
+    The produced mana of Scryfall is used when the card data has it, and the
+    colors are read from the basic land types and the mana abilities of the
+    land otherwise.
+
+    Args:
+        card_data (CardRecord): The card data of the land.
+
+    Returns:
+        set: The colors produced by the land.
+    """
+    if card_data.produced_mana:
+        return {color for color in card_data.produced_mana if color in COLORS}
+
+    colors = {
+        color
+        for land_type, color in BASIC_LAND_TYPES.items()
+        if land_type in card_data.type_line.split()
+    }
+    for line in card_data.oracle_text.splitlines():
+        if 'Add ' not in line:
+            continue
+        if 'any color' in line:
+            return set(COLORS)
+        colors.update(_ADDED_MANA.findall(line))
+    return colors
+
+
+def _is_land(card_data):
+    # Modal double-faced cards with a land back face are cast as spells
+    return 'Land' in card_data.type_line.split(' // ')[0]
+
+
+def _compute_table(deck_size):
+    table = []
+    for cards_seen in range(min(OPENING_HAND_SIZE + MAX_TURN, deck_size) + 1):
+        total = math.comb(deck_size, cards_seen)
+        # The probabilities of seeing exactly each number of sources
+        pmfs = [
+            [
+                math.comb(sources, seen_sources)
+                * math.comb(deck_size - sources, cards_seen - seen_sources)
+                / total
+                for seen_sources in range(cards_seen + 1)
+            ]
+            for sources in range(deck_size + 1)
+        ]
+        table.append(
+            [
+                [min(sum(pmf[pips:]), 1.0) for pmf in pmfs]
+                for pips in range(MAX_PIPS + 1)
+            ]
+        )
+    return table
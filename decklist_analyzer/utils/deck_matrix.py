@@ -0,0 +1,351 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from decklist_analyzer.utils.analyzer import STATISTICS
+from decklist_analyzer.utils.card_classifier import CardClassifier
+from decklist_analyzer.utils.card_data_fetcher import CardDataFetcher
+
+# The columns of the card table, taken from the classification flags
+COLUMNS = (
+    'cmc',
+    'non_land',
+    'land_spell_mdfc',
+    'mythic',
+    'cheap_card_draw',
+    'cheap_mana_ramp',
+    'cheap_card_scry',
+)
+# The keys of a result, in the order of serialize_analysis()
+RESULT_KEYS = ('companion_count', 'companion') + STATISTICS
+
+_UNRESOLVED = object()
+
+
+class DeckMatrix:
+    """
+    A class for analyzing many parsed decklists at once, with the same
+    statistics as the Analyzer.
+
+    The cards of the decklists are looked up together, and stored once in a
+    columnar table, with a row for every card and rarity and a column for
+    every classification flag. Each decklist is a sparse vector of the
+    copies of each row, so the counts of every decklist are a few weighted
+    sums over the nonzero entries of the matrix, and the average converted
+    mana cost and the recommended number of lands are computed for all
+    decklists at once with the formula of the Analyzer. Requires NumPy.
+
+    Attributes:
+        _fetcher (CardDataFetcher): The fetcher used to look up card data.
+        _classifier (CardClassifier): The classifier of the cards.
+        _rows (dict): The row of each card of the table, by name and rarity.
+        _row_flags (list): The classification flags of each row.
+        _row_cards (list): The name of the card of each row.
+        _row_lists (list): The lists of cards that the card of each row is in.
+
+    Methods:
+        analyze_decklists(): Analyzes parsed decklists.
+    """
+
+    def __init__(self, fetcher=None):
+        """
+        Initializes the DeckMatrix instance.
+
+        Args:
+            fetcher (CardDataFetcher): The fetcher used to look up card data.
+                A new CardDataFetcher is used if not given.
+
+        Raises:
+            ImportError: If NumPy is not installed.
+        """
+        if np is None:
+            raise ImportError('The deck matrix requires NumPy.')
+
+        self._fetcher = fetcher or CardDataFetcher()
+        self._classifier = CardClassifier()
+        self._rows = {}
+        self._row_flags = []
+        self._row_cards = []
+        self._row_lists = []
+
+    def analyze_decklists(self, parsed_decklists):
+        """
+        Analyzes parsed decklists.
+
+        Args:
+            parsed_decklists (list): The parsed decklists, as returned by
+                DecklistParser.
+
+        Returns:
+            list: The statistics of each decklist, serialized like
+                  serialize_analysis() does, and the error of each decklist
+                  that could not be analyzed, as (result, error) pairs.
+        """
+        printings_data, cards_data = self._fetch(parsed_decklists)
+
+        # The nonzero entries of the matrix: their decklist, row and copies
+        deck_indices, rows, quantities = [], [], []
+        companions, lists, errors = [], [], []
+        # The row of each card and printing, resolved once for all decklists
+        resolved_rows = {}
+        for deck_index, parsed_decklist in enumerate(parsed_decklists):
+            companions.append(len(parsed_decklist['companion']))
+
+            # The copies of each row of the decklist, in the order of its cards
+            deck_rows = {}
+            not_found = []
+            for card, card_info_list in parsed_decklist['deck'].items():
+                for card_info in card_info_list:
+                    key = (card, card_info['set_code'], card_info['card_set_id'])
+                    row = resolved_rows.get(key, _UNRESOLVED)
+                    if row is _UNRESOLVED:
+                        row = resolved_rows[key] = self._resolve(
+                            card, _printing(card_info), printings_data, cards_data
+                        )
+                    if row is None:
+                        not_found.append(card)
+                        break
+                    deck_rows[row] = deck_rows.get(row, 0) + card_info['quantity']
+
+            if not_found:
+                errors.append(
+                    AttributeError(
+                        f'Card data not found for {", ".join(not_found)}.'
+                    )
+                )
+                lists.append(None)
+                continue
+
+            deck_lists = {
+                statistic: []
+                for statistic in STATISTICS
+                if statistic.endswith('_list')
+            }
+            for row in deck_rows:
+                card = self._row_cards[row]
+                for name in self._row_lists[row]:
+                    # The rows of a card with several rarities are listed once
+                    if card not in deck_lists[name]:
+                        deck_lists[name].append(card)
+
+            deck_indices.extend([deck_index] * len(deck_rows))
+            rows.extend(deck_rows)
+            quantities.extend(deck_rows.values())
+            errors.append(None)
+            lists.append(deck_lists)
+
+        statistics = self._statistics(
+            np.array(deck_indices, dtype=np.intp),
+            np.array(rows, dtype=np.intp),
+            np.array(quantities, dtype=np.float64),
+            np.array(companions, dtype=np.float64),
+        )
+
+        results = []
+        for deck_index, parsed_decklist in enumerate(parsed_decklists):
+            error = errors[deck_index]
+            if error is None and not statistics['valid'][deck_index]:
+                error = ValueError(
+                    'Invalid decklist. Non-land cards count or non-land cmcs count must be greater than 0.'
+                )
+            if error is not None:
+                results.append((None, error))
+                continue
+
+            result = {
+                'companion_count': len(parsed_decklist['companion']),
+                'companion': list(parsed_decklist['companion'].keys()),
+            }
+            for name, values in statistics['counts'].items():
+                result[name] = int(values[deck_index])
+            result['non_land_cmcs_count'] = float(
+                statistics['non_land_cmcs_count'][deck_index]
+            )
+            result.update(lists[deck_index])
+            result['average_cmc'] = float(
+                statistics['average_cmc'][deck_index]
+            )
+            result['recommended_number_of_lands'] = int(
+                statistics['recommended_number_of_lands'][deck_index]
+            )
+            results.append(
+                ({key: result[key] for key in RESULT_KEYS}, None)
+            )
+        return results
+
+    def _fetch(self, parsed_decklists):
+        """
+        Looks up the printings and cards of every decklist at once.
+
+        Args:
+            parsed_decklists (list): The parsed decklists.
+
+        Returns:
+            tuple: The card data of the found printings, and of the cards
+                   found by name.
+        """
+        printings = {
+            _printing(card_info)
+            for parsed_decklist in parsed_decklists
+            for card_info_list in parsed_decklist['deck'].values()
+            for card_info in card_info_list
+            if card_info['set_code']
+        }
+        printings_data = self._fetcher.get_printings_data(list(printings))
+
+        cards = {}
+        for parsed_decklist in parsed_decklists:
+            for card, card_info_list in parsed_decklist['deck'].items():
+                if any(
+                    _printing(card_info) not in printings_data
+                    for card_info in card_info_list
+                ):
+                    cards[card] = None
+        cards_data, _ = self._fetcher.get_cards_data(list(cards))
+        return printings_data, cards_data
+
+    def _resolve(self, card, printing, printings_data, cards_data):
+        """
+        Returns the row of the copies of a card listed with a printing.
+
+        Args:
+            card (str): The name of the card.
+            printing (tuple): The listed printing of the card, or None.
+            printings_data (dict): The card data of the found printings.
+            cards_data (dict): The card data of the cards found by name.
+
+        Returns:
+            int: The row of the card, or None if it was not found.
+        """
+        card_data = printings_data.get(printing)
+        if card_data is None:
+            card_data = cards_data.get(card)
+            if card_data is None:
+                return None
+
+        # The printings of a card only differ by their rarity
+        key = (card, card_data.rarity)
+        row = self._rows.get(key)
+        if row is None:
+            flags = self._classifier.get_flags(card_data)
+            row = self._rows[key] = len(self._row_flags)
+            self._row_flags.append(flags)
+            self._row_cards.append(card)
+            self._row_lists.append(self._lists(flags))
+        return row
+
+    def _lists(self, flags):
+        """
+        Returns the lists of cards that a card is listed in, like the
+        Analyzer lists it.
+
+        Args:
+            flags (dict): The classification flags of the card.
+
+        Returns:
+            tuple: The names of the lists.
+        """
+        if not flags['non_land']:
+            return ()
+
+        names = []
+        if flags['land_spell_mdfc']:
+            if flags['mythic']:
+                names.append('mythic_land_spell_mdfc_list')
+            else:
+                names.append('non_mythic_land_spell_mdfc_list')
+        for flag in ('cheap_card_draw', 'cheap_mana_ramp', 'cheap_card_scry'):
+            if flags[flag]:
+                names.append(f'{flag}_list')
+        return tuple(names)
+
+    def _statistics(self, deck_indices, rows, quantities, companions):
+        """
+        Computes the counts, the average converted mana cost and the
+        recommended number of lands of every decklist.
+
+        Args:
+            deck_indices (ndarray): The decklist of each nonzero entry.
+            rows (ndarray): The row of each nonzero entry.
+            quantities (ndarray): The copies of each nonzero entry.
+            companions (ndarray): The number of companions of each decklist.
+
+        Returns:
+            dict: The statistics of every decklist, as arrays, and if each
+                  decklist is valid.
+        """
+        deck_count = len(companions)
+        columns = {
+            column: np.array(
+                [flags[column] for flags in self._row_flags], dtype=np.float64
+            )[rows]
+            for column in COLUMNS
+        }
+
+        def total(weights):
+            return np.bincount(deck_indices, weights, minlength=deck_count)
+
+        non_land = quantities * columns['non_land']
+        land_spell_mdfc = non_land * columns['land_spell_mdfc']
+        counts = {
+            'card_count': total(quantities),
+            'non_land_count': total(non_land),
+            'cheap_card_draw_count': total(non_land * columns['cheap_card_draw']),
+            'cheap_card_scry_count': total(non_land * columns['cheap_card_scry']),
+            'cheap_mana_ramp_count': total(non_land * columns['cheap_mana_ramp']),
+            'non_mythic_land_spell_mdfc_count': total(
+                land_spell_mdfc * (1 - columns['mythic'])
+            ),
+            'mythic_land_spell_mdfc_count': total(
+                land_spell_mdfc * columns['mythic']
+            ),
+        }
+        non_land_cmcs_count = total(non_land * columns['cmc'])
+
+        valid = (non_land_cmcs_count > 0) & (counts['non_land_count'] > 0)
+        average_cmc = np.divide(
+            non_land_cmcs_count,
+            counts['non_land_count'],
+            out=np.zeros(deck_count),
+            where=valid,
+        )
+
+        # The formula of Analyzer._calculate_number_of_lands(), with its
+        # operations in the same order, so that it rounds the same way
+        card_count = counts['card_count']
+        commander_free_mulligan_draw_reduction = np.where(
+            card_count >= 98, 1.35, 0.0
+        )
+        companions = np.where(card_count >= 80, 1.0, companions)
+        lands = (
+            card_count / 60 * (19.59 + ((1.90 * average_cmc) + (0.27 * companions)))
+        ) - (
+            0.28
+            * (counts['cheap_card_draw_count'] + counts['cheap_mana_ramp_count'])
+            - commander_free_mulligan_draw_reduction
+        )
+        lands = lands - (
+            (0.38 * counts['non_mythic_land_spell_mdfc_count'])
+            + (0.74 * counts['mythic_land_spell_mdfc_count'])
+        )
+        lands = np.where(
+            (card_count <= 60) & (counts['cheap_card_scry_count'] >= 4),
+            np.floor(lands),
+            lands,
+        )
+
+        return {
+            'counts': counts,
+            'non_land_cmcs_count': non_land_cmcs_count,
+            'average_cmc': average_cmc,
+            # Rounds half to even, like round()
+            'recommended_number_of_lands': np.rint(lands),
+            'valid': valid,
+        }
+
+
+def _printing(card_info):
+    if card_info['set_code'] is None:
+        return None
+    return (card_info['set_code'], card_info['card_set_id'])
@@ -1,12 +1,30 @@
 import re
 
+# The name runs up to the set information or to the markers exported after
+# it, like the '*F*' of foil and the '*E*' of etched printings, so it keeps
+# any other punctuation, like the '//' of split cards or the '!' of
+# 'Ach! Hans, Run!'
+CARD_PATTERN = re.compile(r'^\s*(?P<quantity>\d+)\s+(?P<card_name>[^()*]+)')
+SET_PATTERN = re.compile(r'\((?P<set_code>\w+)\)\s+(?P<card_set_id>\w+)')
+
+# Any of the '\r\n', '\n' and '\r' line endings
+LINE_BREAK_PATTERN = re.compile(r'\r\n?|\n')
+
+SECTIONS = ('companion', 'deck', 'sideboard')
+
+INVALID_DECKLIST_MESSAGE = 'Invalid entry. Enter a valid decklist by explicitly entering each section that your decklist has. Example: Companion ... Deck ... Sideboard ...'
+
 
 class DecklistParser:
     """
     A class for parsing a decklist and extracting card information.
 
+    The decklist is read line by line in a single pass, which validates its
+    sections and extracts its cards at the same time, so it can be given as
+    a string or as any iterator of lines, like a file object or an upload.
+
     Attributes:
-        _decklist (str): The raw decklist to be parsed.
+        _decklist (str | iterable): The raw decklist to be parsed, or its lines.
         _parsed_decklist (dict): A dictionary to store the parsed decklist data.
     """
 
@@ -15,9 +33,11 @@ class DecklistParser:
         Initializes the DecklistParser instance.
 
         Args:
-            decklist (str): The raw decklist to be parsed.
+            decklist (str | iterable): The raw decklist to be parsed, or an
+                iterator of its lines (str or bytes), with '\\n', '\\r\\n' or
+                '\\r' line endings.
         """
-        self._decklist = decklist.lower().strip()
+        self._decklist = decklist
         self._parsed_decklist = {'companion': {}, 'deck': {}, 'sideboard': {}}
 
     @property
@@ -34,88 +54,152 @@ class DecklistParser:
         """
         Parses the decklist and extracts card information.
 
+        A decklist starts with its Companion or Deck section. The Companion
+        section has a single card and is followed by a blank line, and the
+        Sideboard section, if any, is separated from the Deck by a blank line.
+
         Returns:
             dict: A dictionary containing the parsed decklist data.
         """
-        lines = self._decklist.split('\r\n')
-
-        if self._is_valid_decklist(lines):
-            card_pattern = (
-                r'^\s*(?P<quantity>\d+)\s+(?P<card_name>[\w\s\'\,\-]+)'
+        validator = _DecklistValidator()
+        current_section = None
+        section_error = None
+
+        for line in self._iter_lines():
+            validator.feed(line)
+
+            if line.startswith(SECTIONS):
+                current_section = line.strip()
+                continue
+
+            match = CARD_PATTERN.match(line)
+            if match is None or section_error is not None:
+                continue
+
+            set_info = SET_PATTERN.search(line) if '(' in line else None
+            if set_info:
+                set_code = set_info.group('set_code')
+                card_set_id = set_info.group('card_set_id')
+            else:
+                set_code = None
+                card_set_id = None
+
+            # Report a card outside of the known sections once the decklist
+            # is known to be valid, like before the sections were validated
+            # in the same pass
+            section = self._parsed_decklist.get(current_section)
+            if section is None:
+                section_error = KeyError(current_section)
+                continue
+
+            section.setdefault(match.group('card_name').strip(), []).append(
+                {
+                    'quantity': int(match.group('quantity')),
+                    'set_code': set_code,
+                    'card_set_id': card_set_id,
+                }
             )
-            set_pattern = r'\((?P<set_code>\w+)\)\s+(?P<card_set_id>\d+)'
 
-            current_section = None
+        if not validator.is_valid():
+            raise KeyError(INVALID_DECKLIST_MESSAGE)
+        if section_error is not None:
+            raise section_error
+
+        return self._parsed_decklist
 
+    def _iter_lines(self):
+        if isinstance(self._decklist, str):
+            return LINE_BREAK_PATTERN.split(self._decklist.lower().strip())
+        return self._iter_stream_lines(self._decklist)
+
+    def _iter_stream_lines(self, chunks):
+        # Yield the lowercased lines like the stripped string decklist would
+        # have them: leading blank lines are skipped, the last non-blank line
+        # is held back to be right-stripped, and the blank lines after it are
+        # only yielded once another non-blank line follows
+        previous_line = None
+        blank_lines = []
+
+        for chunk in chunks:
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode('utf-8')
+            if chunk.endswith('\n'):
+                chunk = chunk[:-2] if chunk.endswith('\r\n') else chunk[:-1]
+            elif chunk.endswith('\r'):
+                chunk = chunk[:-1]
+
+            lines = (
+                LINE_BREAK_PATTERN.split(chunk)
+                if '\r' in chunk or '\n' in chunk
+                else (chunk,)
+            )
             for line in lines:
-                if line.startswith('companion'):
-                    current_section = line.strip()
-                elif line.startswith('deck'):
-                    current_section = line.strip()
-                elif line.startswith('sideboard'):
-                    current_section = line.strip()
+                line = line.lower()
+                if not line.strip():
+                    if previous_line is not None:
+                        blank_lines.append(line)
+                    continue
+
+                if previous_line is None:
+                    line = line.lstrip()
                 else:
-                    match = re.search(card_pattern, line)
-                    if match:
-                        quantity = int(match.group('quantity'))
-                        card_name = match.group('card_name').strip()
-                        set_info = re.search(set_pattern, line)
-
-                        if set_info:
-                            set_code = set_info.group('set_code')
-                            card_set_id = set_info.group('card_set_id')
-                        else:
-                            set_code = None
-                            card_set_id = None
-
-                        self._parsed_decklist[current_section].setdefault(
-                            card_name, []
-                        )
-                        self._parsed_decklist[current_section][
-                            card_name
-                        ].append(
-                            {
-                                'quantity': quantity,
-                                'set_code': set_code,
-                                'card_set_id': card_set_id,
-                            }
-                        )
-
-            return self._parsed_decklist
-
-        else:
-            raise KeyError(
-                'Invalid entry. Enter a valid decklist by explicitly entering each section that your decklist has. Example: Companion ... Deck ... Sideboard ...'
-            )
+                    yield previous_line
+                    yield from blank_lines
+                    blank_lines.clear()
+                previous_line = line
+
+        if previous_line is not None:
+            yield previous_line.rstrip()
+
+
+class _DecklistValidator:
+    """
+    Validates the sections of a decklist, one line at a time.
+
+    The first line must name the Companion or the Deck section, and with a
+    companion, the fourth line must name the Deck section. After the first
+    'deck' line, the first blank line must come right before the first
+    'sideboard' line, or be the last line when there is no sideboard.
+    """
 
-    def _is_valid_decklist(self, decklist):
-        if self._is_valid_decklist_start(decklist):
-            if self._is_valid_decklist_end(decklist):
-                return True
-        return False
-
-    def _is_valid_decklist_start(self, decklist):
-        if 'companion' in decklist[0]:
-            if 'deck' in decklist[3]:
-                return True
-
-        elif 'deck' in decklist[0]:
-            return True
-
-    def _is_valid_decklist_end(self, decklist):
-        deck_index = decklist.index('deck')
-        sublist_after_deck = decklist[deck_index + 1 :]
-        sublist_after_deck_len = len(sublist_after_deck)
-        if '' in sublist_after_deck:
-            if 'sideboard' in sublist_after_deck:
-                if (
-                    sublist_after_deck.index('')
-                    == sublist_after_deck.index('sideboard') - 1
-                ):
-                    return True
-
-            elif sublist_after_deck.index('') + 1 == sublist_after_deck_len:
-                return True
-
-        elif 'sideboard' not in sublist_after_deck:
-            return True
+    def __init__(self):
+        self._line_count = 0
+        self._starts_with_companion = False
+        self._valid_start = False
+        self._deck_seen = False
+        self._after_deck_count = 0
+        self._first_blank_index = None
+        self._first_sideboard_index = None
+
+    def feed(self, line):
+        index = self._line_count
+        self._line_count += 1
+
+        if index == 0:
+            if 'companion' in line:
+                self._starts_with_companion = True
+            else:
+                self._valid_start = 'deck' in line
+        elif index == 3 and self._starts_with_companion:
+            self._valid_start = 'deck' in line
+
+        if not self._deck_seen:
+            self._deck_seen = line == 'deck'
+            return
+
+        if line == '' and self._first_blank_index is None:
+            self._first_blank_index = self._after_deck_count
+        elif line == 'sideboard' and self._first_sideboard_index is None:
+            self._first_sideboard_index = self._after_deck_count
+        self._after_deck_count += 1
+
+    def is_valid(self):
+        if not self._valid_start or not self._deck_seen:
+            return False
+
+        if self._first_blank_index is not None:
+            if self._first_sideboard_index is not None:
+                return self._first_blank_index == self._first_sideboard_index - 1
+            return self._first_blank_index + 1 == self._after_deck_count
+
+        return self._first_sideboard_index is None
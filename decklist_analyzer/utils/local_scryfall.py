@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class LocalScryfallServer:
+    """
+    A class for serving a recorded card pool through a local stand-in for the
+    Scryfall API, so that the fetcher can be tested and benchmarked offline.
+
+    The server answers the /cards/named and /cards/collection endpoints and
+    counts the requests it receives.
+
+    Attributes:
+        _cards_by_name (dict): The card pool indexed by card and face name.
+        _latency (float): The number of seconds each response is delayed.
+        _requests (list): The (method, path) of every request received.
+
+    Methods:
+        start(): Starts serving on a free local port.
+        stop(): Stops the server.
+        reset(): Clears the list of requests received.
+    """
+
+    COLLECTION_LIMIT = 75
+
+    def __init__(self, card_pool, latency=0.0):
+        """
+        Initializes the LocalScryfallServer instance.
+
+        Args:
+            card_pool (list): The card objects, in Scryfall's format, to serve.
+            latency (float): The number of seconds each response is delayed.
+        """
+        self._cards_by_name = {}
+        for card_data in card_pool:
+            self._cards_by_name.setdefault(card_data['name'].lower(), card_data)
+            for face in card_data.get('card_faces', []):
+                self._cards_by_name.setdefault(face['name'].lower(), card_data)
+        self._latency = latency
+        self._requests = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @classmethod
+    def from_fixture(cls, path, latency=0.0):
+        """
+        Creates a LocalScryfallServer serving the card pool of a fixture file.
+
+        Args:
+            path (str): The path of a JSON file with a list of card objects.
+            latency (float): The number of seconds each response is delayed.
+
+        Returns:
+            LocalScryfallServer: The server, not started yet.
+        """
+        with open(path, encoding='utf-8') as fixture:
+            return cls(json.load(fixture), latency=latency)
+
+    @property
+    def url(self):
+        """
+        str: The base URL of the running server.
+        """
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def requests(self):
+        """
+        list: The (method, path) of every request received.
+        """
+        with self._lock:
+            return list(self._requests)
+
+    def start(self):
+        """
+        Starts serving on a free local port in a background thread.
+
+        Returns:
+            LocalScryfallServer: The server itself.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server._handle(self)
+
+            def do_POST(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def reset(self):
+        """
+        Clears the list of requests received.
+        """
+        with self._lock:
+            self._requests.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handle(self, handler):
+        url = urlparse(handler.path)
+        with self._lock:
+            self._requests.append((handler.command, url.path))
+
+        if self._latency:
+            time.sleep(self._latency)
+
+        body = None
+        if handler.command == 'POST':
+            length = int(handler.headers.get('Content-Length', 0))
+            body = json.loads(handler.rfile.read(length) or b'{}')
+
+        if handler.command == 'GET' and url.path == '/cards/named':
+            status, payload = self._named(parse_qs(url.query))
+        elif handler.command == 'POST' and url.path == '/cards/collection':
+            status, payload = self._collection(body)
+        else:
+            status, payload = self._error(404, 'not_found')
+
+        content = json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def _named(self, query):
+        name = query.get('exact', [''])[0].lower()
+        card_data = self._cards_by_name.get(name)
+        if card_data is None:
+            return self._error(404, 'not_found')
+        return 200, card_data
+
+    def _collection(self, body):
+        identifiers = body.get('identifiers', [])
+        if len(identifiers) > self.COLLECTION_LIMIT:
+            return self._error(422, 'validation_error')
+
+        data = []
+        not_found = []
+        for identifier in identifiers:
+            card_data = self._cards_by_name.get(
+                identifier.get('name', '').lower()
+            )
+            if card_data is None:
+                not_found.append(identifier)
+            elif card_data not in data:
+                data.append(card_data)
+
+        return 200, {'object': 'list', 'not_found': not_found, 'data': data}
+
+    def _error(self, status, code):
+        return status, {'object': 'error', 'code': code, 'status': status}
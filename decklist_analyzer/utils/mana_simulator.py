@@ -0,0 +1,462 @@
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+OPENING_HAND_SIZE = 7
+# Screw is missing a land drop by this turn, and flood is having this many
+# lands more than the land drops of the last simulated turn
+SCREW_TURN = 4
+FLOOD_MARGIN = 2
+# The kinds of cards of a simulated deck
+LAND, MDFC, CANTRIP, SPELL = range(4)
+
+
+class ManaSimulator:
+    """
+    A class for simulating the land drops of a deck over a range of land
+    counts, with the London mulligan.
+
+    Opening hands of 7 cards are kept if, once the mulligans are put on the
+    bottom, they have at least 2 mana sources and 2 spells, and hands of the
+    last mulligan are always kept. Mana sources are put on the bottom when the
+    hand has more than half of them, and spells otherwise. Decks of 98 cards
+    or more get a free first mulligan, like in Commander.
+
+    When every spell is a plain spell, the probabilities are computed exactly
+    from the hypergeometric distribution. When the deck has land/spell modal
+    double-faced cards, which are played as lands when there is no land to
+    play, or cheap card draw, which is cast as soon as there is a land to
+    draw one more card, the games are sampled instead, all land counts at
+    once, with NumPy, until the number of games or the time budget is
+    reached.
+
+    Attributes:
+        _card_count (int): The number of cards of the deck.
+        _mdfc_count (int): The number of land/spell modal double-faced cards.
+        _cantrip_count (int): The number of cheap card draw spells.
+        _on_play (bool): If the games are on the play.
+        _turns (int): The number of simulated turns.
+        _max_mulligans (int): The number of mulligans before a hand is kept.
+        _free_mulligan (bool): If the first mulligan is free.
+        _games (int): The maximum number of sampled games per land count.
+        _time_budget (float): The maximum time spent sampling, in seconds.
+        _rng (Generator): The random generator of the sampled games.
+
+    Methods:
+        from_analysis(): Creates a ManaSimulator for an analyzed decklist.
+        simulate(): Simulates the games of the deck for several land counts.
+    """
+
+    def __init__(
+        self,
+        card_count,
+        mdfc_count=0,
+        cantrip_count=0,
+        on_play=True,
+        turns=6,
+        max_mulligans=3,
+        free_mulligan=None,
+        games=1_000_000,
+        time_budget=1.0,
+        seed=None,
+    ):
+        """
+        Initializes the ManaSimulator instance.
+
+        Args:
+            card_count (int): The number of cards of the deck.
+            mdfc_count (int): The number of land/spell modal double-faced cards.
+            cantrip_count (int): The number of cheap card draw spells.
+            on_play (bool): If the games are on the play.
+            turns (int): The number of simulated turns.
+            max_mulligans (int): The number of mulligans before a hand is kept.
+            free_mulligan (bool): If the first mulligan is free. Defaults to
+                True for decks of 98 cards or more.
+            games (int): The maximum number of sampled games per land count.
+            time_budget (float): The maximum time spent sampling, in seconds.
+            seed (int): The seed of the random generator of sampled games.
+        """
+        self._card_count = card_count
+        self._mdfc_count = mdfc_count
+        self._cantrip_count = cantrip_count
+        self._on_play = on_play
+        self._turns = turns
+        self._max_mulligans = max_mulligans
+        if free_mulligan is None:
+            free_mulligan = card_count >= 98
+        self._free_mulligan = free_mulligan
+        self._games = games
+        self._time_budget = time_budget
+        self._rng = np.random.default_rng(seed) if np is not None else None
+
+    @classmethod
+    def from_analysis(cls, result, **kwargs):
+        """
+        Creates a ManaSimulator for an analyzed decklist.
+
+        Args:
+            result (dict): The statistics of the decklist, as serialized by
+                serialize_analysis().
+            **kwargs: The other arguments of the ManaSimulator.
+
+        Returns:
+            ManaSimulator: The simulator of the deck.
+        """
+        mdfc_count = (
+            result['non_mythic_land_spell_mdfc_count']
+            + result['mythic_land_spell_mdfc_count']
+        )
+        return cls(
+            result['card_count'],
+            mdfc_count=mdfc_count,
+            cantrip_count=min(
+                result['cheap_card_draw_count'],
+                result['non_land_count'] - mdfc_count,
+            ),
+            **kwargs,
+        )
+
+    def simulate(self, land_counts):
+        """
+        Simulates the games of the deck for several land counts.
+
+        Args:
+            land_counts (iterable): The numbers of lands of the deck.
+
+        Returns:
+            list: For each land count, a dictionary with the keys:
+                lands (int): The number of lands.
+                method (str): 'exact' or 'monte_carlo'.
+                games (int): The number of sampled games, or None.
+                keep_rate (float): The probability of keeping the first 7 cards.
+                average_mulligans (float): The average number of mulligans.
+                land_drops (list): The probability of having made every land
+                    drop up to each turn.
+                screw (float): The probability of missing a land drop by turn 4.
+                flood (float): The probability of having 2 lands more than the
+                    land drops of the last turn.
+
+        Raises:
+            ValueError: If a land count does not fit in the deck.
+            ImportError: If the games must be sampled and NumPy is not installed.
+        """
+        land_counts = list(land_counts)
+        spell_count = self._mdfc_count + self._cantrip_count
+        for lands in land_counts:
+            if lands < 0 or lands + spell_count > self._card_count:
+                raise ValueError(
+                    f'Invalid land count {lands} for a deck of '
+                    f'{self._card_count} cards.'
+                )
+        if self._card_count < OPENING_HAND_SIZE + self._turns:
+            raise ValueError(
+                f'Invalid deck of {self._card_count} cards to simulate '
+                f'{self._turns} turns.'
+            )
+
+        if not spell_count:
+            return [self._simulate_exact(lands) for lands in land_counts]
+
+        if np is None:
+            raise ImportError(
+                'Simulating modal double-faced cards and card draw requires NumPy.'
+            )
+        return self._simulate_games(land_counts)
+
+    def _bottom_count(self, mulligans):
+        if self._free_mulligan:
+            return max(mulligans - 1, 0)
+        return mulligans
+
+    def _kept_sources(self, sources, bottom_count):
+        """
+        Returns the mana sources kept in a hand once the mulligans are put on
+        the bottom.
+
+        Args:
+            sources (int): The mana sources in the 7 cards.
+            bottom_count (int): The number of cards put on the bottom.
+
+        Returns:
+            int: The kept mana sources.
+        """
+        hand_size = OPENING_HAND_SIZE - bottom_count
+        lowest = max(sources - bottom_count, 0)
+        highest = min(sources, hand_size)
+        return min(max(math.ceil(hand_size / 2), lowest), highest)
+
+    def _result(self, lands, method, games, keep_rate, mulligans, drops, flood):
+        return {
+            'lands': lands,
+            'method': method,
+            'games': games,
+            'keep_rate': keep_rate,
+            'average_mulligans': mulligans,
+            'land_drops': drops,
+            'screw': 1 - drops[min(SCREW_TURN, self._turns) - 1],
+            'flood': flood,
+        }
+
+    def _simulate_exact(self, lands):
+        """
+        Computes the probabilities of a land count from the hypergeometric
+        distribution of the lands in the opening hands and the draws.
+
+        Args:
+            lands (int): The number of lands of the deck.
+
+        Returns:
+            dict: The probabilities of the land count.
+        """
+        card_count = self._card_count
+        library_count = card_count - OPENING_HAND_SIZE
+        drops = [0.0] * self._turns
+        flood = 0.0
+        mulligans = 0.0
+        keep_rate = None
+        reach = 1.0
+
+        for attempt in range(self._max_mulligans + 1):
+            bottom_count = self._bottom_count(attempt)
+            hand_size = OPENING_HAND_SIZE - bottom_count
+            kept = 0.0
+            for hand_lands in range(OPENING_HAND_SIZE + 1):
+                probability = _hypergeometric_pmf(
+                    hand_lands, card_count, lands, OPENING_HAND_SIZE
+                )
+                kept_lands = self._kept_sources(hand_lands, bottom_count)
+                if not probability or (
+                    attempt < self._max_mulligans
+                    and not 2 <= kept_lands <= hand_size - 2
+                ):
+                    continue
+
+                # The cards put on the bottom are not drawn in a few turns
+                weight = reach * probability
+                library_lands = lands - hand_lands
+                kept += probability
+                mulligans += weight * attempt
+                for turn in range(1, self._turns + 1):
+                    drops[turn - 1] += weight * _hypergeometric_sf(
+                        turn - kept_lands,
+                        library_count,
+                        library_lands,
+                        self._draws(turn),
+                    )
+                flood += weight * _hypergeometric_sf(
+                    self._turns + FLOOD_MARGIN - kept_lands,
+                    library_count,
+                    library_lands,
+                    self._draws(self._turns),
+                )
+
+            if keep_rate is None:
+                keep_rate = kept
+            reach *= 1 - kept
+
+        return self._result(lands, 'exact', None, keep_rate, mulligans, drops, flood)
+
+    def _draws(self, turn):
+        return turn - 1 if self._on_play else turn
+
+    def _simulate_games(self, land_counts):
+        """
+        Samples games of every land count at once, in chunks, until the
+        number of games or the time budget is reached.
+
+        Args:
+            land_counts (list): The numbers of lands of the deck.
+
+        Returns:
+            list: The probabilities of each land count.
+        """
+        deadline = time.perf_counter() + self._time_budget
+        chunk_games = max(min(self._games, 200_000 // len(land_counts)), 1)
+        totals = np.zeros((len(land_counts), self._turns + 3))
+        games = 0
+        while games < self._games:
+            chunk_games = min(chunk_games, self._games - games)
+            totals += self._sample_games(land_counts, chunk_games)
+            games += chunk_games
+            if time.perf_counter() >= deadline:
+                break
+
+        results = []
+        for lands, lands_totals in zip(land_counts, totals / games):
+            keep_rate, mulligans, flood = lands_totals[:3]
+            results.append(
+                self._result(
+                    lands,
+                    'monte_carlo',
+                    games,
+                    float(keep_rate),
+                    float(mulligans),
+                    [float(drop) for drop in lands_totals[3:]],
+                    float(flood),
+                )
+            )
+        return results
+
+    def _sample_games(self, land_counts, games):
+        """
+        Samples games of every land count.
+
+        The cards of each kind in the hands and libraries of the games are
+        kept in one row per kind, so that every step of the games is a few
+        operations over contiguous arrays.
+
+        Args:
+            land_counts (list): The numbers of lands of the deck.
+            games (int): The number of games per land count.
+
+        Returns:
+            ndarray: For each land count, the number of kept first hands,
+                     mulligans, floods and land drops made up to each turn.
+        """
+        lands = np.repeat(np.array(land_counts, dtype=np.int32), games)
+        decks = np.empty((4, len(lands)), dtype=np.int32)
+        decks[LAND] = lands
+        decks[MDFC] = self._mdfc_count
+        decks[CANTRIP] = self._cantrip_count
+        decks[SPELL] = (
+            self._card_count - self._mdfc_count - self._cantrip_count - lands
+        )
+
+        hands, libraries, mulligans = self._mulligan(decks)
+
+        played_lands = np.zeros(len(lands), dtype=np.int32)
+        played_sources = np.zeros(len(lands), dtype=np.int32)
+        on_curve = np.ones(len(lands), dtype=bool)
+        drops = []
+        for turn in range(1, self._turns + 1):
+            if turn > 1 or not self._on_play:
+                hands += self._draw(libraries)
+
+            # Lands are played before modal double-faced cards
+            play_land = hands[LAND] > 0
+            play_mdfc = ~play_land & (hands[MDFC] > 0)
+            hands[LAND] -= play_land
+            hands[MDFC] -= play_mdfc
+            played_lands += play_land
+            played_sources += play_land | play_mdfc
+            on_curve = on_curve & (play_land | play_mdfc)
+            drops.append(on_curve)
+
+            cast = np.flatnonzero((hands[CANTRIP] > 0) & (played_sources > 0))
+            if len(cast):
+                hands[CANTRIP, cast] -= 1
+                hands[:, cast] += self._draw(libraries, cast)
+
+        flood = played_lands + hands[LAND] >= self._turns + FLOOD_MARGIN
+        columns = np.stack([mulligans == 0, mulligans, flood] + drops)
+        return columns.reshape(len(columns), len(land_counts), games).sum(2).T
+
+    def _mulligan(self, decks):
+        """
+        Samples the opening hands of games, with the London mulligan.
+
+        Args:
+            decks (ndarray): The cards of each kind of the deck of each game.
+
+        Returns:
+            tuple: The kept hand, the library and the mulligans of each game.
+        """
+        hands = np.zeros_like(decks)
+        libraries = np.zeros_like(decks)
+        mulligans = np.zeros(decks.shape[1], dtype=np.int32)
+        pending = np.arange(decks.shape[1])
+        for attempt in range(self._max_mulligans + 1):
+            library = decks[:, pending]
+            seen = np.zeros_like(library)
+            for _ in range(OPENING_HAND_SIZE):
+                seen += self._draw(library)
+
+            bottom_count = self._bottom_count(attempt)
+            hand_size = OPENING_HAND_SIZE - bottom_count
+            sources = seen[LAND] + seen[MDFC]
+            kept_sources = np.clip(
+                math.ceil(hand_size / 2),
+                np.maximum(sources - bottom_count, 0),
+                np.minimum(sources, hand_size),
+            )
+
+            # Lands go to the bottom before modal double-faced cards, and
+            # plain spells before card draw
+            bottom_sources = sources - kept_sources
+            bottom_lands = np.minimum(seen[LAND], bottom_sources)
+            bottom_spells = bottom_count - bottom_sources
+            bottom_plain = np.minimum(seen[SPELL], bottom_spells)
+            seen[LAND] -= bottom_lands
+            seen[MDFC] -= bottom_sources - bottom_lands
+            seen[SPELL] -= bottom_plain
+            seen[CANTRIP] -= bottom_spells - bottom_plain
+
+            if attempt == self._max_mulligans:
+                keep = np.ones(len(pending), dtype=bool)
+            else:
+                keep = (kept_sources >= 2) & (kept_sources <= hand_size - 2)
+            kept = pending[keep]
+            hands[:, kept] = seen[:, keep]
+            # The cards put on the bottom are not drawn in a few turns
+            libraries[:, kept] = library[:, keep]
+            mulligans[kept] = attempt
+            pending = pending[~keep]
+        return hands, libraries, mulligans
+
+    def _draw(self, libraries, games=None):
+        """
+        Draws a card from the libraries of the games.
+
+        Args:
+            libraries (ndarray): The cards of each kind left in the library of
+                each game, updated in place.
+            games (ndarray): The games that draw a card. Defaults to all.
+
+        Returns:
+            ndarray: For each kind, if the card drawn by each game is of that
+                     kind.
+        """
+        library = libraries if games is None else libraries[:, games]
+        lands = library[LAND]
+        mdfcs = lands + library[MDFC]
+        cantrips = mdfcs + library[CANTRIP]
+        picks = self._rng.random(library.shape[1], dtype=np.float32) * (
+            cantrips + library[SPELL]
+        )
+        kinds = (
+            (picks >= lands).view(np.int8)
+            + (picks >= mdfcs).view(np.int8)
+            + (picks >= cantrips).view(np.int8)
+        )
+        drawn = kinds == np.arange(4, dtype=np.int8)[:, None]
+        if games is None:
+            libraries -= drawn
+        else:
+            libraries[:, games] -= drawn
+        return drawn
+
+
+def _hypergeometric_pmf(successes, population, population_successes, draws):
+    if not 0 <= successes <= population_successes:
+        return 0.0
+    if draws - successes > population - population_successes:
+        return 0.0
+    return (
+        math.comb(population_successes, successes)
+        * math.comb(population - population_successes, draws - successes)
+        / math.comb(population, draws)
+    )
+
+
+def _hypergeometric_sf(successes, population, population_successes, draws):
+    # The probability of drawing at least this many successes
+    return sum(
+        _hypergeometric_pmf(
+            count, population, population_successes, draws
+        )
+        for count in range(max(successes, 0), draws + 1)
+    )
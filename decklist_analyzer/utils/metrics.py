@@ -0,0 +1,578 @@
+import atexit
+import contextlib
+import fcntl
+import glob
+import json
+import math
+import os
+import threading
+import uuid
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# The file where the counters and histograms of exited processes are summed,
+# and the file locked while it is read or written
+DEAD_SNAPSHOT_NAME = 'dead-workers.json'
+DEAD_SNAPSHOT_LOCK_NAME = 'dead-workers.lock'
+
+
+class Counter:
+    """
+    A class for a metric that only goes up, like a number of requests.
+
+    Methods:
+        inc(): Increments the counter.
+        samples(): Returns the samples of the counter.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Initializes the Counter instance.
+
+        Args:
+            name (str): The name of the metric, ending with _total.
+            documentation (str): The help text of the metric.
+            labelnames (tuple): The names of the labels of the metric.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        """
+        Increments the counter.
+
+        Args:
+            value (float): The value added to the counter.
+            **labels: The values of the labels of the metric.
+        """
+        key = tuple(str(labels[name]) for name in self._labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        """
+        Returns the samples of the counter.
+
+        Returns:
+            list: The (name, labels, value) of each sample.
+        """
+        with self._lock:
+            return [
+                (self.name, dict(zip(self._labelnames, key)), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Histogram:
+    """
+    A class for a metric that counts observations in buckets, like request
+    durations.
+
+    Methods:
+        observe(): Records an observation.
+        samples(): Returns the samples of the histogram.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes the Histogram instance.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            buckets (tuple): The upper bounds of the buckets, in ascending order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(buckets) + (math.inf,)
+        self._counts = [0] * len(self._buckets)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Records an observation.
+
+        Args:
+            value (float): The observed value.
+        """
+        with self._lock:
+            self._sum += value
+            for index, bound in enumerate(self._buckets):
+                if value <= bound:
+                    self._counts[index] += 1
+                    break
+
+    def samples(self):
+        """
+        Returns the samples of the histogram, with cumulative bucket counts.
+
+        Returns:
+            list: The (name, labels, value) of each sample.
+        """
+        with self._lock:
+            samples = []
+            cumulative_count = 0
+            for bound, count in zip(self._buckets, self._counts):
+                cumulative_count += count
+                samples.append(
+                    (
+                        f'{self.name}_bucket',
+                        {'le': _format_value(bound)},
+                        cumulative_count,
+                    )
+                )
+            samples.append((f'{self.name}_sum', {}, self._sum))
+            samples.append((f'{self.name}_count', {}, cumulative_count))
+            return samples
+
+
+class Gauge:
+    """
+    A class for a metric whose value is read when the metrics are collected,
+    like a cache size. The values of the live processes are summed.
+
+    Methods:
+        samples(): Returns the samples of the gauge.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        """
+        Initializes the Gauge instance.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            function (callable): A function returning the current value.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._function = function
+
+    def samples(self):
+        """
+        Returns the current value of the gauge.
+
+        Returns:
+            list: The (name, labels, value) of the sample.
+        """
+        return [(self.name, {}, self._function())]
+
+
+class FunctionCounter(Gauge):
+    """
+    A class for a counter whose value is read when the metrics are
+    collected, like the hit count kept by a cache. The values of every
+    process are summed.
+    """
+
+    type = 'counter'
+
+
+class MetricsRegistry:
+    """
+    A class for registering metrics and exposing them in the Prometheus text
+    format.
+
+    When a directory is given, every process writes a snapshot of its metrics
+    to its own file in it from a background thread, named by its PID and a
+    random id so that a process reusing the PID of an exited one does not
+    overwrite it, and render() merges the snapshots of every process. When a
+    process exits, or render() finds that it is gone, its counters and
+    histograms are added to a single file of the exited processes, so that
+    they never go down, and its gauges are dropped.
+
+    Attributes:
+        _directory (str): The directory shared by the processes, or None.
+        _flush_interval (float): The number of seconds between snapshots.
+        _metrics (dict): The registered metrics by name.
+
+    Methods:
+        counter(): Registers a counter.
+        histogram(): Registers a histogram.
+        gauge(): Registers or replaces a gauge.
+        function_counter(): Registers or replaces a counter read from a function.
+        set_directory(): Sets the directory shared by the processes.
+        flush(): Writes the snapshot of this process.
+        mark_process_dead(): Adds the snapshot of an exited process to the
+            snapshot of the exited processes.
+        render(): Renders the metrics of every process.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        """
+        Initializes the MetricsRegistry instance.
+
+        Args:
+            directory (str): The directory shared by the processes, or None
+                to only expose the metrics of this process.
+            flush_interval (float): The number of seconds between snapshots.
+        """
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        self._fork_hook_registered = False
+        self._snapshot_pid = None
+        self._snapshot_path = None
+        self._dead_pid = None
+        self._flush_lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        """
+        Registers a counter.
+
+        Returns:
+            Counter: The registered counter.
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        """
+        Registers a histogram.
+
+        Returns:
+            Histogram: The registered histogram.
+        """
+        return self._register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name, documentation, function):
+        """
+        Registers a gauge, replacing any gauge with the same name.
+
+        Returns:
+            Gauge: The registered gauge.
+        """
+        return self._replace(Gauge(name, documentation, function))
+
+    def function_counter(self, name, documentation, function):
+        """
+        Registers a counter read from a function, replacing any counter with
+        the same name.
+
+        Returns:
+            FunctionCounter: The registered counter.
+        """
+        return self._replace(FunctionCounter(name, documentation, function))
+
+    def set_directory(self, directory):
+        """
+        Sets the directory shared by the processes and starts writing the
+        snapshots of this process to it.
+
+        Args:
+            directory (str): The directory shared by the processes, or None.
+        """
+        self._directory = str(directory) if directory else None
+        if self._directory:
+            os.makedirs(self._directory, exist_ok=True)
+            self._start_flusher()
+            if not self._fork_hook_registered:
+                # Start a flusher in the workers forked by gunicorn --preload
+                os.register_at_fork(after_in_child=self._start_flusher)
+                self._fork_hook_registered = True
+
+    def flush(self):
+        """
+        Writes the snapshot of this process to the shared directory.
+        """
+        if not self._directory:
+            return
+
+        with self._flush_lock:
+            if self._dead_pid == os.getpid():
+                return
+            snapshot = {'pid': os.getpid(), 'metrics': self._collect()}
+            path = self._own_snapshot_path()
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(tmp_path, path)
+
+    def mark_process_dead(self, pid):
+        """
+        Adds the counters and histograms of the snapshots of an exited process
+        to the snapshot of the exited processes, and removes the snapshots.
+
+        Args:
+            pid (int): The PID of the exited process.
+        """
+        if not self._directory:
+            return
+
+        pattern = os.path.join(self._directory, f'{pid}-*.json')
+        with self._dead_snapshot_lock():
+            for path in glob.glob(pattern):
+                self._fold_snapshot(path)
+
+    def render(self):
+        """
+        Renders the metrics of every process in the Prometheus text format.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        if not self._directory:
+            return self._format(self._collect())
+
+        self._start_flusher()
+        self.flush()
+
+        # Read under the lock so that a snapshot being added to the snapshot
+        # of the exited processes is not counted twice
+        with self._dead_snapshot_lock():
+            snapshots = []
+            pattern = os.path.join(self._directory, '[0-9]*-*.json')
+            for path in glob.glob(pattern):
+                snapshot = _read_snapshot(path)
+                if snapshot is None:
+                    continue
+                if _is_alive(snapshot['pid']):
+                    snapshots.append(snapshot)
+                else:
+                    self._fold_snapshot(path)
+            dead_snapshot = _read_snapshot(self._dead_snapshot_path())
+            if dead_snapshot is not None:
+                snapshots.append(dead_snapshot)
+
+        return self._format(_merge_snapshots(snapshots))
+
+    def _own_snapshot_path(self):
+        # A forked process gets its own file, and adds the files left by
+        # exited processes that had its PID to the exited processes first
+        if self._snapshot_pid != os.getpid():
+            self._snapshot_pid = os.getpid()
+            self._snapshot_path = os.path.join(
+                self._directory, f'{os.getpid()}-{uuid.uuid4().hex}.json'
+            )
+            self.mark_process_dead(os.getpid())
+        return self._snapshot_path
+
+    def _dead_snapshot_path(self):
+        return os.path.join(self._directory, DEAD_SNAPSHOT_NAME)
+
+    @contextlib.contextmanager
+    def _dead_snapshot_lock(self):
+        lock_path = os.path.join(self._directory, DEAD_SNAPSHOT_LOCK_NAME)
+        with open(lock_path, 'a', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fold_snapshot(self, path):
+        # Must be called with the lock of the snapshot of the exited processes
+        snapshot = _read_snapshot(path)
+        if snapshot is not None:
+            self._add_to_dead_snapshot(snapshot['metrics'])
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
+
+    def _add_to_dead_snapshot(self, metrics):
+        snapshots = [{'pid': None, 'metrics': metrics}]
+        dead_snapshot = _read_snapshot(self._dead_snapshot_path())
+        if dead_snapshot is not None:
+            snapshots.append(dead_snapshot)
+        merged = _merge_snapshots(snapshots)
+
+        path = self._dead_snapshot_path()
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump({'pid': None, 'metrics': merged}, snapshot_file)
+        os.replace(tmp_path, path)
+
+    def _mark_own_process_dead(self):
+        # Adds the metrics of this process to the exited processes when it
+        # exits, once even if the handler was also inherited from the parent
+        with self._flush_lock:
+            if not self._directory or self._dead_pid == os.getpid():
+                return
+            self._dead_pid = os.getpid()
+            metrics = self._collect()
+            path = self._own_snapshot_path()
+        try:
+            with self._dead_snapshot_lock():
+                self._add_to_dead_snapshot(metrics)
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Duplicate metric: {metric.name}.')
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _replace(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def _collect(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.documentation,
+                'samples': metric.samples(),
+            }
+            for metric in metrics
+        }
+
+    def _format(self, metrics):
+        lines = []
+        for name, metric in sorted(metrics.items()):
+            lines.append(f'# HELP {name} {metric["help"]}')
+            lines.append(f'# TYPE {name} {metric["type"]}')
+            for sample_name, labels, value in metric['samples']:
+                if labels:
+                    label_text = ','.join(
+                        f'{label}="{label_value}"'
+                        for label, label_value in labels.items()
+                    )
+                    sample_name = f'{sample_name}{{{label_text}}}'
+                lines.append(f'{sample_name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def _start_flusher(self):
+        # Worker processes forked from a process with a flusher thread do not
+        # inherit the thread, so every process starts its own
+        if not self._directory or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(
+            target=self._flush_periodically, name='metrics-flusher', daemon=True
+        ).start()
+        atexit.register(self._mark_own_process_dead)
+
+    def _flush_periodically(self):
+        event = threading.Event()
+        while not event.wait(self._flush_interval):
+            self._flush_quietly()
+
+    def _flush_quietly(self):
+        # A snapshot that cannot be written is retried by the next flush
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, encoding='utf-8') as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge_snapshots(snapshots):
+    # Sums the samples of the snapshots by metric, sample name and labels,
+    # without the gauges of exited processes
+    merged = {}
+    for snapshot in snapshots:
+        live = snapshot['pid'] is not None
+        for name, metric in snapshot['metrics'].items():
+            if metric['type'] == 'gauge' and not live:
+                continue
+            merged_metric = merged.setdefault(name, {**metric, 'samples': {}})
+            for sample_name, labels, value in metric['samples']:
+                key = (sample_name, tuple(sorted(labels.items())))
+                merged_metric['samples'][key] = (
+                    merged_metric['samples'].get(key, 0) + value
+                )
+
+    for metric in merged.values():
+        metric['samples'] = [
+            (sample_name, dict(labels), value)
+            for (sample_name, labels), value in metric['samples'].items()
+        ]
+    return merged
+
+
+def _is_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _resident_memory_bytes():
+    # The current resident set size on Linux, the peak one elsewhere
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = MetricsRegistry()
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    'how_many_upstream_requests_total',
+    'Requests made to the Scryfall API.',
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'how_many_upstream_errors_total',
+    'Failed requests to the Scryfall API, by status code or error.',
+    ('reason',),
+)
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'how_many_upstream_latency_seconds',
+    'Duration of the requests to the Scryfall API.',
+)
+ANALYSIS_DURATION = REGISTRY.histogram(
+    'how_many_analysis_seconds',
+    'End-to-end duration of decklist analyses, from parsing to statistics.',
+)
+ANALYSES = REGISTRY.counter(
+    'how_many_analyses_total',
+    'Decklist analyses, by outcome.',
+    ('outcome',),
+)
+REGISTRY.gauge(
+    'how_many_process_resident_memory_bytes',
+    'Resident memory of the processes.',
+    _resident_memory_bytes,
+)
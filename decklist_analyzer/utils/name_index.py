@@ -0,0 +1,171 @@
+import re
+import unicodedata
+
+# The faces of a card are written 'Fire // Ice', 'Fire/Ice' or 'Fire / Ice'
+FACE_SEPARATOR_PATTERN = re.compile(r'\s*/+\s*')
+# Apostrophes and thousands separators are dropped, other punctuation
+# separates words
+DROPPED_PUNCTUATION_PATTERN = re.compile(r'[\'’‘`,.]')
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s/]+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+_AMBIGUOUS = object()
+
+
+def normalize_name(name):
+    """
+    Normalizes a card name, so that the ways of writing the same name have
+    the same normalized name.
+
+    The name is casefolded, its accents are stripped, its apostrophes, commas
+    and periods are removed, its other punctuation is replaced by spaces, and
+    the separator of its faces is written ' // '.
+
+    Args:
+        name (str): The name of a card.
+
+    Returns:
+        str: The normalized name.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = DROPPED_PUNCTUATION_PATTERN.sub('', name.casefold())
+    name = PUNCTUATION_PATTERN.sub(' ', name)
+    name = FACE_SEPARATOR_PATTERN.sub(' // ', name)
+    return WHITESPACE_PATTERN.sub(' ', name).strip()
+
+
+class _Node:
+    __slots__ = ('label', 'children', 'value', 'unique')
+
+    def __init__(self, label='', value=None, unique=None):
+        self.label = label
+        self.children = {}
+        self.value = value
+        self.unique = unique
+
+    def merge_unique(self, value):
+        if self.unique is None:
+            self.unique = value
+        elif self.unique != value:
+            self.unique = _AMBIGUOUS
+
+
+class NameIndex:
+    """
+    A class for resolving the ways of writing a card name to the card.
+
+    Names are indexed by their normalized name in a radix trie, whose nodes
+    know the card shared by every name below them, so a name is resolved in
+    time proportional to its length: either to the card of its normalized
+    name, or, if it is the prefix of the names of a single card, to that
+    card.
+
+    Attributes:
+        _root (_Node): The root of the radix trie.
+        _size (int): The number of indexed names.
+
+    Methods:
+        add(): Indexes a name of a card.
+        resolve(): Resolves a name to its card.
+    """
+
+    def __init__(self, names=()):
+        """
+        Initializes the NameIndex instance.
+
+        Args:
+            names (iterable): The (name, card) pairs to index, where card
+                identifies the card, e.g. its id in the card store.
+        """
+        self._root = _Node()
+        self._size = 0
+        for name, card in names:
+            self.add(name, card)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, name, card):
+        """
+        Indexes a name of a card. A name whose normalized name is already
+        indexed keeps its first card.
+
+        Args:
+            name (str): The name of the card, or of one of its faces.
+            card (object): The identifier of the card.
+        """
+        key = normalize_name(name)
+        if not key:
+            return
+
+        node = self._root
+        position = 0
+        while position < len(key):
+            child = node.children.get(key[position])
+            if child is None:
+                node.children[key[position]] = _Node(
+                    key[position:], value=card, unique=card
+                )
+                self._size += 1
+                return
+
+            common = _common_prefix_length(child.label, key, position)
+            if common < len(child.label):
+                # Split the edge where the name leaves it
+                parent = _Node(child.label[:common], unique=child.unique)
+                child.label = child.label[common:]
+                parent.children[child.label[0]] = child
+                node.children[key[position]] = parent
+                child = parent
+
+            child.merge_unique(card)
+            node = child
+            position += common
+
+        if node.value is None:
+            node.value = card
+            self._size += 1
+
+    def resolve(self, name):
+        """
+        Resolves a name to its card.
+
+        Args:
+            name (str): The name of a card, or of one of its faces, written in
+                any case, with or without accents and punctuation, or its
+                beginning.
+
+        Returns:
+            object: The identifier of the card, or None if the name is not
+                    the name or the prefix of the names of a single card.
+        """
+        key = normalize_name(name)
+        if not key:
+            return None
+
+        node = self._root
+        position = 0
+        while True:
+            child = node.children.get(key[position])
+            if child is None:
+                return None
+
+            common = _common_prefix_length(child.label, key, position)
+            if position + common == len(key):
+                if common == len(child.label) and child.value is not None:
+                    return child.value
+                return None if child.unique is _AMBIGUOUS else child.unique
+            if common < len(child.label):
+                return None
+
+            node = child
+            position += common
+
+
+def _common_prefix_length(label, key, position):
+    length = 0
+    limit = min(len(label), len(key) - position)
+    while length < limit and label[length] == key[position + length]:
+        length += 1
+    return length
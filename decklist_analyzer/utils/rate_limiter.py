@@ -0,0 +1,64 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    A class for spacing out requests to an upstream API with a token bucket.
+
+    Tokens are added at a fixed rate up to the bucket capacity, and every
+    request takes one token, waiting for it if the bucket is empty. The
+    limiter is safe to share between threads.
+
+    Attributes:
+        _interval (float): The number of seconds between two new tokens.
+        _capacity (int): The maximum number of tokens, i.e. the largest burst.
+        _tokens (float): The number of tokens currently in the bucket.
+        _updated_at (float): The monotonic time the tokens were last updated.
+
+    Methods:
+        acquire(): Waits until a token is available and takes it.
+    """
+
+    def __init__(self, interval, capacity=1):
+        """
+        Initializes the RateLimiter instance with a full bucket.
+
+        Args:
+            interval (float): The number of seconds between two new tokens.
+            capacity (int): The maximum number of tokens, i.e. the largest burst.
+        """
+        self._interval = interval
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Waits until a token is available and takes it.
+
+        Returns:
+            float: The number of seconds spent waiting for the token.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._interval > 0:
+                    self._tokens = min(
+                        self._capacity,
+                        self._tokens + (now - self._updated_at) / self._interval,
+                    )
+                else:
+                    self._tokens = self._capacity
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+
+                delay = (1 - self._tokens) * self._interval
+
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,148 @@
+import hashlib
+import threading
+import time
+
+
+class SingleFlight:
+    """
+    A class for coalescing the concurrent lookups of the same keys, so that
+    only one of them requests the upstream API.
+
+    The first caller to claim a key leads its lookup, and the callers that
+    claim it before it is released wait for it instead, then read its result
+    from the cache the leader filled. When a Django cache is given as
+    backend, the keys are also locked in it, so that the lookups are
+    coalesced between worker processes sharing that cache: callers of other
+    processes wait until the lock is released or expires.
+
+    Attributes:
+        _backend (BaseCache): An optional Django cache shared between workers.
+        _namespace (str): The prefix of the locks in the Django cache.
+        _lock_timeout (float): The number of seconds a lock is held at most,
+            and a caller waits for it at most.
+        _poll_interval (float): The number of seconds between two checks of
+            a lock held by another worker.
+        _flights (dict): The event of each key led in this process.
+
+    Methods:
+        claim(): Claims the keys that no one else is looking up.
+        release(): Releases the claimed keys and wakes up their waiters.
+        wait(): Waits for the lookups of keys claimed by others.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        namespace='card',
+        lock_timeout=30.0,
+        poll_interval=0.05,
+    ):
+        """
+        Initializes the SingleFlight instance.
+
+        Args:
+            backend (BaseCache): An optional Django cache shared between workers.
+            namespace (str): The prefix of the locks in the Django cache.
+            lock_timeout (float): The number of seconds a lock is held at most,
+                and a caller waits for it at most.
+            poll_interval (float): The number of seconds between two checks of
+                a lock held by another worker.
+        """
+        self._backend = backend
+        self._namespace = namespace
+        self._lock_timeout = lock_timeout
+        self._poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys):
+        """
+        Claims the keys that no one else is looking up.
+
+        Args:
+            keys (iterable): The keys to look up.
+
+        Returns:
+            tuple: The keys claimed by the caller, which it must look up then
+                   release, and the flights of the keys looked up by others,
+                   to be given to wait().
+        """
+        claimed = []
+        flights = {}
+        with self._lock:
+            for key in keys:
+                event = self._flights.get(key)
+                if event is not None:
+                    flights[key] = event
+                else:
+                    self._flights[key] = threading.Event()
+                    claimed.append(key)
+
+        if self._backend is None or not claimed:
+            return claimed, flights
+
+        # The locks of the other workers are taken without holding the lock
+        # of this process, which every claim would wait for otherwise
+        locked = []
+        for key in claimed:
+            if self._backend.add(self._backend_key(key), 1, self._lock_timeout):
+                locked.append(key)
+            else:
+                # Looked up by another worker
+                flights[key] = None
+
+        if len(locked) < len(claimed):
+            # Wake up the callers of this process that wait for the keys
+            # locked by another worker, so that they wait for it instead
+            with self._lock:
+                for key, event in flights.items():
+                    if event is None:
+                        self._flights.pop(key).set()
+        return locked, flights
+
+    def release(self, keys):
+        """
+        Releases the claimed keys and wakes up the callers waiting for them.
+
+        Args:
+            keys (iterable): The keys claimed by the caller.
+        """
+        keys = list(keys)
+        if self._backend is not None and keys:
+            self._backend.delete_many(
+                [self._backend_key(key) for key in keys]
+            )
+        with self._lock:
+            for key in keys:
+                event = self._flights.pop(key, None)
+                if event is not None:
+                    event.set()
+
+    def wait(self, flights):
+        """
+        Waits for the lookups of keys claimed by others, for at most the lock
+        timeout.
+
+        Args:
+            flights (dict): The flights returned by claim().
+        """
+        deadline = time.monotonic() + self._lock_timeout
+        for key, event in flights.items():
+            if event is not None:
+                event.wait(max(deadline - time.monotonic(), 0))
+                if self._backend is None:
+                    continue
+                # The key may have been claimed in this process, then found
+                # locked by another worker, which is waited for too
+
+            while (
+                time.monotonic() < deadline
+                and self._backend.get(self._backend_key(key)) is not None
+            ):
+                time.sleep(self._poll_interval)
+
+    def _backend_key(self, key):
+        return (
+            f'how_many:{self._namespace}:lock:'
+            + hashlib.md5(key.encode()).hexdigest()
+        )
@@ -0,0 +1,154 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    A class for collecting the time spent in each phase of a request, and
+    counters like the number of cache misses.
+
+    The timings are shared with the threads that fetch card data for the
+    request, so the time of concurrent upstream requests is summed.
+
+    Attributes:
+        _phases (dict): The seconds spent in each phase, in first-seen order.
+        _counters (dict): The value of each counter.
+        _lock (threading.Lock): A lock for updates from several threads.
+
+    Methods:
+        add(): Adds time to a phase.
+        count(): Adds to a counter.
+        server_timing(): Formats the phases as a Server-Timing header value.
+        as_dict(): Returns the phases, in milliseconds, and the counters.
+    """
+
+    def __init__(self):
+        """
+        Initializes the RequestTimings instance.
+        """
+        self._phases = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        """
+        Adds time to the specified phase.
+
+        Args:
+            phase (str): The name of the phase.
+            seconds (float): The number of seconds spent in the phase.
+        """
+        with self._lock:
+            self._phases[phase] = self._phases.get(phase, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """
+        Adds to the specified counter.
+
+        Args:
+            name (str): The name of the counter.
+            value (int): The value added to the counter.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def server_timing(self):
+        """
+        Formats the phases as the value of a Server-Timing header.
+
+        Returns:
+            str: The phases with their durations in milliseconds.
+        """
+        with self._lock:
+            return ', '.join(
+                f'{phase};dur={seconds * 1000:.2f}'
+                for phase, seconds in self._phases.items()
+            )
+
+    def as_dict(self):
+        """
+        Returns the phases and counters.
+
+        Returns:
+            dict: The phases, with their durations in milliseconds, and the
+                  counters.
+        """
+        with self._lock:
+            return {
+                'phases': {
+                    phase: round(seconds * 1000, 3)
+                    for phase, seconds in self._phases.items()
+                },
+                **self._counters,
+            }
+
+
+def start_timings():
+    """
+    Starts collecting the timings of the current request.
+
+    Returns:
+        tuple: The new RequestTimings and the token to pass to stop_timings.
+    """
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def stop_timings(token):
+    """
+    Stops collecting the timings started by start_timings.
+
+    Args:
+        token (Token): The token returned by start_timings.
+    """
+    _current_timings.reset(token)
+
+
+def get_timings():
+    """
+    Returns the timings of the current request.
+
+    Returns:
+        RequestTimings: The timings being collected, or None outside of a
+                        timed request.
+    """
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(phase):
+    """
+    Adds the time spent in the block to a phase of the current request, if
+    its timings are being collected.
+
+    Args:
+        phase (str): The name of the phase.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    """
+    Adds to a counter of the current request, if its timings are being
+    collected.
+
+    Args:
+        name (str): The name of the counter.
+        value (int): The value added to the counter.
+    """
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.count(name, value)
@@ -1,7 +1,36 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import redirect, render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from decklist_analyzer.analysis import (
+    aget_analysis,
+    analysis_state,
+    get_analysis,
+    parse_decklist,
+)
+from decklist_analyzer.card_data import (
+    get_analysis_cache,
+    get_card_cache,
+    get_card_data_fetcher,
+    get_not_found_cache,
+    get_source_tables,
+)
+from decklist_analyzer.utils.card_data_fetcher import UpstreamUnavailable
+from decklist_analyzer.utils.color_requirements import ColorRequirements
+from decklist_analyzer.utils.mana_simulator import ManaSimulator
+from decklist_analyzer.utils.metrics import REGISTRY
+from decklist_analyzer.utils.timing import timed
 
-from decklist_analyzer.utils.analyzer import Analyzer
-from decklist_analyzer.utils.decklist_parser import DecklistParser
+# Django reads the body of these requests into request.POST and request.FILES
+FORM_CONTENT_TYPES = (
+    'multipart/form-data',
+    'application/x-www-form-urlencoded',
+)
 
 
 def index(request):
@@ -18,6 +47,10 @@ def index(request):
     If there's an error during parsing or analysis, it catches the exceptions, stores
     an error message in the session, and redirects back to the index page.
 
+    The last analysis is also kept in the session, so that a resubmitted decklist
+    with a few edited lines is analyzed by updating its statistics for the changed
+    cards only.
+
     Args:
         request (HttpRequest): The HTTP request object.
 
@@ -29,84 +62,413 @@ def index(request):
         form = request.POST
         decklist = form.get('decklist', '').strip()
 
-        request.session['preloaded_decklist'] = decklist
+        previous = _start_analysis(request, decklist)
 
         try:
-            parser = DecklistParser(decklist)
-            parser.parse_decklist()
-            analyzer = Analyzer(parser.parsed_decklist)
-            analyzer.analyze_decklist()
-
-            companion_count = len(parser.parsed_decklist['companion'])
-            companion = ', '.join(parser.parsed_decklist['companion'].keys())
-            card_count = analyzer.card_count
-            non_land_count = analyzer.non_land_count
-            non_land_cmcs_count = analyzer.non_land_cmcs_count
-            cheap_card_draw_count = analyzer.cheap_card_draw_count
-            cheap_card_draw_list = ', '.join(analyzer.cheap_card_draw_list)
-            cheap_card_scry_count = analyzer.cheap_card_scry_count
-            cheap_card_scry_list = ', '.join(analyzer.cheap_card_scry_list)
-            cheap_mana_ramp_count = analyzer.cheap_mana_ramp_count
-            cheap_mana_ramp_list = ', '.join(analyzer.cheap_mana_ramp_list)
-            non_mythic_land_spell_mdfc_count = (
-                analyzer.non_mythic_land_spell_mdfc_count
-            )
-            non_mythic_land_spell_mdfc_list = ', '.join(
-                analyzer.non_mythic_land_spell_mdfc_list
+            fetcher = get_card_data_fetcher()
+            result = get_analysis(
+                decklist, fetcher, get_analysis_cache(), previous=previous
             )
-            mythic_land_spell_mdfc_count = (
-                analyzer.mythic_land_spell_mdfc_count
-            )
-            mythic_land_spell_mdfc_list = ', '.join(
-                analyzer.mythic_land_spell_mdfc_list
+
+            _update_session(
+                request,
+                result_data=_format_result_data(result),
+                analysis_state=analysis_state(decklist, result, fetcher),
             )
-            average_cmc = f'{analyzer.average_cmc:.1f}'
-            recommended_number_of_lands = analyzer.recommended_number_of_lands
-
-            request.session['result_data'] = {
-                'companion_count': companion_count,
-                'companion': companion,
-                'card_count': card_count,
-                'non_land_count': non_land_count,
-                'non_land_cmcs_count': non_land_cmcs_count,
-                'cheap_card_draw_count': cheap_card_draw_count,
-                'cheap_card_draw_list': cheap_card_draw_list,
-                'cheap_card_scry_count': cheap_card_scry_count,
-                'cheap_card_scry_list': cheap_card_scry_list,
-                'cheap_mana_ramp_count': cheap_mana_ramp_count,
-                'cheap_mana_ramp_list': cheap_mana_ramp_list,
-                'non_mythic_land_spell_mdfc_count': non_mythic_land_spell_mdfc_count,
-                'non_mythic_land_spell_mdfc_list': non_mythic_land_spell_mdfc_list,
-                'mythic_land_spell_mdfc_count': mythic_land_spell_mdfc_count,
-                'mythic_land_spell_mdfc_list': mythic_land_spell_mdfc_list,
-                'average_cmc': average_cmc,
-                'recommended_number_of_lands': recommended_number_of_lands,
-            }
 
             return redirect('index')
 
         except (ValueError, AttributeError, KeyError) as e:
-            request.session['error_message'] = str(e).replace("'", '')
+            with timed('session'):
+                request.session['error_message'] = str(e).replace("'", '')
+
+            return redirect('index')
+
+        except UpstreamUnavailable as e:
+            with timed('session'):
+                request.session['error_message'] = str(e)
 
             return redirect('index')
+
+    return _render_index(request)
+
+
+async def index_async(request):
+    """
+    Handles the index page view like index, awaiting the analysis of the
+    decklist instead of blocking a worker while the card data is fetched.
+
+    Used instead of index when the ASYNC_VIEWS setting is True. The session is
+    read and written from a thread, since its backend may be a database.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        HttpResponse: The HTTP response object that redirects to the index page with
+        analyzed data, or with an error message if the parsing/analysis fails.
+    """
+    if request.method != 'POST':
+        return await sync_to_async(_render_index)(request)
+
+    decklist = request.POST.get('decklist', '').strip()
+    previous = await sync_to_async(_start_analysis)(request, decklist)
+
+    try:
+        fetcher = get_card_data_fetcher()
+        result = await aget_analysis(
+            decklist, fetcher, get_analysis_cache(), previous=previous
+        )
+    except (ValueError, AttributeError, KeyError) as e:
+        await sync_to_async(_update_session)(
+            request, error_message=str(e).replace("'", '')
+        )
+    except UpstreamUnavailable as e:
+        await sync_to_async(_update_session)(request, error_message=str(e))
     else:
+        await sync_to_async(_update_session)(
+            request,
+            result_data=_format_result_data(result),
+            analysis_state=analysis_state(decklist, result, fetcher),
+        )
+    return redirect('index')
+
+
+@csrf_exempt
+@require_POST
+def api_analyze(request):
+    """
+    Handles the JSON analysis API, which analyzes a decklist in a single request.
+
+    The decklist is read from a JSON body ({"decklist": "..."}), from the
+    decklist field or file upload of a form, or from a plain text body. The view does not
+    use the session, so it can be called at high rates without writing to the
+    sessions database.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The analysis of the decklist, or an error message with a
+        400 status if the decklist is invalid, or a 503 status if Scryfall is
+        unavailable.
+    """
+    try:
+        decklist = _read_api_decklist(request)
+        result = get_analysis(
+            decklist, get_card_data_fetcher(), get_analysis_cache()
+        )
+    except (ValueError, AttributeError, KeyError) as e:
+        return JsonResponse(
+            {'error': str(e).replace("'", '')}, status=400
+        )
+    except UpstreamUnavailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+    return JsonResponse(result)
+
+
+async def api_analyze_async(request):
+    """
+    Handles the JSON analysis API like api_analyze, awaiting the analysis of
+    the decklist instead of blocking a worker while the card data is fetched.
+
+    Used instead of api_analyze when the ASYNC_VIEWS setting is True.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The analysis of the decklist, or an error message with a
+        400 status if the decklist is invalid, or a 503 status if Scryfall is
+        unavailable.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    try:
+        decklist = _read_api_decklist(request)
+        result = await aget_analysis(
+            decklist, get_card_data_fetcher(), get_analysis_cache()
+        )
+    except (ValueError, AttributeError, KeyError) as e:
+        return JsonResponse({'error': str(e).replace("'", '')}, status=400)
+    except UpstreamUnavailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+    return JsonResponse(result)
+
+
+# Marked like csrf_exempt marks views, since before Django 5.0 its wrapper
+# (like require_POST's) is synchronous and cannot wrap an async view
+api_analyze_async.csrf_exempt = True
+
+
+@csrf_exempt
+@require_POST
+def api_simulate(request):
+    """
+    Handles the mana base simulation API, which analyzes a decklist and
+    simulates its land drops over a range of land counts.
+
+    The decklist is read like api_analyze reads it. The land counts are given
+    by the lands query parameter (e.g. ?lands=20-26), and default to the
+    recommended number of lands, give or take 3. The games are on the play
+    unless on_play=false is given. The number of sampled games and the time
+    spent sampling them are bounded by the MANA_SIMULATOR setting.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The analysis of the decklist and the simulation of each
+        land count, or an error message with a 400 status if the decklist or
+        the parameters are invalid, or a 503 status if Scryfall is
+        unavailable.
+    """
+    try:
+        decklist = _read_api_decklist(request)
+        result = get_analysis(
+            decklist, get_card_data_fetcher(), get_analysis_cache()
+        )
+        options = getattr(settings, 'MANA_SIMULATOR', {})
+        simulator = ManaSimulator.from_analysis(
+            result,
+            on_play=request.GET.get('on_play', 'true').lower() != 'false',
+            games=options.get('GAMES', 1_000_000),
+            time_budget=options.get('TIME_BUDGET', 1.0),
+        )
+        land_counts = _read_land_counts(request, result)
+        with timed('simulate'):
+            simulation = simulator.simulate(land_counts)
+    except (ValueError, AttributeError, KeyError) as e:
+        return JsonResponse({'error': str(e).replace("'", '')}, status=400)
+    except UpstreamUnavailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except ImportError as e:
+        return JsonResponse({'error': str(e)}, status=501)
+
+    return JsonResponse({'analysis': result, 'simulation': simulation})
+
+
+@csrf_exempt
+@require_POST
+def api_colors(request):
+    """
+    Handles the color requirements API, which computes the sources of each
+    color a decklist needs to cast its spells on curve.
+
+    The decklist is read like api_analyze reads it. The target probability
+    of casting each spell on curve is given by the target query parameter
+    (e.g. ?target=0.95) and defaults to 0.9. The spells are cast on the play
+    unless on_play=false is given.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The sources and requirements of each color, or an error
+        message with a 400 status if the decklist or the parameters are
+        invalid, or a 503 status if Scryfall is unavailable.
+    """
+    try:
+        try:
+            target = float(request.GET.get('target', 0.9))
+        except ValueError:
+            raise ValueError('The target parameter must be a probability.')
+        color_requirements = ColorRequirements(
+            parse_decklist(_read_api_decklist(request)),
+            fetcher=get_card_data_fetcher(),
+            tables=get_source_tables(),
+            target=target,
+            on_play=request.GET.get('on_play', 'true').lower() != 'false',
+        )
+        with timed('colors'):
+            colors = color_requirements.analyze()
+    except (ValueError, AttributeError, KeyError) as e:
+        return JsonResponse({'error': str(e).replace("'", '')}, status=400)
+    except UpstreamUnavailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+
+    return JsonResponse(colors)
+
+
+@require_GET
+def metrics(request):
+    """
+    Handles the metrics endpoint, scraped by Prometheus.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        HttpResponse: The metrics of every worker process, in the Prometheus
+        text exposition format.
+    """
+    # Register the cache metrics of this process even before its first analysis
+    get_card_cache()
+    get_analysis_cache()
+    get_not_found_cache()
+
+    return HttpResponse(
+        REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def _read_api_decklist(request):
+    """
+    Reads the decklist of an analysis API request.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        str | UploadedFile: The raw decklist, or the uploaded decklist file.
+
+    Raises:
+        ValueError: If the body or the form has no decklist.
+    """
+    if request.content_type == 'application/json':
+        try:
+            payload = json.loads(request.body)
+        except json.JSONDecodeError:
+            raise ValueError('Invalid JSON body.')
+        if not isinstance(payload, dict) or not isinstance(
+            payload.get('decklist'), str
+        ):
+            raise ValueError('The JSON body must have a decklist string.')
+        decklist = payload['decklist']
+    elif request.content_type in FORM_CONTENT_TYPES:
+        if 'decklist' in request.FILES:
+            # Parsed line by line, without reading the whole upload in memory
+            decklist = request.FILES['decklist']
+        elif 'decklist' in request.POST:
+            decklist = request.POST['decklist']
+        else:
+            raise ValueError('The form must have a decklist field or file.')
+    else:
+        decklist = request.body.decode(request.encoding or 'utf-8')
+
+    return decklist
+
+
+def _read_land_counts(request, result):
+    """
+    Reads the land counts of a simulation API request.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        result (dict): The statistics of the decklist.
+
+    Returns:
+        range: The land counts to simulate.
+    """
+    lands = request.GET.get('lands')
+    if lands is None:
+        recommended = result['recommended_number_of_lands']
+        return range(max(recommended - 3, 0), recommended + 4)
+
+    try:
+        lowest, _, highest = lands.partition('-')
+        lowest = int(lowest)
+        highest = int(highest or lowest)
+    except ValueError:
+        raise ValueError('The lands parameter must be a count or a range, e.g. 20-26.')
+    if not 0 <= highest - lowest < 20:
+        raise ValueError('The lands parameter must be a range of at most 20 counts.')
+    return range(lowest, highest + 1)
+
+
+def _format_result_data(result):
+    """
+    Formats the statistics of a decklist for the index page.
+
+    Args:
+        result (dict): The statistics of the decklist.
+
+    Returns:
+        dict: The statistics, with their lists joined and the average CMC rounded.
+    """
+    return {
+        **result,
+        'companion': ', '.join(result['companion']),
+        'cheap_card_draw_list': ', '.join(result['cheap_card_draw_list']),
+        'cheap_card_scry_list': ', '.join(result['cheap_card_scry_list']),
+        'cheap_mana_ramp_list': ', '.join(result['cheap_mana_ramp_list']),
+        'non_mythic_land_spell_mdfc_list': ', '.join(
+            result['non_mythic_land_spell_mdfc_list']
+        ),
+        'mythic_land_spell_mdfc_list': ', '.join(
+            result['mythic_land_spell_mdfc_list']
+        ),
+        'average_cmc': f'{result["average_cmc"]:.1f}',
+    }
+
+
+def _update_session(request, **values):
+    """
+    Stores values in the session.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        **values: The values to store, by session key.
+    """
+    with timed('session'):
+        request.session.update(values)
+
+
+def _start_analysis(request, decklist):
+    """
+    Stores the submitted decklist in the session, and reads the state of the
+    last analysis stored there.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        decklist (str): The submitted decklist.
+
+    Returns:
+        dict: The state of the last analysis, or None.
+    """
+    with timed('session'):
+        request.session['preloaded_decklist'] = decklist
+        return request.session.get('analysis_state')
+
+
+def _render_index(request):
+    """
+    Renders the index page with the result or the error message of the last
+    analysis stored in the session, or with a sample decklist.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        HttpResponse: The rendered index page.
+    """
+    with timed('session'):
+        has_result_data = 'result_data' in request.session
+        has_error_message = 'error_message' in request.session
 
-        if 'result_data' in request.session:
+    if has_result_data:
+        with timed('session'):
             preloaded_decklist = request.session['preloaded_decklist']
             request.session.pop('preloaded_decklist', None)
             result_data = request.session['result_data']
             request.session.pop('result_data', None)
+        with timed('render'):
             return render(
                 request,
                 'decklist_analyzer/index.html',
                 {'result': result_data, 'preloaded_decklist' : preloaded_decklist},
             )
 
-        elif 'error_message' in request.session:
+    elif has_error_message:
+        with timed('session'):
             preloaded_decklist = request.session['preloaded_decklist']
             request.session.pop('preloaded_decklist', None)
             error_message = request.session['error_message']
             request.session.pop('error_message', None)
+        with timed('render'):
             return render(
                 request,
                 'decklist_analyzer/index.html',
@@ -114,7 +476,7 @@ def index(request):
             )
 
 
-        request.session['preloaded_decklist'] = '''
+    request.session['preloaded_decklist'] = '''
 Companion
 1 Jegantha, the Wellspring
 
@@ -152,8 +514,10 @@ Sideboard
 2 Damping Sphere
 1 Abrade
 2 Ob Nixilis, the Adversary 
-        '''
+    '''
 
+    with timed('session'):
         preloaded_decklist = request.session['preloaded_decklist']
         request.session.pop('preloaded_decklist', None)
+    with timed('render'):
         return render(request, 'decklist_analyzer/index.html', {'preloaded_decklist' : preloaded_decklist})
@@ -46,8 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'decklist_analyzer.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'decklist_analyzer.middleware.StaticFilesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,6 +89,122 @@ DATABASES = {
 }
 
 
+# Local card store built from Scryfall bulk data (python manage.py ingest_card_data)
+
+CARD_STORE_PATH = os.getenv('CARD_STORE_PATH', BASE_DIR / 'card_data.sqlite3')
+
+CARD_DATA_OFFLINE = os.getenv('CARD_DATA_OFFLINE', '') == 'True'
+
+# Card data cache shared by every analysis of a worker. Set BACKEND to the
+# alias of a Django cache (e.g. Redis or Memcached) to share it between workers.
+# Set SNAPSHOT to a file path to restore the cache from it when a worker starts
+# and write it back when the worker exits (see python manage.py warm_card_cache).
+# Cards expired for less than STALE_TTL seconds are still served while they are
+# requested again from Scryfall in the background.
+
+CARD_CACHE = {
+    'MAX_ENTRIES': 20000,
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'TTL': 24 * 60 * 60,
+    'STALE_TTL': 7 * 24 * 60 * 60,
+    'BACKEND': os.getenv('CARD_CACHE_BACKEND') or None,
+    'SNAPSHOT': os.getenv('CARD_CACHE_SNAPSHOT') or None,
+}
+
+# Statistics of analyzed decklists, keyed by a fingerprint of the decklist and
+# of the card data and classification rules it was analyzed with.
+
+ANALYSIS_CACHE = {
+    'MAX_ENTRIES': 5000,
+    'TTL': 24 * 60 * 60,
+    'BACKEND': os.getenv('ANALYSIS_CACHE_BACKEND') or None,
+}
+
+# Names of the cards not found by Scryfall, which are not requested again until
+# they expire. Set BACKEND to share them between workers like the card cache.
+
+NOT_FOUND_CACHE = {
+    'MAX_ENTRIES': 50000,
+    'TTL': 60 * 60,
+    'BACKEND': os.getenv('NOT_FOUND_CACHE_BACKEND') or None,
+}
+
+# Requests to Scryfall for cards missing from the cache and the card store.
+# Scryfall asks for 50-100 ms between requests, i.e. about 10 per second, so
+# they are spaced out without bursts.
+# Failed requests are retried MAX_RETRIES times, waiting at most
+# MAX_RETRY_DELAY seconds between two attempts, and a request with its retries
+# takes at most RETRY_DEADLINE seconds, whatever Retry-After Scryfall sends.
+# After FAILURE_THRESHOLD failed requests in a row, Scryfall is not requested
+# for RESET_TIMEOUT seconds. Concurrent lookups of the same card make a single
+# request; set LOCK_BACKEND to the alias of the Django cache shared by the card
+# cache to make a single request across workers.
+
+CARD_DATA_FETCHER = {
+    'LOOKUP': 'collection',
+    'MAX_WORKERS': 8,
+    'MAX_ASYNC_REQUESTS': 32,
+    'REQUEST_INTERVAL': 0.1,
+    'REQUEST_BURST': 1,
+    'MAX_RETRIES': 3,
+    'RETRY_BACKOFF': 0.5,
+    'MAX_RETRY_DELAY': 5.0,
+    'RETRY_DEADLINE': 20.0,
+    'TIMEOUT': 10.0,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30.0,
+    'LOCK_BACKEND': os.getenv('CARD_DATA_LOCK_BACKEND') or None,
+}
+
+# The tables of the probabilities of drawing colored sources, used by the color
+# requirements, are computed in memory when they are first used. When a path
+# outside the source tree is set, they are written there once and loaded by the
+# next workers instead.
+SOURCE_TABLES_PATH = os.getenv('SOURCE_TABLES_PATH') or None
+
+# Bounds of the Monte Carlo simulations of the mana base simulation API, which
+# stops sampling games once either is reached.
+
+MANA_SIMULATOR = {
+    'GAMES': 1_000_000,
+    'TIME_BUDGET': 1.0,
+}
+
+# Serve the index page and the analysis API with async views, which await the
+# card data instead of blocking a worker while Scryfall responds. Set
+# ASYNC_VIEWS=True when serving how_many.asgi with an ASGI server, e.g.
+# gunicorn -k uvicorn.workers.UvicornWorker how_many.asgi.
+
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '') == 'True'
+
+
+# Every response has a Server-Timing header with the time spent in each phase of
+# the request. Set SERVER_TIMING_LOG=True to also log a JSON line per request.
+
+SERVER_TIMING_LOG = os.getenv('SERVER_TIMING_LOG', '') == 'True'
+
+# Metrics exposed on /metrics in the Prometheus text format. With several worker
+# processes (gunicorn), set METRICS_DIR to a directory shared by the workers and
+# emptied before they start, so that /metrics merges the metrics of every worker.
+
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'decklist_analyzer.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 